@@ -1,13 +1,38 @@
+import time
+# ใช้วัดเวลาเริ่มต้นระบบ (รวมเวลา import OpenCV และโหลดโมเดล)
+import_started = time.perf_counter()
+
 import os
 import gc
 import cv2
 import math
-import time
-import joblib
+import bisect
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+import contextvars
+import tracemalloc
+import multiprocessing
 import numpy as np
 from flask_cors import CORS
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, render_template, send_from_directory, url_for
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, url_for
+from artifacts import ArtifactStore
+from cache import PairCache, ResultCache, content_key, perceptual_hash
+from jobs import JobQueue, QueueFull
+from warp import scratch, rotation_matrix, rotate_window, warp_rotated
+from npmodel import NumpyModel, SklearnModel
+import metrics
+
+try :
+    from flask_sock import Sock
+except ImportError :
+    # โหมดสแกนสด (/live) ต้องใช้ flask-sock ถ้าไม่ได้ติดตั้ง หน้า scanner จะมีแค่แบบถ่ายภาพ
+    Sock = None
 
 app = Flask(__name__)
 CORS(app)
@@ -19,14 +44,194 @@ GENERATED_FOLDER = os.path.join(BASE_DIR, 'static', 'generated')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER) :
-    os.makedirs(UPLOAD_FOLDER)
+def env_bool(name, default) :
+    value = os.environ.get(name)
+    if value is None :
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# ค่าเริ่มต้นไม่บันทึกไฟล์ที่อัปโหลดลงดิสก์ ประมวลผลจากหน่วยความจำทั้งหมด
+app.config['SAVE_UPLOADS'] = env_bool('GIVEMATH_SAVE_UPLOADS', False)
+# ถ้าปิด จะส่งภาพผลลัพธ์กลับไปเป็น data URL แทนการเขียนไฟล์ลง static/generated
+app.config['SAVE_GENERATED'] = env_bool('GIVEMATH_SAVE_GENERATED', True)
+
+def env_int(name, default) :
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+def env_float(name, default) :
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+# แคชผลลัพธ์ตาม hash ของไฟล์: ขนาดในหน่วยความจำ, โฟลเดอร์บนดิสก์ (ว่าง = ไม่ใช้),
+# และระยะ Hamming สูงสุดของ perceptual hash (-1 = ปิด)
+app.config['CACHE_MAX_BYTES'] = env_int('GIVEMATH_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+app.config['CACHE_DIR'] = os.environ.get('GIVEMATH_CACHE_DIR') or None
+app.config['CACHE_DISK_MAX_BYTES'] = env_int('GIVEMATH_CACHE_DISK_MAX_BYTES', 1024 * 1024 * 1024)
+app.config['CACHE_PHASH_DISTANCE'] = env_int('GIVEMATH_CACHE_PHASH_DISTANCE', -1)
+
+# จำนวน process สำหรับ /upload/batch และจำนวนไฟล์สูงสุดต่อหนึ่งคำขอ
+# ทุก gunicorn worker มีพูลของตัวเอง ค่าเริ่มต้นจึงแบ่ง core ให้เท่า ๆ กัน (core // GIVEMATH_WORKERS อย่างน้อย 1)
+# ไม่งั้น workers x BATCH_WORKERS process (แต่ละตัว import OpenCV และโมเดล) จะแย่ง core กันเอง
+app.config['BATCH_WORKERS'] = env_int('GIVEMATH_BATCH_WORKERS',
+                                      max(1, (os.cpu_count() or 1) // max(1, env_int('GIVEMATH_WORKERS', os.cpu_count() or 1))))
+app.config['BATCH_MAX_FILES'] = env_int('GIVEMATH_BATCH_MAX_FILES', 64)
+
+# จำนวนเธรดของ OpenCV ในแต่ละ process (ว่าง = ค่าเริ่มต้นของ OpenCV ซึ่งใช้ทุก core, 0 = ไม่ใช้เธรด)
+# เมื่อรันหลาย gunicorn worker ควรให้ workers x ค่านี้ไม่เกินจำนวน core (ดู loadtest.py)
+app.config['CV_THREADS'] = env_int('GIVEMATH_CV_THREADS', None)
+if app.config['CV_THREADS'] is not None :
+    cv2.setNumThreads(app.config['CV_THREADS'])
+
+# คิวงานของ /jobs: จำนวนเธรดที่ประมวลผล, ความยาวคิวสูงสุด, อายุผลลัพธ์ (วินาที)
+# และโฟลเดอร์เก็บสถานะงาน ให้ถามสถานะจาก gunicorn worker ไหนก็ได้ (ค่าเริ่มต้นอยู่ในโฟลเดอร์ชั่วคราวของระบบ
+# ตั้ง GIVEMATH_JOB_DIR เป็นค่าว่างเพื่อเก็บในหน่วยความจำอย่างเดียว ใช้ได้เฉพาะเมื่อมี process เดียว)
+app.config['JOB_WORKERS'] = env_int('GIVEMATH_JOB_WORKERS', 2)
+app.config['JOB_QUEUE_DEPTH'] = env_int('GIVEMATH_JOB_QUEUE_DEPTH', 16)
+app.config['JOB_TTL'] = env_int('GIVEMATH_JOB_TTL', 600)
+app.config['JOB_DIR'] = os.environ.get('GIVEMATH_JOB_DIR', os.path.join(tempfile.gettempdir(), 'givemath', 'jobs')) or None
+
+# ไฟล์ที่เก็บไว้ใน static/generated และ static/uploads: ขนาดรวมสูงสุดต่อโฟลเดอร์ (ไบต์), อายุ (วินาที)
+# และรอบการกวาดไฟล์หมดอายุ (วินาที) ค่า 0 = ไม่จำกัด / ไม่กวาด
+app.config['ARTIFACT_MAX_BYTES'] = env_int('GIVEMATH_ARTIFACT_MAX_BYTES', 256 * 1024 * 1024)
+app.config['ARTIFACT_TTL'] = env_int('GIVEMATH_ARTIFACT_TTL', 24 * 60 * 60)
+app.config['ARTIFACT_SWEEP_INTERVAL'] = env_int('GIVEMATH_ARTIFACT_SWEEP_INTERVAL', 300)
+
+# ขนาดคำขอสูงสุด (ไบต์) เกินจะตอบ 413, 0 = ไม่จำกัด
+app.config['MAX_CONTENT_LENGTH'] = env_int('GIVEMATH_MAX_UPLOAD_BYTES', 32 * 1024 * 1024) or None
+# ถอดรหัส JPEG แบบย่อขนาด (1/2, 1/4, 1/8) โดยให้ด้านที่สั้นกว่ายังยาวอย่างน้อยเท่านี้ 0 = ถอดรหัสเต็มขนาดเสมอ
+# ปิดไว้โดยค่าเริ่มต้นเพราะเปลี่ยนคำตอบ (ภาพหลังย่อเหลือกว้าง 500px ไม่เหมือนเดิม) แม้ตั้ง 1000 (2 เท่าของ 500px)
+# ดูผลต่อความแม่นยำใน variants ของ bench/baseline.json
+app.config['DECODE_MIN_SIDE'] = env_int('GIVEMATH_DECODE_MIN_SIDE', 0)
+# ขนาดภาพที่รับได้: ภาพที่ header ระบุจำนวนพิกเซลเกิน MAX_IMAGE_PIXELS จะไม่ถอดรหัสเลย
+# และภาพที่ด้านยาวเกิน MAX_IMAGE_SIDE จะถูกย่อหลังถอดรหัส (0 = ไม่จำกัด)
+app.config['MAX_IMAGE_PIXELS'] = env_int('GIVEMATH_MAX_IMAGE_PIXELS', 64 * 1024 * 1024)
+app.config['MAX_IMAGE_SIDE'] = env_int('GIVEMATH_MAX_IMAGE_SIDE', 4096)
+# ภาพที่ด้านยาวยาวกว่าด้านสั้นเกินกี่เท่าจะไม่ประมวลผล (0 = ไม่จำกัด) ภาพถูกย่อให้กว้าง 500px ก่อน
+# ภาพแคบและสูงมาก (เช่น 8x4096) จึงกลายเป็น 500x256000 ใช้หน่วยความจำหลายร้อย MB
+app.config['MAX_ASPECT_RATIO'] = env_float('GIVEMATH_MAX_ASPECT_RATIO', 10.0)
+# บัฟเฟอร์ของแต่ละเธรด (warp.ScratchBuffers) ที่ใหญ่กว่านี้ (ไบต์) จะถูกคืนหลังประมวลผลแต่ละภาพ
+# ภาพขนาดปกติ (กว้าง 500px) ใช้ไม่ถึง 1 MB ต่อบัฟเฟอร์ จึงยังใช้ซ้ำได้
+app.config['SCRATCH_MAX_BYTES'] = env_int('GIVEMATH_SCRATCH_MAX_BYTES', 4 * 1024 * 1024)
+# เรียก gc.collect() หลังคำขอเฉพาะเมื่อ RSS ของ process โตขึ้นเกินค่านี้ (ไบต์) นับจากครั้งก่อน (0 = ไม่เรียกเอง)
+app.config['GC_RSS_THRESHOLD'] = env_int('GIVEMATH_GC_RSS_THRESHOLD', 64 * 1024 * 1024)
+# วัดหน่วยความจำสูงสุดที่ Python / NumPy จองระหว่างแต่ละคำขอด้วย tracemalloc (ทำให้ช้าลง ใช้ตอนตรวจสอบ)
+app.config['TRACEMALLOC'] = env_bool('GIVEMATH_TRACEMALLOC', False)
+if app.config['TRACEMALLOC'] and not tracemalloc.is_tracing() :
+    tracemalloc.start()
+
+# ถ้าเส้นฐานเอียงน้อยกว่ากี่องศาจะไม่หมุนภาพ (0 = หมุนทุกครั้ง ผลเหมือนเดิมทุกภาพ)
+app.config['ROTATE_MIN_DEGREES'] = env_float('GIVEMATH_ROTATE_MIN_DEGREES', 0.0)
+
+# ทางเลือกของขั้นหาเส้น (ปิดไว้ ผลเหมือนเดิม)
+# HOUGH_ROI = ใช้ HoughLinesP เฉพาะในรูปหลายเหลี่ยมของเส้นรอบรูป (ขยายออกข้างละ HOUGH_ROI_PADDING พิกเซล)
+# MERGE_SEGMENTS = รวมเส้นที่อยู่แนวเดียวกันและซ้อน/ต่อกัน (มาจากเส้นเดียวกันในภาพ) ก่อนคัดเลือกเส้น
+app.config['HOUGH_ROI'] = env_bool('GIVEMATH_HOUGH_ROI', False)
+app.config['HOUGH_ROI_PADDING'] = env_int('GIVEMATH_HOUGH_ROI_PADDING', 4)
+app.config['MERGE_SEGMENTS'] = env_bool('GIVEMATH_MERGE_SEGMENTS', False)
+# ใช้เฉพาะเส้นที่ยาวที่สุดไม่เกินกี่เส้นจาก HoughLinesP (ภาพปกติได้ไม่ถึง 150 เส้น, 0 = ไม่จำกัด)
+app.config['MAX_HOUGH_LINES'] = env_int('GIVEMATH_MAX_HOUGH_LINES', 500)
+# จำผลทำนายของโมเดลต่อคู่เส้นใน funcTriangles ไม่ทำนายคู่เดิมซ้ำ
+# PAIR_MEMO_QUANTUM = ปัดพิกัดเส้นเป็นช่วงละกี่พิกเซลก่อนใช้เป็น key (0 = ไม่ใช้, 1 = ต้องตรงกันทุกพิกเซล ผลเหมือนเดิม,
+# มากกว่า 1 = ใช้ผลของคู่เส้นที่ใกล้เคียงกันแทน ผลอาจต่างไปบ้าง)
+# ปิดไว้โดยค่าเริ่มต้น: ใน bench ที่ quantum 1 ไม่มีคู่ซ้ำเลย (0 จาก 82136 คู่) มีแต่ค่าสร้าง key
+# ให้เปิดเมื่อ bench/run.py (บรรทัด pair memo) แสดงว่ามีคู่ที่ใช้ซ้ำได้จริง
+# PAIR_MEMO_SHARED = จำนวนคู่ที่มีด้านของรูปเป็นเส้นหนึ่งที่เก็บไว้ใช้ข้ามคำขอ (0 = จำเฉพาะในภาพเดียวกัน)
+# ใช้ได้เมื่อเปิด PAIR_MEMO_QUANTUM เท่านั้น
+app.config['PAIR_MEMO_QUANTUM'] = env_int('GIVEMATH_PAIR_MEMO_QUANTUM', 0)
+app.config['PAIR_MEMO_SHARED'] = env_int('GIVEMATH_PAIR_MEMO_SHARED', 0)
+# เวลาสูงสุด (วินาที) ที่ให้ประมวลผลหนึ่งภาพ เกินแล้วหยุดและตอบว่าหมดเวลา (0 = ไม่จำกัด)
+# ควรน้อยกว่า timeout ของ gunicorn (GIVEMATH_TIMEOUT) worker จะได้ไม่ถูก kill กลางคำขอ
+app.config['SCAN_TIMEOUT'] = env_float('GIVEMATH_SCAN_TIMEOUT', 10.0)
+
+# รูปแบบผลลัพธ์เริ่มต้น (คำขอเลือกเองได้ด้วย overlay=...)
+# png = ภาพ PNG (ไฟล์ใน static/generated หรือ data URL), webp / jpeg = ภาพบีบอัดเป็น data URL ในคำตอบ
+# geometry = ไม่สร้างภาพ ส่งพิกัดเส้นกับ transform ให้ browser วาดบนภาพของตัวเอง
+app.config['OVERLAY_FORMAT'] = os.environ.get('GIVEMATH_OVERLAY_FORMAT', 'png')
+# คุณภาพของ webp / jpeg (1-100)
+app.config['OVERLAY_QUALITY'] = env_int('GIVEMATH_OVERLAY_QUALITY', 80)
+
+# โหมดสแกนสด (WebSocket /live): นับว่ารูปนิ่งเมื่อมุมทุกมุมขยับไม่เกิน LIVE_TOLERANCE (สัดส่วนของความกว้างภาพ)
+# ติดกัน LIVE_STABLE_FRAMES เฟรม, ขนาดเฟรมสูงสุด (ไบต์) และปิดการเชื่อมต่อที่ไม่ส่งเฟรมมานานเกินกี่วินาที
+app.config['LIVE_STABLE_FRAMES'] = env_int('GIVEMATH_LIVE_STABLE_FRAMES', 5)
+app.config['LIVE_TOLERANCE'] = env_float('GIVEMATH_LIVE_TOLERANCE', 0.02)
+app.config['LIVE_MAX_FRAME_BYTES'] = env_int('GIVEMATH_LIVE_MAX_FRAME_BYTES', 1024 * 1024)
+app.config['LIVE_IDLE_SECONDS'] = env_int('GIVEMATH_LIVE_IDLE_SECONDS', 30)
+# ภายใต้ gunicorn แต่ละการเชื่อมต่อใช้หนึ่งเธรดของ worker ตลอดเวลาที่เปิดอยู่ จึงจำกัดจำนวนการเชื่อมต่อต่อ process
+# ค่าเริ่มต้นเหลือไว้หนึ่งเธรดให้คำขอปกติ (GIVEMATH_THREADS - 1) gunicorn.conf.py ตั้งไว้ 1 เธรด โหมดสแกนสดจึงปิดอยู่
+# เปิดได้ด้วย GIVEMATH_THREADS มากกว่า 1 หรือกำหนด GIVEMATH_LIVE_MAX_SESSIONS เอง (0 = ปิด)
+app.config['LIVE_MAX_SESSIONS'] = env_int('GIVEMATH_LIVE_MAX_SESSIONS', max(env_int('GIVEMATH_THREADS', 1) - 1, 0))
+app.config['SOCK_SERVER_OPTIONS'] = {'max_message_size' : app.config['LIVE_MAX_FRAME_BYTES'], 'ping_interval' : 25}
 
-if not os.path.exists(GENERATED_FOLDER) :
-    os.makedirs(GENERATED_FOLDER)
+generated_store = ArtifactStore(
+    GENERATED_FOLDER,
+    max_bytes=app.config['ARTIFACT_MAX_BYTES'],
+    ttl=app.config['ARTIFACT_TTL'],
+    interval=app.config['ARTIFACT_SWEEP_INTERVAL'],
+)
+upload_store = ArtifactStore(
+    UPLOAD_FOLDER,
+    max_bytes=app.config['ARTIFACT_MAX_BYTES'],
+    ttl=app.config['ARTIFACT_TTL'],
+    interval=app.config['ARTIFACT_SWEEP_INTERVAL'],
+)
 
-scaler1 = joblib.load(os.path.join(BASE_DIR, 'scaler1.pkl'))
-model1 = joblib.load(os.path.join(BASE_DIR, 'model1.pkl'))
+# พารามิเตอร์ของ scaler1 + model1 ที่ export เป็น NumPy แล้ว (python export_model.py)
+app.config['MODEL_NPZ'] = os.environ.get('GIVEMATH_MODEL_NPZ') or os.path.join(BASE_DIR, 'model1.npz')
+
+def model_files() :
+    # ไฟล์ที่ load_line_classifier ใช้ (model1.npz ถ้ามี ไม่งั้น scaler1.pkl + model1.pkl)
+    if os.path.exists(app.config['MODEL_NPZ']) :
+        return [app.config['MODEL_NPZ']]
+    return [os.path.join(BASE_DIR, 'scaler1.pkl'), os.path.join(BASE_DIR, 'model1.pkl')]
+
+def load_line_classifier() :
+    # ใช้ model1.npz ถ้ามี จะได้ไม่ต้องโหลด scikit-learn ไม่งั้นใช้ pickle เดิม
+    if os.path.exists(app.config['MODEL_NPZ']) :
+        return NumpyModel.load(app.config['MODEL_NPZ'])
+
+    import joblib
+    scaler1 = joblib.load(os.path.join(BASE_DIR, 'scaler1.pkl'))
+    model1 = joblib.load(os.path.join(BASE_DIR, 'model1.pkl'))
+    return SklearnModel(scaler1, model1)
+
+model_started = time.perf_counter()
+line_classifier = load_line_classifier()
+
+startup = {
+    'pid' : os.getpid(),
+    'import_seconds' : None,
+    'model_seconds' : time.perf_counter() - model_started,
+    'cv_threads' : cv2.getNumThreads(),
+    'warmup' : None,
+    'ready' : False,
+}
+
+pair_cache = PairCache(app.config['PAIR_MEMO_SHARED'])
+
+# ค่าตั้งที่เปลี่ยนคำตอบได้ (เกณฑ์อื่น ๆ เป็นค่าคงที่ในโค้ด จึงนับรวมโค้ดของ pipeline ด้วย)
+RESULT_CONFIG_KEYS = ('DECODE_MIN_SIDE', 'MAX_IMAGE_SIDE', 'MAX_ASPECT_RATIO', 'ROTATE_MIN_DEGREES', 'HOUGH_ROI',
+                      'HOUGH_ROI_PADDING', 'MERGE_SEGMENTS', 'MAX_HOUGH_LINES', 'PAIR_MEMO_QUANTUM')
+
+def result_version() :
+    # fingerprint ของทุกอย่างที่กำหนดคำตอบ: โมเดล ค่าตั้ง โค้ด และเวอร์ชัน OpenCV
+    # แคชบนดิสก์แยกโฟลเดอร์ตามค่านี้ เปลี่ยนโมเดลหรือค่าตั้งแล้วจะไม่ได้คำตอบเก่า
+    digest = hashlib.sha256()
+    digest.update(json.dumps({key : app.config[key] for key in RESULT_CONFIG_KEYS}, sort_keys=True).encode('utf-8'))
+    digest.update(cv2.__version__.encode('ascii'))
+    for path in [os.path.abspath(__file__), os.path.join(BASE_DIR, 'npmodel.py')] + model_files() :
+        if os.path.exists(path) :
+            with open(path, 'rb') as f :
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+result_cache = ResultCache(
+    app.config['CACHE_MAX_BYTES'],
+    version=result_version(),
+    disk_dir=app.config['CACHE_DIR'],
+    disk_max_bytes=app.config['CACHE_DISK_MAX_BYTES'],
+    phash_distance=app.config['CACHE_PHASH_DISTANCE'],
+)
 
 def show_image(image) :
     cv2.imshow('image', image)
@@ -94,6 +299,104 @@ def slope(line) :
     
     return (y2 - y1) / (x2 - x1)
 
+def line_pair_features(line1, lines2) :
+    # คำนวณ feature ของเส้น line1 เทียบกับทุกเส้นใน lines2 พร้อมกัน (หนึ่งแถวต่อหนึ่งคู่)
+    # ให้ผลเหมือนการเรียก line_length, angle_between_lines, cosine_similarity,
+    # endpoint_distance และ slope ทีละคู่
+    x1, y1, x2, y2 = [float(v) for v in line1]
+    other = np.asarray(lines2, dtype=np.float64).reshape(-1, 4)
+    fx1, fy1, fx2, fy2 = other.T
+
+    length1 = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    length2 = np.sqrt((fx2 - fx1) ** 2 + (fy2 - fy1) ** 2)
+    length_diff = np.abs(length1 - length2)
+
+    # angle_between_lines เรียงจุดปลายจากซ้ายไปขวาก่อน
+    if x1 > x2 :
+        vx, vy = x1 - x2, y1 - y2
+    else :
+        vx, vy = x2 - x1, y2 - y1
+    flip = fx1 > fx2
+    wx = np.where(flip, fx1 - fx2, fx2 - fx1)
+    wy = np.where(flip, fy1 - fy2, fy2 - fy1)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        cos_theta = (vx * wx + vy * wy) / (np.sqrt(vx ** 2 + vy ** 2) * np.sqrt(wx ** 2 + wy ** 2))
+        angle_diff = np.degrees(np.arccos(np.clip(cos_theta, -1.0, 1.0)))
+
+        # cosine_similarity ใช้ทิศทางเดิมของเส้น
+        cos_sim = ((x2 - x1) * (fx2 - fx1) + (y2 - y1) * (fy2 - fy1)) / (length1 * length2)
+
+    d1 = np.sqrt((x1 - fx1) ** 2 + (y1 - fy1) ** 2)
+    d3 = np.sqrt((x2 - fx1) ** 2 + (y2 - fy1) ** 2)
+    d4 = np.sqrt((x2 - fx2) ** 2 + (y2 - fy2) ** 2)
+    endpoint_dist = np.minimum(np.minimum(d1, d3), d4)
+
+    slope1 = slope(line1)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        slope2 = np.where(fx2 == fx1, 1e6, (fy2 - fy1) / (fx2 - fx1))
+    slope_diff = np.abs(slope1 - slope2)
+
+    features = np.empty((len(other), 13))
+    features[:, 0:4] = other
+    features[:, 4:8] = (x1, y1, x2, y2)
+    features[:, 8] = length_diff
+    features[:, 9] = angle_diff
+    features[:, 10] = cos_sim
+    features[:, 11] = endpoint_dist
+    features[:, 12] = slope_diff
+
+    return features
+
+def classify_line_pairs(line1, lines2) :
+    # ทำนายทุกคู่ (line2, line1) ด้วยการเรียก scaler1/model1 ครั้งเดียว
+    if len(lines2) == 0 :
+        return np.empty(0, dtype=int)
+
+    metrics.count('model_calls')
+    metrics.count('model_pairs', len(lines2))
+    return line_classifier.predict(line_pair_features(line1, lines2))
+
+class LinePairMemo :
+    # ผลทำนายของ classify_line_pairs ที่ได้แล้วในภาพหนึ่ง key = พิกัดของ (line1, line2) หารปัดลงด้วย quantum
+    # คู่ที่ line2 เป็นด้านของรูป (sides ตัวแรกของ lines2) จะถามและเก็บใน shared (PairCache) ด้วย
+    # เพราะด้านของรูปเดิมกลับมาอีกเมื่อภาพเดิมหรือภาพที่เกือบเหมือนกันถูกส่งมาใหม่ (เช่นหลายเฟรมในโหมดสแกนสด)
+    def __init__(self, quantum, shared=None) :
+        self.quantum = quantum
+        self.shared = shared
+        self.entries = {}
+
+    def key(self, line1, line2) :
+        return tuple(int(v) // self.quantum for v in (*line1, *line2))
+
+    def predict(self, line1, lines2, sides=0) :
+        if not self.quantum :
+            return classify_line_pairs(line1, lines2)
+
+        keys = [self.key(line1, line2) for line2 in lines2]
+        predictions = [self.entries.get(key) for key in keys]
+        hits = sum(p is not None for p in predictions)
+        shared_hits = 0
+        if self.shared is not None :
+            for i in range(min(sides, len(keys))) :
+                if predictions[i] is None :
+                    predictions[i] = self.shared.get(keys[i])
+                    if predictions[i] is not None :
+                        self.entries[keys[i]] = predictions[i]
+                        shared_hits += 1
+
+        missing = [i for i, p in enumerate(predictions) if p is None]
+        metrics.count('memo_hits', hits)
+        metrics.count('memo_shared_hits', shared_hits)
+        metrics.count('memo_misses', len(missing))
+        if missing :
+            predicted = classify_line_pairs(line1, [lines2[i] for i in missing]).tolist()
+            for i, value in zip(missing, predicted) :
+                predictions[i] = value
+                self.entries[keys[i]] = value
+                if self.shared is not None and i < sides :
+                    self.shared.put(keys[i], value)
+        return np.array(predictions)
+
 def findMainContours(image, threshold) :
     contours, _ = cv2.findContours(threshold, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -140,29 +443,270 @@ def is_vertically_overlapping(line1, line2, x_thresh=5) :
     
     return not (y_max1 < y_min2 or y_max2 < y_min1)
 
+class OverlapIndex :
+    # เส้นที่รับไว้แล้ว เรียงตามค่าเฉลี่ยของพิกัดแกนหนึ่ง (y ของเส้นแนวนอน, x ของเส้นแนวตั้ง)
+    # เส้นที่ค่าเฉลี่ยห่างกันเกิน thresh ไม่มีทางซ้อนทับกัน จึงตรวจเฉพาะเส้นในช่วงนั้นด้วย bisect
+    # ผลเหมือนเรียก is_horizontally_overlapping (axis=1) / is_vertically_overlapping (axis=0) กับทุกเส้น
+    def __init__(self, axis, thresh, lines=()) :
+        self.axis = axis
+        self.thresh = thresh
+        self.keys = []
+        self.spans = []
+        for line in lines :
+            self.add(line)
+
+    def _key_span(self, line) :
+        a, b = line[self.axis], line[self.axis + 2]
+        c, d = line[1 - self.axis], line[3 - self.axis]
+        return float((a + b) / 2), (min(c, d), max(c, d))
+
+    def add(self, line) :
+        key, span = self._key_span(line)
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.spans.insert(i, span)
+
+    def overlaps(self, line) :
+        key, (low, high) = self._key_span(line)
+        start = bisect.bisect_left(self.keys, key - self.thresh)
+        stop = bisect.bisect_right(self.keys, key + self.thresh, lo=start)
+        for span_low, span_high in self.spans[start:stop] :
+            if not (high < span_low or span_high < low) :
+                return True
+        return False
+
 def rotate_image(image, line) :
-    x1, y1, x2, y2 = line
-    angle_rad = math.atan2(y2 - y1, x2 - x1)
-    angle_deg = math.degrees(angle_rad)
-    
-    height, width = image.shape[:2]
-    center = (width // 2, height // 2)
-    
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle_deg, 1.0)
-    
-    cos = abs(rotation_matrix[0, 0])
-    sin = abs(rotation_matrix[0, 1])
-    new_width = int((height * sin) + (width * cos))
-    new_height = int((height * cos) + (width * sin))
-    
-    rotation_matrix[0, 2] += (new_width / 2) - center[0]
-    rotation_matrix[1, 2] += (new_height / 2) - center[1]
-    
-    rotated = cv2.warpAffine(image, rotation_matrix, (new_width, new_height), borderValue=(255, 255, 255))
+    matrix, size = rotation_matrix(image.shape, line)
+    rotated = cv2.warpAffine(image, matrix, size, borderValue=(255, 255, 255))
     
     return rotated
 
-def funcTriangles(image, threshold, approx) :
+def crop_rotated(image, line, contour, min_degrees=0.0, padding=24, margin=10, guard=8) :
+    # ได้ผลเหมือน rotate_image(image, line) -> หาเส้นรอบรูปใหม่ -> ตัดกรอบขยายข้างละ margin
+    # แต่หมุนพิกัดของ contour เดิมเพื่อประมาณตำแหน่งก่อน แล้ว warp / หาขอบเฉพาะหน้าต่างรอบ ๆ (ขยายข้างละ padding)
+    # ถ้าเส้นรอบรูปที่เจอชนขอบหน้าต่างจะทำทั้งภาพแบบเดิม
+    # คืน (ภาพที่ตัดแล้ว, matrix 2x3 จากพิกัดพิกเซลของ image ไปเป็นพิกัดในภาพที่ตัด)
+    x1, y1, x2, y2 = line
+    rotated = None
+    matrix, (new_width, new_height) = rotation_matrix(image.shape, line)
+    # มุมเป็น 0 แต่ภาพมีด้านที่ยาวเป็นเลขคี่ matrix จะเลื่อนภาพครึ่งพิกเซล จึงข้ามได้เฉพาะเมื่อไม่เปลี่ยนภาพจริง ๆ
+    identity = np.array_equal(matrix, np.eye(2, 3)) and (new_height, new_width) == image.shape[:2]
+    if identity or abs(math.degrees(math.atan2(y2 - y1, x2 - x1))) < min_degrees :
+        # ไม่หมุน
+        matrix = None
+        rotated = image
+        new_height, new_width = image.shape[:2]
+        points = contour
+    else :
+        points = np.rint(cv2.transform(contour.astype(np.float64), matrix)).astype(np.int32)
+
+    x, y, w, h = cv2.boundingRect(points)
+    left, top = max(x - padding, 0), max(y - padding, 0)
+    right, bottom = min(x + w + padding, new_width), min(y + h + padding, new_height)
+    if rotated is None and (right - left) * (bottom - top) * 2 > new_width * new_height :
+        # หน้าต่างกินพื้นที่เกินครึ่งภาพ warpAffine ทั้งภาพเร็วกว่าคำนวณ map เอง
+        rotated = warp_rotated(image, matrix, (new_width, new_height))
+
+    while True :
+        if rotated is not None :
+            window = rotated[top:bottom, left:right]
+        else :
+            window = rotate_window(image, matrix, left, top, right, bottom, 'rotated_window')
+        # ขั้นนี้ของเดิมใช้ medianBlur อย่างเดียว (ผลของ GaussianBlur ถูกเขียนทับ)
+        threshold = find_edges(window, 0, 3, 7, 'window')
+        main_contour = findMainContours(window, threshold)
+        whole = (left, top, right, bottom) == (0, 0, new_width, new_height)
+        if main_contour is not None :
+            # ขอบหน้าต่างที่ไม่ใช่ขอบภาพทำให้ผลของ filter ใกล้ขอบต่างจากทั้งภาพ (ไม่เกิน guard พิกเซล)
+            x, y, w, h = cv2.boundingRect(main_contour)
+            near_edge = ((x < guard and left > 0) or (y < guard and top > 0) or
+                         (x + w > right - left - guard and right < new_width) or
+                         (y + h > bottom - top - guard and bottom < new_height))
+            if not near_edge :
+                break
+        if whole :
+            raise ScanError('contour', 'outline lost after rotation')
+        left, top, right, bottom = 0, 0, new_width, new_height
+        if rotated is None :
+            rotated = warp_rotated(image, matrix, (new_width, new_height))
+    x, y = x + left, y + top
+
+    # ตัดแบบเดียวกับ slicing ของ numpy บนภาพที่หมุนทั้งภาพ (ค่าติดลบนับจากท้าย, เกินขอบถูกตัดออก)
+    crop_top, crop_bottom, _ = slice(y - margin, y + h + margin).indices(new_height)
+    crop_left, crop_right, _ = slice(x - margin, x + w + margin).indices(new_width)
+    crop_matrix = (np.eye(2, 3) if matrix is None else matrix) - [[0, 0, crop_left], [0, 0, crop_top]]
+    if rotated is not None :
+        crop = rotated[crop_top:crop_bottom, crop_left:crop_right]
+    elif left <= crop_left and top <= crop_top and crop_right <= right and crop_bottom <= bottom :
+        crop = window[crop_top - top:crop_bottom - top, crop_left - left:crop_right - left]
+    else :
+        crop = rotate_window(image, matrix, crop_left, crop_top, crop_right, crop_bottom, 'rotated_crop')
+    return crop, crop_matrix
+
+def crop_transform(resized_shape, crop_matrix, crop_shape, final_shape) :
+    # affine 2x3 จากพิกัดบนภาพต้นฉบับแบบ normalize (0..1) ไปเป็นพิกัดบนภาพที่ใช้นับ (กว้าง 256)
+    # ใช้พิกัดแบบ canvas (พิกเซล i ครอบคลุม i ถึง i + 1) ซึ่ง resize เป็นแค่การคูณสเกล
+    # ส่วน warpAffine ใช้พิกัดกึ่งกลางพิกเซล จึงเลื่อนครึ่งพิกเซลก่อนและหลัง
+    def affine(a, b, c, d, e, f) :
+        return np.array([[a, b, c], [d, e, f], [0, 0, 1]], dtype=np.float64)
+
+    to_resized = affine(resized_shape[1], 0, 0, 0, resized_shape[0], 0)
+    rotate = affine(1, 0, 0.5, 0, 1, 0.5) @ np.vstack([crop_matrix, [0, 0, 1]]) @ affine(1, 0, -0.5, 0, 1, -0.5)
+    to_final = affine(final_shape[1] / crop_shape[1], 0, 0, 0, final_shape[0] / crop_shape[0], 0)
+    return (to_final @ rotate @ to_resized)[:2]
+
+def find_edges(image, blur, median, close, name) :
+    # GaussianBlur (ถ้า blur > 0) -> medianBlur (ถ้า median > 0) -> ภาพเทา -> Canny -> morphology close
+    # เขียนผลแต่ละขั้นลงบัฟเฟอร์ของเธรด ผลที่คืนจะถูกเขียนทับในการเรียกครั้งถัดไปที่ใช้ name เดียวกัน
+    rows, cols = image.shape[:2]
+    blurred = image
+    if blur :
+        blurred = cv2.GaussianBlur(blurred, (blur, blur), 0, dst=scratch.get(name + '_blurred', image.shape))
+    if median :
+        blurred = cv2.medianBlur(blurred, median, dst=scratch.get(name + '_median', image.shape))
+    gray = cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY, dst=scratch.get(name + '_gray', (rows, cols)))
+    edges = cv2.Canny(gray, 50, 150, edges=scratch.get(name + '_edges', (rows, cols)), apertureSize=3)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (close, close))
+    return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, dst=scratch.get(name + '_threshold', (rows, cols)))
+
+def shrink_horizontal_lines(horizontal_lines) :
+    # บีบเส้นแนวนอนให้แคบเพื่อไม่ให้แตะกับสองเส้นที่โอบด้านข้าง คืน x1, y1, x2, y2 รูป (H, 1)
+    H = np.asarray(horizontal_lines, dtype=np.float64).reshape(-1, 4)
+    return H[:, 0:1] + 15, H[:, 1:2] - 5, H[:, 2:3] - 15, H[:, 3:4] - 5
+
+def count_dividing_crossings(horizontal_lines, dividing_lines) :
+    # นับว่าเส้น d แต่ละเส้นตัดเส้น h (ที่บีบแล้ว) แต่ละเส้นหรือไม่ คำนวณทุกคู่ (H, D) พร้อมกัน
+    if len(horizontal_lines) == 0 or len(dividing_lines) == 0 :
+        return np.zeros(len(horizontal_lines), dtype=int)
+
+    x1, y1, x2, y2 = shrink_horizontal_lines(horizontal_lines)
+    dx1, dy1, dx2, dy2 = np.asarray(dividing_lines, dtype=np.float64).reshape(-1, 4).T
+
+    with np.errstate(all='ignore') :
+        # หาความชันและ c ตามสมการ y = mx + c ของเส้น h และเส้น d (เส้นตั้งฉากมีความชันเป็น inf)
+        mh = np.where(x2 - x1 != 0, (y2 - y1) / (x2 - x1), np.inf)
+        ch = y1 - mh * x1
+        m = np.where(dx2 - dx1 != 0, (dy2 - dy1) / (dx2 - dx1), np.inf)
+        c = dy1 - (m * dx1)
+
+        # y = mx + c --(1)
+        # y = mhx + ch --(2)
+        # x = (ch - c) / (m - mh) --(3)
+        vertical = m == np.inf
+        new_dx = np.where(vertical, dx1, (ch - c) / (m - mh))
+        new_dy = np.where(vertical, mh * new_dx + ch, m * new_dx + c)
+
+    # เส้นขนานกัน (m == mh) ไม่ตัดกัน
+    crossing = m != mh
+
+    # new_dx, new_dy ปัดเศษแบบ int() แล้วต้องอยู่ระหว่างจุดปลายของเส้นแนวนอน
+    # ถ้าค่าเป็น inf/nan ที่ int() แปลงไม่ได้ ให้ผิดพลาดเหมือนเดิม
+    if not np.isfinite(new_dx[crossing]).all() :
+        raise ValueError('cannot convert intersection x to integer')
+    in_x = crossing & (np.minimum(x1, x2) <= np.trunc(new_dx)) & (np.trunc(new_dx) <= np.maximum(x1, x2))
+    if not np.isfinite(new_dy[in_x]).all() :
+        raise ValueError('cannot convert intersection y to integer')
+    in_y = (np.minimum(y1, y2) <= np.trunc(new_dy)) & (np.trunc(new_dy) <= np.maximum(y1, y2))
+
+    return np.count_nonzero(in_x & in_y, axis=1)
+
+def count_vertical_crossings(horizontal_lines, vertical_lines) :
+    # นับเส้นแนวตั้งที่ vx1 อยู่ระหว่าง x1 กับ x2 ของเส้น h (ที่บีบแล้ว) ทุกคู่ (H, V) พร้อมกัน
+    if len(horizontal_lines) == 0 or len(vertical_lines) == 0 :
+        return np.zeros(len(horizontal_lines), dtype=int)
+
+    x1, _, x2, _ = shrink_horizontal_lines(horizontal_lines)
+    vx1 = np.asarray(vertical_lines, dtype=np.float64).reshape(-1, 4)[:, 0]
+
+    return np.count_nonzero((np.minimum(x1, x2) <= vx1) & (vx1 <= np.maximum(x1, x2)), axis=1)
+
+def line_list(lines) :
+    # พิกัดเส้นเป็น int ของ Python (ส่งเป็น JSON ได้)
+    return [[int(v) for v in line] for line in lines]
+
+def merge_collinear_segments(lines, angle_tol=3.0, distance_tol=3.0, gap_tol=10.0) :
+    # รวมเส้นที่มุมต่างกันไม่เกิน angle_tol องศา ปลายทั้งสองห่างจากแนวเส้นไม่เกิน distance_tol พิกเซล
+    # และซ้อนหรือเว้นช่องไม่เกิน gap_tol พิกเซล เป็นเส้นเดียว
+    # lines เรียงจากยาวไปสั้น เส้นแรกของแต่ละกลุ่มเป็นแกน แล้วยืดแกนให้ครอบคลุมทุกเส้นในกลุ่ม
+    if len(lines) < 2 :
+        return lines
+    segments = np.asarray(lines, dtype=np.float64)
+    origin = segments[:, :2]
+    delta = segments[:, 2:] - origin
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    direction = delta / np.where(length > 0, length, 1)[:, None]
+
+    # ค่าของทุกคู่ [แกน i, เส้น j] ในพิกัดตามแนวเส้น i: ระยะตามแนว (t) และระยะตั้งฉาก (d) ของปลายทั้งสองของ j
+    ux, uy = direction[:, 0:1], direction[:, 1:2]
+    rel1 = segments[None, :, :2] - origin[:, None, :]
+    rel2 = segments[None, :, 2:] - origin[:, None, :]
+    t1 = rel1[..., 0] * ux + rel1[..., 1] * uy
+    t2 = rel2[..., 0] * ux + rel2[..., 1] * uy
+    d1 = np.abs(rel1[..., 1] * ux - rel1[..., 0] * uy)
+    d2 = np.abs(rel2[..., 1] * ux - rel2[..., 0] * uy)
+    parallel = np.abs(direction @ direction.T) >= math.cos(math.radians(angle_tol))
+    compatible = parallel & (d1 <= distance_tol) & (d2 <= distance_tol)
+    t_low, t_high = np.minimum(t1, t2), np.maximum(t1, t2)
+
+    anchors = []
+    extent = {}
+    for j in range(len(segments)) :
+        merged = False
+        for i in anchors :
+            if not compatible[i, j] :
+                continue
+            low, high = extent[i]
+            if t_low[i, j] <= high + gap_tol and t_high[i, j] >= low - gap_tol :
+                extent[i] = (min(low, t_low[i, j]), max(high, t_high[i, j]))
+                merged = True
+                break
+        if not merged :
+            anchors.append(j)
+            extent[j] = (0.0, length[j])
+
+    merged_lines = []
+    for i in anchors :
+        low, high = extent[i]
+        x1, y1 = np.rint(origin[i] + direction[i] * low).astype(int).tolist()
+        x2, y2 = np.rint(origin[i] + direction[i] * high).astype(int).tolist()
+        merged_lines.append((x1, y1, x2, y2) if (y1 < y2) or (y1 == y2 and x1 < x2) else (x2, y2, x1, y1))
+    return sorted(merged_lines, key=lambda line: line_length(line), reverse=True)
+
+def hough_segments(threshold, approx) :
+    # เส้นจาก HoughLinesP ในรูป (x1, y1, x2, y2) ที่จุดแรกอยู่บน เรียงจากยาวไปสั้น
+    next_stage('hough')
+    if app.config['HOUGH_ROI'] :
+        # ปิดขอบที่อยู่นอกรูป เส้นที่จุดกึ่งกลางอยู่นอกรูปถูกตัดทิ้งในขั้นคัดเลือกอยู่แล้ว
+        mask = scratch.get('roi_mask', threshold.shape)
+        mask.fill(0)
+        cv2.fillPoly(mask, [approx], 255)
+        padding = app.config['HOUGH_ROI_PADDING']
+        if padding > 0 :
+            cv2.polylines(mask, [approx], True, 255, 2 * padding + 1)
+        threshold = cv2.bitwise_and(threshold, mask, dst=scratch.get('roi_edges', threshold.shape))
+    lines = cv2.HoughLinesP(threshold, 2, np.pi / 180, threshold=50, minLineLength=0, maxLineGap=10)
+    metrics.count('hough_lines', 0 if lines is None else len(lines))
+    if lines is None :
+        # เดิม func1 ล้มเหลวเมื่อไม่มีเส้นเลย ไม่ตอบจากด้านของรูปอย่างเดียว
+        raise ScanError('hough', 'no line segments found')
+
+    lines = [
+        (x1, y1, x2, y2) if (y1 < y2) or (y1 == y2 and x1 < x2) else (x2, y2, x1, y1)
+        for [[x1, y1, x2, y2]] in lines
+    ]
+    lines = sorted(lines, key=lambda line: line_length(line), reverse=True)
+    max_lines = app.config['MAX_HOUGH_LINES']
+    if max_lines and len(lines) > max_lines :
+        # ภาพที่มีขอบจำนวนมาก (เช่นพื้นหลังลวดลาย) ทำให้ขั้นคัดเลือกเส้นช้ามาก เก็บเฉพาะเส้นที่ยาวที่สุด
+        metrics.count('hough_lines_dropped', len(lines) - max_lines)
+        lines = lines[:max_lines]
+
+    if app.config['MERGE_SEGMENTS'] :
+        next_stage('merge')
+        lines = merge_collinear_segments(lines)
+    return lines
+
+def funcTriangles(image, threshold, approx, draw=True) :
     vertices = [tuple(point[0]) for point in approx]
 
     sides = [(vertices[i][0], vertices[i][1], vertices[(i + 1) % len(vertices)][0], vertices[(i + 1) % len(vertices)][1])
@@ -175,84 +719,66 @@ def funcTriangles(image, threshold, approx) :
     if base[0] > base[2] :
         base = (base[2], base[3], base[0], base[1])
     other_sides = [sides[i] for i in range(len(vertices)) if i != base_index]
+    memo = LinePairMemo(app.config['PAIR_MEMO_QUANTUM'], pair_cache)
 
-    lines = cv2.HoughLinesP(threshold, 2, np.pi / 180, threshold=50, minLineLength=0, maxLineGap=10)
+    lines = hough_segments(threshold, approx)
 
-    lines = [
-        (x1, y1, x2, y2) if (y1 < y2) or (y1 == y2 and x1 < x2) else (x2, y2, x1, y1)
-        for [[x1, y1, x2, y2]] in lines
-    ]
-    
-    lines = sorted(lines, key=lambda line: line_length(line), reverse=True)
+    next_stage('classify')
     
     horizontal_lines = []
     dividing_lines = []
     
     horizontal_lines.append(base)
+    horizontal_index = OverlapIndex(1, 6, horizontal_lines)
     
     for side in other_sides :
         dividing_lines.append(side)
     
-    if lines is not None :
-        for line1 in lines :
-            if line_length(line1) < line_length(base) / 20 :
-                continue
-            keep = True
-            hor = None
-            x1, y1, x2, y2 = line1
-            
-            if cv2.pointPolygonTest(np.array(approx), (float((x1 + x2) / 2), float((y1 + y2) / 2)), False) >= 0 :
-                if abs(y1 - y2) <= 10 :
-                    hor = True
-                    for line2 in horizontal_lines :
-                        fx1, fy1, fx2, fy2 = line2
-                
-                        length_diff = abs(line_length(line1) - line_length(line2))
-                        angle_diff = angle_between_lines(line1, line2)
-                        cos_sim = cosine_similarity(line1, line2)
-                        endpoint_dist = endpoint_distance(line1, line2)
-                        slope_diff = abs(slope(line1) - slope(line2))
-                
-                        input_data = [[fx1, fy1, fx2, fy2, x1, y1, x2, y2, length_diff, angle_diff, cos_sim, endpoint_dist, slope_diff]]
-                        input_data = scaler1.transform(input_data)
-                        prediction = model1.predict(input_data)
-
-                        if prediction[0] == 0 or is_horizontally_overlapping(line1, line2) :
-                            keep = False
-                            break
+    for line1 in lines :
+        check_deadline()
+        if line_length(line1) < line_length(base) / 20 :
+            continue
+        keep = True
+        hor = None
+        x1, y1, x2, y2 = line1
+        
+        if cv2.pointPolygonTest(np.array(approx), (float((x1 + x2) / 2), float((y1 + y2) / 2)), False) >= 0 :
+            if abs(y1 - y2) <= 10 :
+                hor = True
+                # ตัดทิ้งถ้าซ้อนทับเส้นแนวนอนเดิม (ไม่ต้องเรียกโมเดล)
+                # หรือทำนายกับเส้นแนวนอนทุกเส้นในครั้งเดียวแล้วมีคู่ไหนได้ 0
+                if horizontal_index.overlaps(line1) :
+                    keep = False
+                elif np.any(memo.predict(line1, horizontal_lines, 1) == 0) :
+                    keep = False
+            else :
+                hor = False
+                prediction = memo.predict(line1, dividing_lines, len(other_sides))
+                if np.any(prediction == 0) :
+                    keep = False
+                    
+            if keep :
+                if hor :
+                    horizontal_lines.append(line1)
+                    horizontal_index.add(line1)
                 else :
-                    hor = False
-                    for line2 in dividing_lines :
-                        fx1, fy1, fx2, fy2 = line2
-                        
-                        length_diff = abs(line_length(line1) - line_length(line2))
-                        angle_diff = angle_between_lines(line1, line2)
-                        cos_sim = cosine_similarity(line1, line2)
-                        endpoint_dist = endpoint_distance(line1, line2)
-                        slope_diff = abs(slope(line1) - slope(line2))
-                        
-                        input_data = [[fx1, fy1, fx2, fy2, x1, y1, x2, y2, length_diff, angle_diff, cos_sim, endpoint_dist, slope_diff]]
-                        input_data = scaler1.transform(input_data)
-                        prediction = model1.predict(input_data)
-                        
-                        if prediction[0] == 0 :
-                            keep = False
-                            break
-                        
-                if keep :
-                    if hor :
-                        horizontal_lines.append(line1)
-                    else :
-                        dividing_lines.append(line1)
-    
-    # วาดเส้นลงบนภาพที่จะใช้แสดงในกรอบ
-    ret_image = image.copy()
-    for x1, y1, x2, y2 in horizontal_lines :
-        cv2.line(ret_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
-    for x1, y1, x2, y2 in dividing_lines :
-        cv2.line(ret_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
+                    dividing_lines.append(line1)
+    metrics.count('lines_kept', len(horizontal_lines) + len(dividing_lines) - len(sides))
+    
+    kept_lines = {'horizontal_lines' : line_list(horizontal_lines), 'dividing_lines' : line_list(dividing_lines)}
+    
+    # วาดเส้นลงบนภาพที่จะใช้แสดงในกรอบ (ไม่วาดถ้า browser วาดเองจากพิกัดเส้น)
+    ret_image = None
+    if draw :
+        next_stage('draw')
+        ret_image = image.copy()
+        for x1, y1, x2, y2 in horizontal_lines :
+            cv2.line(ret_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        for x1, y1, x2, y2 in dividing_lines :
+            cv2.line(ret_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
     
     # ทำให้อยู่ในฟอร์มของ (xซ้าย, yซ้าย, xขวา, yขวา)
+    next_stage('count')
     horizontal_lines = [[x1, y1, x2, y2] if (x1 < x2) or (x1 == x2 and y1 < y2) else [x2, y2, x1, y1]
     for [x1, y1, x2, y2] in horizontal_lines]
 
@@ -265,61 +791,16 @@ def funcTriangles(image, threshold, approx) :
     
     # การนับ จะนับเส้น dividing_lines ที่ผ่านเส้น horizontal_lines แต่ละเส้น โดยไม่นับสองฝั่งด้านข้าง (บวกเพิ่มทีหลัง)
 
-    for h in horizontal_lines :
-        x1, y1, x2, y2 = h
-        y1 -= 5
-        y2 -= 5
-        x1 += 15
-        x2 -= 15
-        
-        # หาความชันของเส้น h
-        mh = (y2 - y1) / (x2 - x1) if x2 - x1 != 0 else float('inf')
-        
-        # หา ch ตามสมการ y = mx + c
-        ch = y1 - mh * x1
-        
-        number_of_dividing = 0
-        
-        for d in dividing_lines :
-            dx1, dy1, dx2, dy2 = d
-            
-            # หาความชันของเส้น d
-            m = (dy2 - dy1) / (dx2 - dx1) if dx2 - dx1 != 0 else float('inf')
-            
-            # หา cd ตามสมการ y = mx + c
-            c = dy1 - (m * dx1)
-            
-            # y = mx + c --(1)
-            # y = mhx + ch --(2)
-            
-            # นำสองสมการมาลบกัน
-            # 0 = x(m - mh) + (c + ch) --((1) - (2))
-            # ch - c = x(m - mh)
-            # x = (ch - c) / (m - mh) --(3)
-            
-            if m != mh :
-                # หา new_dx ซึ่งก็คือการหา x จากสมการ (3) [x ของจุดที่สองเส้นตัดกัน]
-                new_dx = (ch - c) / (m - mh) if m != float('inf') else dx1
-                
-                # หา new_dy โดยแทน new_dx เข้าไปในสมการ (1)
-                new_dy = m * new_dx + c if m != float('inf') else mh * new_dx + ch
-                
-                # เช็กเงื่อนไข
-                # new_dx ต้องอยู่ระหว่างจุดปลายสองจุดของเส้นแนวนอน
-                # new_dy ต้องอยู่ระหว่างจุดปลายสองจุดของเส้นแนวนอน
-                # ถ้าครบ 2 เงื่อนไข แปลว่า (new_dx, new_dy) คือจุดที่เส้น h และ d ตัดกัน
-                if min(x1, x2) <= int(new_dx) <= max(x1, x2) and min(y1, y2) <= int(new_dy) <= max(y1, y2) :
-                    number_of_dividing += 1
-        
+    for number_of_dividing in count_dividing_crossings(horizontal_lines, dividing_lines).tolist() :
         # บันทึกใน list ว่าเส้น h นี้มีเส้น d ให้เลือกกี่เส้น
         base_info.append(number_of_dividing + 2)
 
         # บวกเพิ่มในคำตอบรวม
         all_triangles += ((number_of_dividing + 1) * (number_of_dividing + 2)) / 2
     
-    return 'triangle', all_triangles, base_info, ret_image
+    return 'triangle', all_triangles, base_info, ret_image, kept_lines
 
-def funcRectangles(image, threshold, approx) :
+def funcRectangles(image, threshold, approx, draw=True) :
     vertices = [tuple(point[0]) for point in approx]
     
     sides = [(vertices[i][0], vertices[i][1], vertices[(i + 1) % len(vertices)][0], vertices[(i + 1) % len(vertices)][1])
@@ -327,13 +808,9 @@ def funcRectangles(image, threshold, approx) :
     sides = [(x1, y1, x2, y2) if y1 < y2 or (y1 == y2 and x1 < x2) else (x2, y2, x1, y1)
             for x1, y1, x2, y2 in sides]
 
-    lines = cv2.HoughLinesP(threshold, 2, np.pi / 180, threshold=50, minLineLength=0, maxLineGap=10)
-    lines = [
-        (x1, y1, x2, y2) if (y1 < y2) or (y1 == y2 and x1 < x2) else (x2, y2, x1, y1)
-        for [[x1, y1, x2, y2]] in lines
-    ]
-    
-    lines = sorted(lines, key=lambda line: line_length(line), reverse=True)
+    lines = hough_segments(threshold, approx)
+
+    next_stage('dedup')
     
     horizontal_lines = []
     vertical_lines = []
@@ -344,33 +821,32 @@ def funcRectangles(image, threshold, approx) :
             horizontal_lines.append(side)
         else :
             vertical_lines.append(side)
+    horizontal_index = OverlapIndex(1, 6, horizontal_lines)
+    vertical_index = OverlapIndex(0, 5, vertical_lines)
     
     # นับและแยกเส้นแนวตั้ง-แนวนอน
-    if lines is not None :
-        for line1 in lines :
-            keep = True
-            hor = None
-            x1, y1, x2, y2 = line1
+    for line1 in lines :
+        check_deadline()
+        keep = True
+        hor = None
+        x1, y1, x2, y2 = line1
+        
+        if cv2.pointPolygonTest(np.array(approx), (float((x1 + x2) / 2), float((y1 + y2) / 2)), False) >= 0 :
+            if abs(y1 - y2) <= 20 :
+                hor = True
+                keep = not horizontal_index.overlaps(line1)
+            else :
+                hor = False
+                keep = not vertical_index.overlaps(line1)
             
-            if cv2.pointPolygonTest(np.array(approx), (float((x1 + x2) / 2), float((y1 + y2) / 2)), False) >= 0 :
-                if abs(y1 - y2) <= 20 :
-                    hor = True
-                    for line2 in horizontal_lines :
-                        if is_horizontally_overlapping(line1, line2) :
-                            keep = False
-                            break
+            if keep :
+                if hor :
+                    horizontal_lines.append(line1)
+                    horizontal_index.add(line1)
                 else :
-                    hor = False
-                    for line2 in vertical_lines :
-                        if is_vertically_overlapping(line1, line2) :
-                            keep = False
-                            break
-                
-                if keep :
-                    if hor :
-                        horizontal_lines.append(line1)
-                    else :
-                        vertical_lines.append(line1)
+                    vertical_lines.append(line1)
+                    vertical_index.add(line1)
+    metrics.count('lines_kept', len(horizontal_lines) + len(vertical_lines) - len(sides))
 
     """
     for l in horizontal_lines :
@@ -380,14 +856,20 @@ def funcRectangles(image, threshold, approx) :
         show_line(image, l)
     """
     
+    kept_lines = {'horizontal_lines' : line_list(horizontal_lines), 'vertical_lines' : line_list(vertical_lines)}
+    
     # วาดเส้นในภาพ
-    ret_image = image.copy()
-    for x1, y1, x2, y2 in horizontal_lines :
-        cv2.line(ret_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
-    for x1, y1, x2, y2 in vertical_lines :
-        cv2.line(ret_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
+    ret_image = None
+    if draw :
+        next_stage('draw')
+        ret_image = image.copy()
+        for x1, y1, x2, y2 in horizontal_lines :
+            cv2.line(ret_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        for x1, y1, x2, y2 in vertical_lines :
+            cv2.line(ret_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
     
     # ทำให้พิกัดเส้นอยู่ในรูป (xซ้าย, yซ้าย, xขวา, yขวา)
+    next_stage('count')
     horizontal_lines = [[x1, y1, x2, y2] if (x1 < x2) or (x1 == x2 and y1 < y2) else [x2, y2, x1, y1]
                         for [x1, y1, x2, y2] in horizontal_lines]
     
@@ -399,50 +881,190 @@ def funcRectangles(image, threshold, approx) :
     # เก็บว่าแต่ละเส้นแนวนอน มีเส้นแนวตั้งผ่านกี่เส้น
     base_info = []
     
-    for h in horizontal_lines :
-        # บีบเส้นให้แคบเพื่อไม่ให้แตะกับสองเส้นที่โอบด้านข้าง
-        x1, y1, x2, y2 = h
-        y1 -= 5
-        y2 -= 5
-        x1 += 15
-        x2 -= 15
-
-        number_of_vertical = 0
-
-        for v in vertical_lines :
-            vx1, vy1, vx2, vy2 = v
-
-            # เช็กว่า vx อยู่ระหว่าง x1 กับ x2 ของเส้น h หรือเปล่า
-            if min(x1, x2) <= vx1 <= max(x1, x2) :
-                number_of_vertical += 1
-        
+    for number_of_vertical in count_vertical_crossings(horizontal_lines, vertical_lines).tolist() :
         # บันทึกว่าเส้นแนวนอนนั้นเลือกเส้นแนวตั้งได้กี่เส้น
         base_info.append(number_of_vertical + 2)
     
-    for i in range(len(horizontal_lines)) :
-        for j in range(i+1, len(horizontal_lines)) :
-            t = min(base_info[i], base_info[j])
-            all_rectangles += t * (t-1) / 2
+    # ทุกคู่ของเส้นแนวนอน (i < j) สร้างสี่เหลี่ยมได้ C(t, 2) รูป โดย t = min(base_info[i], base_info[j])
+    if len(base_info) >= 2 :
+        b = np.array(base_info, dtype=np.int64)
+        t = np.minimum.outer(b, b)[np.triu_indices(len(b), 1)]
+        all_rectangles = float(np.sum(t * (t - 1) // 2))
       
-    return 'rectangle', all_rectangles, base_info, ret_image
+    return 'rectangle', all_rectangles, base_info, ret_image, kept_lines
  
-def func1(file_path) :
-    try:
-        image_original = cv2.imread(file_path)
-        image = image_original.copy()
-        image_1 = image_original.copy()
+# marker SOF ของ JPEG ทุกแบบ (ยกเว้น DHT 0xC4, JPG 0xC8, DAC 0xCC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(data) :
+    # อ่าน (กว้าง, สูง) จาก header ของ JPEG โดยไม่ถอดรหัสภาพ คืน None ถ้าไม่ใช่ JPEG หรืออ่านไม่ได้
+    if data[:2] != b'\xff\xd8' :
+        return None
+    i = 2
+    while i + 4 <= len(data) :
+        if data[i] != 0xFF :
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF :
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8 :
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS :
+            if i + 9 > len(data) :
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+def png_size(data) :
+    # (กว้าง, สูง) จาก IHDR ของ PNG คืน None ถ้าไม่ใช่ PNG
+    if data[:8] != b'\x89PNG\r\n\x1a\n' or data[12:16] != b'IHDR' :
+        return None
+    return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
 
-        ratio = image.shape[0]/image.shape[1]
-        image = cv2.resize(image, (500, int(500 * ratio)))
-        image_1 = cv2.resize(image_1, (500, int(500 * ratio)))
+def decode_flags(data, min_side) :
+    # ภาพจากกล้องมือถือใหญ่กว่าที่ func1 ใช้มาก (func1 ย่อเหลือกว้าง 500px) ให้ libjpeg ย่อขนาดตอนถอดรหัสเลย
+    # ใช้ด้านที่สั้นกว่า เพราะภาพอาจถูกหมุนตาม EXIF orientation หลังถอดรหัส
+    size = jpeg_size(data) if min_side else None
+    if size is not None :
+        for factor, flags in REDUCED_DECODE_FLAGS :
+            if min(size) // factor >= min_side :
+                return flags
+    return cv2.IMREAD_COLOR
 
-        blurred_1 = cv2.GaussianBlur(image_1, (3, 3), 0)
-        blurred_1 = cv2.medianBlur(blurred_1, 3)
-        gray_1 = cv2.cvtColor(blurred_1, cv2.COLOR_BGR2GRAY)
-        threshold_1 = cv2.Canny(gray_1, 50, 150, apertureSize=3)
-        threshold_1 = cv2.morphologyEx(threshold_1, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7)))
+def decode_image(data, min_side=None) :
+    # ถอดรหัสภาพจาก bytes โดยตรง ไม่ต้องเขียนลงไฟล์ก่อน
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0 :
+        return None
+    if min_side is None :
+        min_side = app.config['DECODE_MIN_SIDE']
+    # ไม่ถอดรหัสภาพที่ใหญ่เกิน (ภาพ 20000x20000 ใช้หน่วยความจำ 1.2GB ก่อนจะย่อได้)
+    # ขนาดจาก header คือก่อนย่อตอนถอดรหัส JPEG จึงเทียบกับ MAX_IMAGE_PIXELS ที่หลวมกว่าเป้าหมายจริงมาก
+    size = jpeg_size(data) or png_size(data)
+    max_pixels = app.config['MAX_IMAGE_PIXELS']
+    if size is not None and max_pixels and size[0] * size[1] > max_pixels :
+        return None
+    image = cv2.imdecode(buffer, decode_flags(data, min_side))
+    return limit_image_side(image, app.config['MAX_IMAGE_SIDE'])
+
+def limit_image_side(image, max_side) :
+    # ย่อภาพที่ด้านยาวเกิน max_side (func1 ใช้แค่กว้าง 500px) ภาพที่ไม่เกินคืนตัวเดิม
+    if image is None or not max_side or max(image.shape[:2]) <= max_side :
+        return image
+    scale = max_side / max(image.shape[:2])
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def encode_image(image, ext='.png', params=()) :
+    ok, buffer = cv2.imencode(ext, image, list(params))
+    if not ok :
+        raise ValueError(f'cannot encode image as {ext}')
+    return buffer.tobytes()
+
+# รูปแบบภาพ overlay: (นามสกุล, mimetype, flag คุณภาพของ OpenCV)
+OVERLAY_FORMATS = {
+    'png' : ('.png', 'image/png', None),
+    'webp' : ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+    'jpeg' : ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+}
+
+def encode_overlay(image, overlay) :
+    ext, _, quality_flag = OVERLAY_FORMATS[overlay]
+    params = () if quality_flag is None else (quality_flag, app.config['OVERLAY_QUALITY'])
+    return encode_image(image, ext, params)
+
+class ScanError(Exception) :
+    # บอกว่าประมวลผลภาพล้มเหลวที่ขั้นตอนไหน (stage) และเพราะอะไร
+    def __init__(self, stage, message) :
+        super().__init__(f'{stage}: {message}')
+        self.stage = stage
+        self.message = message
+
+class ScanTimeout(ScanError) :
+    # ประมวลผลเกินเวลาที่กำหนด (SCAN_TIMEOUT) image_type คือรูปที่ตรวจพบแล้ว (ถ้าหมดเวลาหลังหาเส้นรอบรูปได้)
+    def __init__(self, stage, seconds) :
+        super().__init__(stage, f'timed out after {seconds:.2f}s')
+        self.seconds = seconds
+        self.image_type = None
+
+# [เวลาเริ่ม, เวลาที่ต้องเสร็จ, ขั้นตอนปัจจุบัน] ของภาพที่กำลังประมวลผลใน context นี้ (ดู Deadline)
+# เก็บขั้นตอนไว้เองเพราะ metrics.current_stage() มีค่าเฉพาะเมื่ออยู่ใน metrics.Trace
+_deadline = contextvars.ContextVar('givemath_deadline', default=None)
+
+class Deadline :
+    # with Deadline(seconds) : ... ให้ check_deadline() ภายใน block โยน ScanTimeout เมื่อเกินเวลา (0 / None = ไม่จำกัด)
+    def __init__(self, seconds) :
+        self.seconds = seconds
+
+    def __enter__(self) :
+        now = time.perf_counter()
+        self._token = _deadline.set([now, now + self.seconds, None] if self.seconds else None)
+        return self
+
+    def __exit__(self, *exc) :
+        _deadline.reset(self._token)
+        return False
+
+def check_deadline() :
+    # เรียกระหว่างขั้นตอนและในลูปที่อาจนาน งานที่ถูกหยุดจะบอกว่าหมดเวลาที่ขั้นตอนไหน
+    deadline = _deadline.get()
+    if deadline is not None :
+        now = time.perf_counter()
+        if now > deadline[1] :
+            raise ScanTimeout(deadline[2] or metrics.current_stage() or 'pipeline', now - deadline[0])
+
+def next_stage(name) :
+    check_deadline()
+    deadline = _deadline.get()
+    if deadline is not None :
+        deadline[2] = name
+    metrics.stage(name)
+
+def working_size(shape) :
+    # ขนาด (กว้าง, สูง) ของภาพที่ย่อกว้าง 500px ที่ scan และโหมดสแกนสดใช้
+    # ตรวจสัดส่วนภาพก่อนจองหน่วยความจำ ภาพที่สัดส่วนเกิน MAX_ASPECT_RATIO ไม่ใช่รูปที่นับได้อยู่แล้ว
+    height, width = shape[:2]
+    max_ratio = app.config['MAX_ASPECT_RATIO']
+    if max_ratio and max(height, width) > max_ratio * min(height, width) :
+        raise ScanError('resize', f'image is {width}x{height}, aspect ratio over {max_ratio:g}:1')
+    ratio = height / width
+    return (500, max(1, int(500 * ratio)))
+
+def scan(image_original, draw=True, contour=None) :
+    # รับได้ทั้ง path ของไฟล์ และภาพที่ถอดรหัสแล้ว (numpy array)
+    # คืน (image_type, answer, arr_info, ret_image, geometry) ถ้า draw=False จะไม่วาด ret_image (เป็น None)
+    # geometry คือพิกัดเส้นบนภาพที่ใช้นับ กับ transform จากพิกัด normalize (0..1) ของภาพต้นฉบับไปยังภาพนั้น
+    # contour = เส้นรอบรูปหลักที่หาไว้แล้วบนภาพที่ย่อกว้าง 500px (ContourTracker) จะข้ามการหาเส้นรอบรูปครั้งแรก
+    if isinstance(image_original, str) :
+        metrics.stage('decode')
+        image_original = cv2.imread(image_original)
+    if image_original is None :
+        raise ScanError('decode', 'cannot decode image')
 
-        main_contour_temp = findMainContours(image_1, threshold_1)
+    image_type = None
+    try:
+        next_stage('resize')
+        size_1 = working_size(image_original.shape)
+        image_1 = cv2.resize(image_original, size_1, dst=scratch.get('resized', (size_1[1], 500) + image_original.shape[2:]))
+
+        if contour is None :
+            next_stage('preprocess')
+            threshold_1 = find_edges(image_1, 3, 3, 7, 'full')
+
+            next_stage('contour')
+            main_contour_temp = findMainContours(image_1, threshold_1)
+        else :
+            next_stage('contour')
+            main_contour_temp = contour
+        if main_contour_temp is None :
+            raise ScanError('contour', 'no triangle or rectangle outline found')
         epsilon = 0.02 * cv2.arcLength(main_contour_temp, True)
         approx = cv2.approxPolyDP(main_contour_temp, epsilon, True)
         
@@ -456,108 +1078,628 @@ def func1(file_path) :
         if base[0] > base[2] :
             base = (base[2], base[3], base[0], base[1])
             
-        rotated = rotate_image(image_1, base)
-        
-        blurred_1 = cv2.GaussianBlur(rotated, (3, 3), 0)
-        blurred_1 = cv2.medianBlur(rotated, 3)
-        gray_1 = cv2.cvtColor(blurred_1, cv2.COLOR_BGR2GRAY)
-        threshold_1 = cv2.Canny(gray_1, 50, 150, apertureSize=3)
-        threshold_1 = cv2.morphologyEx(threshold_1, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7)))
-        
-        main_contour_temp = findMainContours(rotated, threshold_1)
-
-        x, y, w, h = cv2.boundingRect(main_contour_temp)
-        image = rotated[y-10: y+h+10, x-10: x+w+10]
+        # หมุนเฉพาะส่วนรอบเส้นรอบรูป ไม่หมุนทั้งภาพ
+        next_stage('rotate')
+        crop, crop_matrix = crop_rotated(image_1, base, main_contour_temp, app.config['ROTATE_MIN_DEGREES'])
 
-        ratio = image.shape[0]/image.shape[1]
-        image = cv2.resize(image, (256, int(256 * ratio)))
+        next_stage('crop_resize')
+        ratio = crop.shape[0]/crop.shape[1]
+        size = (256, int(256 * ratio))
+        image = cv2.resize(crop, size, dst=scratch.get('crop_resized', (size[1], 256) + crop.shape[2:]))
+        transform = crop_transform(image_1.shape, crop_matrix, crop.shape, image.shape)
         width, height = image.shape[:2]
         
-        blurred = cv2.GaussianBlur(image, (5, 5), 0)
-        gray = cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY)
-        threshold = cv2.Canny(gray, 50, 150, apertureSize=3)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-        threshold = cv2.morphologyEx(threshold, cv2.MORPH_CLOSE, kernel)
+        next_stage('preprocess_crop')
+        threshold = find_edges(image, 5, 0, 5, 'crop')
 
+        next_stage('contour_crop')
         main_contour = findMainContours(image, threshold)
+        if main_contour is None :
+            raise ScanError('contour', 'outline lost after cropping')
         epsilon = 0.02 * cv2.arcLength(main_contour, True)
         approx = cv2.approxPolyDP(main_contour, epsilon, True)
         
-        image_type = ''
+        image_type = {3 : 'triangle', 4 : 'rectangle'}.get(len(approx))
         answer = 0
         arr_info = []
         ret_image = None
 
         if len(approx) == 3 :
-            image_type, answer, arr_info, ret_image = funcTriangles(image, threshold, approx)
+            image_type, answer, arr_info, ret_image, kept_lines = funcTriangles(image, threshold, approx, draw)
         elif len(approx) == 4 :
-            image_type, answer, arr_info, ret_image = funcRectangles(image, threshold, approx)
+            image_type, answer, arr_info, ret_image, kept_lines = funcRectangles(image, threshold, approx, draw)
         else :
-            return None
-    except :
-        return None
+            raise ScanError('shape', f'outline has {len(approx)} corners, expected 3 or 4')
+    except ScanTimeout as e :
+        e.image_type = image_type
+        raise
+    except ScanError :
+        raise
+    except Exception as e :
+        # บอกชื่อขั้นตอนที่ล้มเหลวจากตัวจับเวลา
+        raise ScanError(metrics.current_stage() or 'pipeline', f'{type(e).__name__}: {e}') from e
     
-    return image_type, answer, arr_info, ret_image
+    geometry = {
+        'width' : image.shape[1],
+        'height' : image.shape[0],
+        'transform' : transform.tolist(),
+        **kept_lines
+    }
+    return image_type, answer, arr_info, ret_image, geometry
 
-def clean() :
-    if os.path.exists(UPLOAD_FOLDER) :
-        for filename in os.listdir(UPLOAD_FOLDER) :
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            try :
-                if os.path.isfile(filepath) :
-                    os.remove(filepath)
-            except :
-                pass
+def func1(image_original) :
+    try :
+        return scan(image_original)[:4]
+    except ScanError :
+        return None
+
+def make_entry(image, overlay='png', contour=None) :
+    # ผลของภาพหนึ่งภาพในรูป dict ถ้าล้มเหลวจะมี error บอกสาเหตุ
+    # overlay เป็น bytes ของภาพตามรูปแบบ overlay_format หรือ None ถ้าขอแบบ geometry (ไม่วาด ไม่ encode)
+    try :
+        with Deadline(app.config['SCAN_TIMEOUT']) :
+            image_type, answer, arr_info, ret_image, geometry = scan(image, draw=overlay != 'geometry', contour=contour)
+    except ScanError as e :
+        metrics.fail(e.stage)
+        entry = {
+            'image_type' : None,
+            'answer' : None,
+            'arr_info' : None,
+            'geometry' : None,
+            'overlay' : None,
+            'error' : str(e)
+        }
+        if isinstance(e, ScanTimeout) :
+            # ผลบางส่วน: หมดเวลาที่ขั้นตอนไหน ใช้เวลาไปเท่าไร และตรวจพบรูปอะไรแล้ว
+            metrics.count('timeouts')
+            entry['timeout'] = {'stage' : e.stage, 'seconds' : e.seconds, 'image_type' : e.image_type}
+        elif e.__cause__ is not None :
+            # exception ที่ไม่คาดคิดใน pipeline (เช่น MemoryError) ไม่ใช่ผลของภาพ
+            entry['exception'] = type(e.__cause__).__name__
+        return entry
+    finally :
+        # บัฟเฟอร์ที่ภาพใหญ่ผิดปกติทำให้โตขึ้นไม่เก็บไว้ตลอดอายุเธรด
+        scratch.trim(app.config['SCRATCH_MAX_BYTES'])
+
+    entry = {
+        'image_type' : image_type,
+        'answer' : answer,
+        'arr_info' : arr_info,
+        'geometry' : geometry,
+        'overlay' : None
+    }
+    if ret_image is not None :
+        metrics.stage('encode')
+        entry['overlay'] = encode_overlay(ret_image, overlay)
+        entry['overlay_format'] = overlay
+    return entry
+
+def cacheable(entry) :
+    # หมดเวลาหรือ exception ที่ไม่คาดคิดอาจเป็นเพราะ server ยุ่งหรือหน่วยความจำไม่พอในตอนนั้น ไม่เก็บไว้ตอบครั้งต่อไป
+    return not entry.get('timeout') and not entry.get('exception')
+
+def entry_covers(entry, overlay) :
+    # entry จากแคชตอบคำขอแบบ overlay นี้ได้ไหม (entry แบบ geometry ไม่มีภาพ, ภาพที่บีบอัดแบบ lossy ไม่นำมาแปลงเป็นรูปแบบอื่น)
+    if entry is None :
+        return False
+    if entry.get('error') :
+        return True
+    if overlay == 'geometry' :
+        return entry.get('geometry') is not None
+    return entry['overlay'] is not None and entry.get('overlay_format', 'png') in ('png', overlay)
+
+def scan_bytes(data, overlay='png') :
+    # ใช้ใน process pool: รับ bytes ของไฟล์ คืน (entry, perceptual hash, trace)
+    # trace ส่งกลับไปบันทึกสถิติที่ process หลัก
+    with metrics.Trace() as trace :
+        metrics.stage('decode')
+        image = decode_image(data)
+        image_phash = None
+        if app.config['CACHE_PHASH_DISTANCE'] >= 0 and image is not None :
+            image_phash = perceptual_hash(image)
+        entry = make_entry(image, overlay)
+    return entry, image_phash, trace
+
+class ContourTracker :
+    # ติดตามเส้นรอบรูปหลักข้ามเฟรมของโหมดสแกนสด (เฟรมย่อกว้าง 500px แบบเดียวกับใน scan)
+    # เฟรมถัดไปหาเส้นรอบรูปเฉพาะรอบตำแหน่งเดิม (ขยายออก padding ของด้านที่ยาวกว่า) ถ้าไม่เจอจึงหาทั้งภาพ
+    # รูปนิ่งเมื่อจำนวนมุมเท่าเดิมและทุกมุมขยับไม่เกิน tolerance ของความกว้างภาพ ติดกัน stable_frames เฟรม
+    def __init__(self, stable_frames=5, tolerance=0.02, padding=0.15) :
+        self.stable_frames = stable_frames
+        self.tolerance = tolerance
+        self.padding = padding
+        self.reset()
+
+    def reset(self) :
+        self.contour = None
+        self.corners = None
+        self.stable = 0
+        self.scanned = False
+
+    def find(self, image) :
+        # คืน (contour, หาเจอจากตำแหน่งเดิมหรือไม่)
+        if self.contour is not None :
+            x, y, w, h = cv2.boundingRect(self.contour)
+            pad = max(16, int(self.padding * max(w, h)))
+            left, top = max(x - pad, 0), max(y - pad, 0)
+            window = image[top:y + h + pad, left:x + w + pad]
+            contour = findMainContours(window, find_edges(window, 3, 3, 7, 'track'))
+            # รูปที่เจอเล็กกว่าเดิมมาก (เช่นช่องด้านใน) ถือว่าหลุด
+            if contour is not None and cv2.contourArea(contour) >= 0.5 * cv2.contourArea(self.contour) :
+                return contour + np.array([left, top], dtype=contour.dtype), True
+        return findMainContours(image, find_edges(image, 3, 3, 7, 'track')), False
+
+    def update(self, image) :
+        # คืน 'searching' (ไม่เจอรูป), 'tracking' (เจอแต่ยังขยับ) หรือ 'stable'
+        contour, tracked = self.find(image)
+        if contour is None :
+            self.reset()
+            return 'searching', tracked
+        corners = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True).reshape(-1, 2).astype(np.float64)
+        moved = self.corners is None or len(corners) != len(self.corners)
+        if not moved :
+            # ระยะจากแต่ละมุมไปยังมุมเดิมที่ใกล้ที่สุด (ลำดับมุมจาก approxPolyDP อาจเริ่มคนละจุด)
+            distances = np.linalg.norm(corners[:, None] - self.corners[None], axis=2).min(axis=1)
+            moved = distances.max() > self.tolerance * image.shape[1]
+        if moved :
+            self.stable = 0
+            self.scanned = False
+        else :
+            self.stable += 1
+        self.contour = contour
+        self.corners = corners
+        return ('stable' if self.stable >= self.stable_frames else 'tracking'), tracked
+
+def live_frame(tracker, data) :
+    # ประมวลผลหนึ่งเฟรมของโหมดสแกนสด คืน dict ที่ส่งกลับให้ browser
+    # ทุกเฟรมแค่ติดตามเส้นรอบรูป ส่วน scan เต็มรูปแบบ (หมุน, Hough, นับ) ทำครั้งเดียวเมื่อรูปนิ่ง
+    image = decode_image(data, 0)
+    if image is None :
+        return {'status' : 'error', 'error' : 'cannot decode frame'}
+    try :
+        size = working_size(image.shape)
+    except ScanError as e :
+        return {'status' : 'error', 'error' : str(e)}
+    image_1 = cv2.resize(image, size)
+    status, tracked = tracker.update(image_1)
+    result = {
+        'status' : status,
+        'tracked' : tracked,
+        'stable' : tracker.stable,
+        # มุมของรูปแบบ normalize (0..1) ไว้วาดบนภาพจากกล้อง
+        'corners' : None if tracker.corners is None else (tracker.corners / [image_1.shape[1], image_1.shape[0]]).tolist(),
+    }
+    if status == 'stable' and not tracker.scanned :
+        tracker.scanned = True
+        trace = metrics.Trace()
+        with trace :
+            entry = make_entry(image_1, 'geometry', contour=tracker.contour)
+        metrics.observe_scan(trace)
+        if entry.get('error') :
+            # ลองใหม่เมื่อรูปนิ่งครบอีกรอบ
+            tracker.stable = 0
+            tracker.scanned = False
+        result['result'] = render_result(entry, 'geometry')
+    return result
+
+def init_batch_worker() :
+    # แต่ละ process ในพูลโหลดโมเดลตอน import app ครั้งเดียว
+    # และใช้เธรดของ OpenCV เธรดเดียว เพราะขนานกันที่ระดับ process อยู่แล้ว
+    cv2.setNumThreads(1)
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def get_batch_pool() :
+    global _batch_pool
+    with _batch_pool_lock :
+        if _batch_pool is None :
+            # ใช้ spawn เพราะ fork จาก process ที่มีหลายเธรด (OpenCV, gunicorn) อาจค้างได้
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=app.config['BATCH_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_batch_worker,
+            )
+        return _batch_pool
+
+def reset_batch_pool() :
+    global _batch_pool
+    with _batch_pool_lock :
+        if _batch_pool is not None :
+            _batch_pool.shutdown(wait=False, cancel_futures=True)
+        _batch_pool = None
+
+startup['import_seconds'] = time.perf_counter() - import_started
+
+WARMUP_IMAGES = ['example_rec.jpg', 'example_tri.jpg']
+_warmup_lock = threading.Lock()
+
+def warm_up() :
+    # รัน pipeline กับภาพตัวอย่างก่อนรับคำขอจริง ให้ OpenCV เตรียม kernel/บัฟเฟอร์ให้เรียบร้อย
+    # บันทึกเวลารอบแรก (cold) และรอบที่สอง (warm) ของแต่ละภาพ
+    with _warmup_lock :
+        if startup['ready'] :
+            return startup
+
+        started = time.perf_counter()
+        warmup = {}
+        for filename in WARMUP_IMAGES :
+            with open(os.path.join(BASE_DIR, 'static', filename), 'rb') as f :
+                data = f.read()
+            timings = []
+            for _ in range(2) :
+                t = time.perf_counter()
+                make_entry(decode_image(data))
+                timings.append(time.perf_counter() - t)
+            warmup[filename] = {'cold_seconds' : timings[0], 'warm_seconds' : timings[1]}
+
+        startup['pid'] = os.getpid()
+        startup['warmup'] = warmup
+        startup['warmup_seconds'] = time.perf_counter() - started
+        startup['ready'] = True
+        return startup
+
+@app.route('/ready')
+def ready() :
+    # ถ้า server ไม่ได้เรียก warm_up ไว้ก่อน (เช่น flask run) probe แรกจะเริ่ม warm-up เบื้องหลัง
+    if not startup['ready'] and not _warmup_lock.locked() :
+        threading.Thread(target=warm_up, daemon=True).start()
+    return jsonify(startup), 200 if startup['ready'] else 503
 
 @app.route('/')
 def home() :
     return render_template('index.html')
 
+def upload_ext(filename) :
+    # นามสกุลของไฟล์ที่อัปโหลด ใช้ตอนเก็บลง upload_store
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return ext if 2 <= len(ext) <= 6 and ext[1:].isalnum() else '.bin'
+
+def request_overlay() :
+    # รูปแบบผลลัพธ์ที่คำขอต้องการ (form หรือ query string) คืน None ถ้าไม่รู้จัก
+    overlay = request.values.get('overlay') or app.config['OVERLAY_FORMAT']
+    return overlay if overlay == 'geometry' or overlay in OVERLAY_FORMATS else None
+
+def process_upload(data, overlay='png') :
+    # คืนผลเป็น dict (ดู make_entry) ใช้แคชถ้ามี
+    key = content_key(data)
+    entry = result_cache.get(key)
+    if entry_covers(entry, overlay) :
+        return entry
+
+    trace = metrics.Trace()
+    with trace :
+        metrics.stage('decode')
+        image = decode_image(data)
+    image_phash = None
+    if result_cache.phash_enabled and image is not None :
+        image_phash = perceptual_hash(image)
+        entry = result_cache.get_similar(image_phash)
+        if entry_covers(entry, overlay) :
+            return entry
+
+    with trace :
+        entry = make_entry(image, overlay)
+    metrics.observe_scan(trace)
+    del image
+    
+    if cacheable(entry) :
+        result_cache.put(key, entry, image_phash)
+    return entry
+
+def render_result(entry, overlay='png') :
+    ret_image_url = None
+    if overlay != 'geometry' and entry['overlay'] is not None :
+        data = entry['overlay']
+        if entry.get('overlay_format', 'png') != overlay :
+            # entry ในแคชเป็น PNG แต่คำขอนี้ต้องการ webp / jpeg
+            data = encode_overlay(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR), overlay)
+        ext, mimetype, _ = OVERLAY_FORMATS[overlay]
+        if overlay == 'png' and app.config['SAVE_GENERATED'] :
+            # ชื่อไฟล์มาจาก hash ของภาพ ภาพเดียวกันจึงใช้ไฟล์ (และแคชของ browser) ร่วมกันได้
+            ret_image_url = url_for('generated_file', name=generated_store.put(data, ext))
+        else :
+            ret_image_url = f'data:{mimetype};base64,' + base64.b64encode(data).decode('ascii')
+    
+    result = {
+        'image_type' : entry['image_type'],
+        'answer' : entry['answer'],
+        'arr_info' : entry['arr_info'],
+        'ret_image_url' : ret_image_url
+    }
+    if overlay == 'geometry' :
+        result['geometry'] = entry.get('geometry')
+    if entry.get('error') :
+        result['error'] = entry['error']
+    if entry.get('timeout') :
+        result['timeout'] = entry['timeout']
+    
+    return result
+
 @app.route('/upload', methods=['POST'])
 def upload_file() :
     if 'image' not in request.files :
         return jsonify({"error" : "No file uploaded"}), 400
     
     file = request.files['image']
-    if file :
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-    
-    ret = func1(filepath)
-    if ret :
-        image_type, answer, arr_info, ret_image = func1(filepath)
-    else :
-        return {
-            'image_type' : None, 
-            'answer' : None,
-            'arr_info' : None,
-            'ret_image_url' : None
-        }
-    
-    name, _ = os.path.splitext(filename)
-    new_filename = f'{name}_gen.png'
-    filepath = os.path.join(app.config['GENERATED_FOLDER'], new_filename)
-    cv2.imwrite(filepath, ret_image)
-    timestamp = int(time.time())
-    ret_image_url = url_for('static', filename=f'generated/{new_filename}') + f'?v={timestamp}'
+    data = file.read()
+    if not data :
+        return jsonify({"error" : "No file uploaded"}), 400
+    overlay = request_overlay()
+    if overlay is None :
+        return jsonify({"error" : "Unknown overlay format"}), 400
+
+    if app.config['SAVE_UPLOADS'] :
+        upload_store.put(data, upload_ext(file.filename))
     
-    result = {
-        'image_type' : image_type,
-        'answer' : answer,
-        'arr_info' : arr_info,
-        'ret_image_url' : ret_image_url
-    }
+    entry = process_upload(data, overlay)
+    result = render_result(entry, overlay)
     
-    del ret_image, image_type, answer, arr_info
-    gc.collect()
+    del data, entry
+    collect_garbage()
     
     return result
 
-@app.route('/uploads/<filename>')
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch() :
+    files = [file for file in request.files.getlist('images') if file]
+    if not files :
+        return jsonify({"error" : "No file uploaded"}), 400
+    if len(files) > app.config['BATCH_MAX_FILES'] :
+        return jsonify({"error" : f"Too many files (max {app.config['BATCH_MAX_FILES']})"}), 400
+    overlay = request_overlay()
+    if overlay is None :
+        return jsonify({"error" : "Unknown overlay format"}), 400
+
+    items = []
+    for file in files :
+        data = file.read()
+        items.append({'filename' : file.filename, 'key' : content_key(data), 'data' : data})
+
+    # ส่งเฉพาะภาพที่ไม่อยู่ในแคชไปประมวลผลขนานกันในพูล
+    pool = get_batch_pool()
+    for item in items :
+        entry = result_cache.get(item['key']) if item['data'] else None
+        item['entry'] = entry if entry_covers(entry, overlay) else None
+        if item['entry'] is None and item['data'] :
+            item['future'] = pool.submit(scan_bytes, item['data'], overlay)
+
+    results = []
+    for index, item in enumerate(items) :
+        entry = item['entry']
+        if not item['data'] :
+            entry = {'image_type' : None, 'answer' : None, 'arr_info' : None, 'overlay' : None, 'error' : 'decode: empty file'}
+        elif entry is None :
+            try :
+                entry, image_phash, trace = item['future'].result()
+                metrics.observe_scan(trace)
+                if cacheable(entry) :
+                    result_cache.put(item['key'], entry, image_phash)
+            except BrokenProcessPool as e :
+                reset_batch_pool()
+                entry = {'image_type' : None, 'answer' : None, 'arr_info' : None, 'overlay' : None, 'error' : f'worker: {e}'}
+            except Exception as e :
+                # ข้อผิดพลาดอื่นจาก worker (เช่น encode ไม่ได้, pickle ไม่ได้, MemoryError) เสียเฉพาะภาพนี้ ไม่ใช่ทั้ง batch
+                entry = {'image_type' : None, 'answer' : None, 'arr_info' : None, 'overlay' : None, 'error' : f'worker: {type(e).__name__}: {e}'}
+        
+        result = render_result(entry, overlay)
+        result['index'] = index
+        result['filename'] = item['filename']
+        results.append(result)
+
+    return jsonify({'results' : results})
+
+def run_job(payload, progress) :
+    progress('processing')
+    overlay = payload.get('overlay', 'png')
+    entry = process_upload(payload['data'], overlay)
+    progress('rendering')
+    # งานรันนอก request จึงต้องสร้าง request context เองเพื่อใช้ url_for
+    with app.test_request_context() :
+        return render_result(entry, overlay)
+
+job_queue = JobQueue(
+    run_job,
+    workers=app.config['JOB_WORKERS'],
+    depth=app.config['JOB_QUEUE_DEPTH'],
+    ttl=app.config['JOB_TTL'],
+    state_dir=app.config['JOB_DIR'],
+)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job() :
+    if 'image' not in request.files :
+        return jsonify({"error" : "No file uploaded"}), 400
+    
+    file = request.files['image']
+    data = file.read()
+    if not data :
+        return jsonify({"error" : "No file uploaded"}), 400
+    overlay = request_overlay()
+    if overlay is None :
+        return jsonify({"error" : "Unknown overlay format"}), 400
+
+    try :
+        job_id = job_queue.submit({'data' : data, 'overlay' : overlay})
+    except QueueFull as e :
+        response = jsonify({"error" : "Server is busy, try again later", "retry_after" : e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    status_url = url_for('job_status', job_id=job_id)
+    response = jsonify({'job_id' : job_id, 'status' : 'queued', 'status_url' : status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id) :
+    job = job_queue.get(job_id)
+    if job is None :
+        return jsonify({"error" : "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/stats')
+def job_stats() :
+    return jsonify(job_queue.stats())
+
+@app.route('/cache/stats')
+def cache_stats() :
+    return jsonify({**result_cache.stats(), 'pair_memo' : pair_cache.stats()})
+
+@app.errorhandler(413)
+def too_large(e) :
+    return jsonify({"error" : f"File too large (max {app.config['MAX_CONTENT_LENGTH']} bytes)"}), 413
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def process_rss() :
+    # RSS ปัจจุบันของ process (ไบต์) จาก /proc คืน None ถ้าอ่านไม่ได้ (ไม่ใช่ Linux)
+    try :
+        with open('/proc/self/statm', 'rb') as f :
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError) :
+        return None
+
+gc_state = {'rss' : None}
+gc_lock = threading.Lock()
+
+def collect_garbage() :
+    # เดิมเรียก gc.collect() ทุกคำขอ ซึ่งเดินทุก object ใน heap (ช้าขึ้นตามจำนวน object ไม่ใช่ขนาดภาพ)
+    # และ array ของ NumPy / OpenCV ถูกคืนทันทีด้วย reference counting อยู่แล้ว
+    # จึงเรียกเฉพาะเมื่อ RSS โตขึ้นเกิน GC_RSS_THRESHOLD นับจากครั้งก่อน (แสดงว่ามี reference cycle ค้าง)
+    threshold = app.config['GC_RSS_THRESHOLD']
+    if not threshold :
+        return False
+    rss = process_rss()
+    if rss is None :
+        return False
+    with gc_lock :
+        if gc_state['rss'] is None or rss < gc_state['rss'] :
+            gc_state['rss'] = rss
+            return False
+        if rss - gc_state['rss'] < threshold :
+            return False
+        started = time.perf_counter()
+        gc.collect()
+        metrics.gc_seconds.observe(time.perf_counter() - started)
+        metrics.gc_collections.inc()
+        # RSS หลัง collect มักไม่ลดลง (allocator ไม่คืนหน้าให้ระบบ) ใช้ค่าใหม่เป็นฐาน ไม่งั้นจะ collect ทุกคำขอ
+        gc_state['rss'] = process_rss() or rss
+    return True
+
+@app.before_request
+def start_timer() :
+    g.request_started = time.perf_counter()
+    if tracemalloc.is_tracing() :
+        tracemalloc.reset_peak()
+
+@app.after_request
+def record_request(response) :
+    started = g.pop('request_started', None)
+    if started is not None :
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(endpoint, response.status_code, time.perf_counter() - started)
+        if tracemalloc.is_tracing() :
+            # ค่าสูงสุดของทั้ง process ตั้งแต่ต้นคำขอ ถ้า worker มีหลายเธรดจะรวมคำขออื่นที่ทำพร้อมกันด้วย
+            peak = tracemalloc.get_traced_memory()[1]
+            metrics.request_peak_bytes.observe(peak, endpoint=endpoint)
+            response.headers['X-Peak-Alloc-Bytes'] = str(peak)
+    return response
+
+metrics.Gauge(metrics.registry, 'givemath_cache_lookups', 'Result cache lookups in this process by outcome',
+              lambda : {k : v for k, v in result_cache.stats().items() if k.endswith(('hits', 'misses'))}, ['outcome'])
+metrics.Gauge(metrics.registry, 'givemath_cache_bytes', 'Bytes held by the in-memory result cache in this process',
+              lambda : result_cache.stats()['bytes'])
+metrics.Gauge(metrics.registry, 'givemath_job_queue_depth', 'Jobs waiting in the queue of this process',
+              lambda : job_queue.stats()['queued'])
+
+@app.route('/metrics')
+def metrics_endpoint() :
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def send_artifact(store, name) :
+    path = store.path(name)
+    if path is None or not os.path.isfile(path) :
+        return jsonify({"error" : "Not found"}), 404
+    # ชื่อไฟล์มาจาก hash ของเนื้อหา ไฟล์ชื่อเดิมจึงไม่มีวันเปลี่ยน
+    response = send_from_directory(store.root, name, max_age=365 * 24 * 60 * 60)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/generated/<path:name>')
+def generated_file(name) :
+    return send_artifact(generated_store, name)
+
+@app.route('/artifacts/stats')
+def artifact_stats() :
+    return jsonify({'generated' : generated_store.stats(), 'uploads' : upload_store.stats()})
+
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename) :
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_artifact(upload_store, filename)
+
+sock = Sock(app) if Sock is not None else None
+
+live_state = {'sessions' : 0}
+live_lock = threading.Lock()
+
+# close code ของ WebSocket เมื่อการเชื่อมต่อ /live เต็ม (1013 = Try Again Later)
+LIVE_BUSY_CODE = 1013
+
+def live_available() :
+    return sock is not None and app.config['LIVE_MAX_SESSIONS'] > 0
+
+def live_session_start() :
+    with live_lock :
+        if live_state['sessions'] >= app.config['LIVE_MAX_SESSIONS'] :
+            return False
+        live_state['sessions'] += 1
+        return True
+
+def live_session_end() :
+    with live_lock :
+        live_state['sessions'] -= 1
+
+metrics.Gauge(metrics.registry, 'givemath_live_sessions', 'Open live scanner connections in this process',
+              lambda : live_state['sessions'])
+
+if sock is not None :
+    @sock.route('/live')
+    def live(ws) :
+        # รับเฟรม (bytes ของ JPEG) ตอบ JSON หนึ่งข้อความต่อเฟรมที่ประมวลผล ข้อความ 'reset' เริ่มติดตามใหม่
+        # ถ้าเฟรมมาเร็วกว่าที่ประมวลผลทัน จะประมวลผลเฉพาะเฟรมล่าสุดที่ค้างอยู่ เฟรมเก่าทิ้งไป
+        if not live_session_start() :
+            metrics.live_sessions_rejected.inc()
+            ws.close(reason=LIVE_BUSY_CODE, message='live scanner is busy')
+            return
+        try :
+            live_session(ws)
+        finally :
+            live_session_end()
+
+    def live_session(ws) :
+        tracker = ContourTracker(app.config['LIVE_STABLE_FRAMES'], app.config['LIVE_TOLERANCE'])
+        while True :
+            message = ws.receive(timeout=app.config['LIVE_IDLE_SECONDS'] or None)
+            if message is None :
+                break
+            frame = None
+            dropped = 0
+            while message is not None :
+                if isinstance(message, str) :
+                    if message == 'reset' :
+                        tracker.reset()
+                else :
+                    dropped += frame is not None
+                    frame = message
+                message = ws.receive(timeout=0)
+            if frame is None :
+                continue
+            started = time.perf_counter()
+            result = live_frame(tracker, frame)
+            metrics.observe_live_frame(time.perf_counter() - started, dropped, 'result' in result)
+            result['dropped'] = dropped
+            ws.send(json.dumps(result))
 
 @app.route('/topic')
 def topic() :
@@ -565,11 +1707,19 @@ def topic() :
 
 @app.route('/scanner')
 def scanner() :
-    return render_template('scanner.html')
+    return render_template('scanner.html', live=live_available())
 
 @app.route('/example')
 def example() :
     return render_template('example.html')
 
 if __name__ == '__main__' :       
+    if env_bool('GIVEMATH_WARMUP', True) :
+        warm_up()
+    # dev server ให้แต่ละการเชื่อมต่อมีเธรดของตัวเอง ไม่ต้องกันเธรดไว้ให้คำขอปกติ
+    if 'GIVEMATH_LIVE_MAX_SESSIONS' not in os.environ :
+        app.config['LIVE_MAX_SESSIONS'] = 4
+    # dev server มี process เดียว ให้ /upload/batch ใช้ทุก core
+    if 'GIVEMATH_BATCH_WORKERS' not in os.environ :
+        app.config['BATCH_WORKERS'] = os.cpu_count() or 1
     app.run(host='0.0.0.0', port=5000, debug=True)           
\ No newline at end of file
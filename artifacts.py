@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+
+ARTIFACT_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+
+class ArtifactStore :
+    """
+    เก็บไฟล์ที่สร้างขึ้น (เช่นภาพ overlay) โดยตั้งชื่อตาม sha256 ของเนื้อหา แยกโฟลเดอร์ย่อยตาม 2 ตัวแรก
+    เนื้อหาเดียวกันได้ชื่อเดิมเสมอ จึงให้ browser แคชได้ตลอด (immutable)
+    - ttl: ลบไฟล์ที่ไม่ได้ถูกใช้นานเกินกี่วินาที (0 = ไม่จำกัดอายุ)
+    - max_bytes: ขนาดรวมสูงสุด เกินแล้วลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน (0 = ไม่จำกัด)
+    - sweeper thread เริ่มตอน put() ครั้งแรก (หลัง gunicorn fork) แล้วกวาดทุก interval วินาที
+    """
+
+    def __init__(self, root, max_bytes=0, ttl=0, interval=300) :
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'writes' : 0,
+            'reuses' : 0,
+            'sweeps' : 0,
+            'expired' : 0,
+            'evicted' : 0,
+            'files' : 0,
+            'bytes' : 0,
+        }
+
+        if not os.path.exists(root) :
+            os.makedirs(root, exist_ok=True)
+
+    def put(self, data, ext='.png') :
+        # คืนชื่อแบบ 'ab/abcdef....png' ใช้กับ path() และ URL
+        self._start_sweeper()
+        digest = hashlib.sha256(data).hexdigest()
+        name = f'{digest[:2]}/{digest}{ext}'
+        path = os.path.join(self.root, digest[:2], digest + ext)
+        try :
+            # มีไฟล์อยู่แล้ว: แค่ต่ออายุ
+            os.utime(path)
+            with self._lock :
+                self._stats['reuses'] += 1
+            return name
+        except OSError :
+            pass
+
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        # เขียนไฟล์ชั่วคราวแล้ว rename กันคำขออื่นอ่านเจอไฟล์ที่เขียนไม่เสร็จ
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f :
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock :
+            self._stats['writes'] += 1
+        return name
+
+    def path(self, name) :
+        # None ถ้าชื่อไม่ได้มาจาก put() (กัน path traversal)
+        if not ARTIFACT_NAME.match(name) :
+            return None
+        return os.path.join(self.root, *name.split('/'))
+
+    def stats(self) :
+        with self._lock :
+            return dict(self._stats)
+
+    def sweep(self) :
+        # ลบไฟล์หมดอายุ แล้วลบไฟล์เก่าที่สุดจนขนาดรวมไม่เกิน max_bytes
+        now = time.time()
+        files = []
+        total = 0
+        expired = 0
+        for folder, _, names in os.walk(self.root) :
+            for filename in names :
+                path = os.path.join(folder, filename)
+                try :
+                    st = os.stat(path)
+                except OSError :
+                    continue
+                age = now - st.st_mtime
+                # ไฟล์ชั่วคราวที่ค้างจาก process ที่ตายไปแล้ว
+                stale_tmp = filename.endswith('.tmp') and age > 3600
+                if stale_tmp or (self.ttl and age > self.ttl) :
+                    try :
+                        os.remove(path)
+                        expired += not stale_tmp
+                    except OSError :
+                        pass
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        evicted = 0
+        if self.max_bytes and total > self.max_bytes :
+            files.sort()
+            for _, size, path in files :
+                if total <= self.max_bytes :
+                    break
+                try :
+                    os.remove(path)
+                    total -= size
+                    evicted += 1
+                except OSError :
+                    pass
+
+        with self._lock :
+            self._stats['sweeps'] += 1
+            self._stats['expired'] += expired
+            self._stats['evicted'] += evicted
+            self._stats['files'] = len(files) - evicted
+            self._stats['bytes'] = total
+        return expired + evicted
+
+    def _start_sweeper(self) :
+        # ตรวจ pid ด้วย เพราะเธรดไม่ติดไปกับ process ที่ fork ออกมา
+        with self._lock :
+            if self._thread is not None and self._pid == os.getpid() :
+                return
+            if not self.interval or not (self.ttl or self.max_bytes) :
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._sweep_loop, name='artifact-sweeper', daemon=True)
+            self._thread.start()
+
+    def _sweep_loop(self) :
+        while True :
+            try :
+                self.sweep()
+            except Exception :
+                pass
+            time.sleep(self.interval)
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import statistics
+
+import cv2
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path :
+    sys.path.insert(0, BASE_DIR)
+
+import app
+import metrics
+from bench.synthetic import render_figure, sweep
+
+"""
+benchmark ของ func1 ด้วยภาพสังเคราะห์จาก bench/synthetic.py (ไม่ต้องใช้ network)
+
+python -m bench.run [--quick] [--shape rectangle] [--repeat 3] [--out bench/results.json]
+                    [--config KEY=VALUE ...] [--save-baseline bench/baseline.json] [--compare bench/baseline.json]
+
+- จับเวลาแต่ละขั้นตอนด้วย metrics.Trace (ขั้น hough ถึง count คือ funcTriangles / funcRectangles)
+  รันแต่ละภาพ --repeat ครั้งแล้วใช้รอบที่เร็วที่สุด
+- รายงาน: ความแม่นยำเทียบ ground truth และ latency ตามจำนวนเส้นของแต่ละรูป, เวลาแต่ละขั้นตอน
+- --save-baseline เก็บสรุปผลและคำตอบของทุกภาพไว้ --compare เทียบกับ baseline แล้วจบด้วย exit code 1
+  ถ้าคำตอบของภาพใดเปลี่ยน ความแม่นยำลดลง หรือช้าลงเกิน --tolerance
+- คำตอบไม่ขึ้นกับเครื่อง (ภาพสังเคราะห์ deterministic และ pin เวอร์ชัน OpenCV ไว้) เทียบกับ
+  bench/baseline.json ที่ commit ไว้ได้เลย ส่วนเวลาขึ้นกับเครื่อง เทียบเวลาเฉพาะ baseline ที่สร้างบนเครื่องเดียวกัน
+  ด้วย sweep เดียวกัน (--quick หรือเต็ม)
+- คำตอบของสามเหลี่ยมขึ้นกับโมเดล (model1.npz / model1.pkl ไม่อยู่ใน repo) baseline เก็บ sha256 ของไฟล์โมเดลไว้
+  ถ้าไม่ตรงกับโมเดลที่ใช้อยู่จะข้ามการเทียบคำตอบของสามเหลี่ยม สี่เหลี่ยมไม่ใช้โมเดลจึงเทียบได้เสมอ
+  bench/baseline.json ใน repo จึงมีแค่สี่เหลี่ยม (--shape rectangle) คนที่มีโมเดลสร้าง baseline เต็มเองได้
+- --config เปลี่ยนค่าใน app.config สำหรับรอบนี้ (เช่น DECODE_MIN_SIDE=500) baseline เก็บค่าตั้งที่มีผลต่อคำตอบ
+  (app.RESULT_CONFIG_KEYS) ไว้ ถ้าไม่ตรงกันจะไม่เทียบคำตอบ ใช้ --config คู่กับ --save-baseline จะเพิ่มผลของค่าตั้งนั้น
+  เป็น variant ใน baseline ที่มีอยู่ (ความแม่นยำและจำนวนคำตอบที่ต่างจากค่าเริ่มต้น) แทนการเขียนทับ
+- คำตอบที่ไม่ตรง ground truth ใน baseline คือข้อจำกัดของ pipeline เอง (เช่น static/example_rec.jpg
+  ได้ 39 แทน 30 เพราะเศษเส้นแนวตั้งที่สูงไม่เกิน 20px ในภาพ 256px ถูกนับเป็นเส้นแนวนอน) ไม่ใช่ภาพสังเคราะห์ผิด
+"""
+
+# ขั้นตอนที่อยู่ใน funcTriangles / funcRectangles
+FUNC_STAGES = ('hough', 'merge', 'classify', 'dedup', 'draw', 'count')
+
+def parse_config(items) :
+    # ['KEY=VALUE', ...] -> dict ค่าที่เป็น JSON (ตัวเลข, true / false) แปลงเป็นชนิดนั้น นอกนั้นเป็นข้อความ
+    config = {}
+    for item in items :
+        key, _, value = item.partition('=')
+        if key not in app.app.config :
+            raise SystemExit(f'unknown config key {key!r}')
+        try :
+            config[key] = json.loads(value)
+        except ValueError :
+            config[key] = value
+    return config
+
+def result_config() :
+    return {key : app.app.config[key] for key in app.RESULT_CONFIG_KEYS}
+
+def model_fingerprint() :
+    # sha256 ของไฟล์โมเดลที่ app โหลด คืน None ถ้าไม่มีไฟล์
+    digest = hashlib.sha256()
+    for path in app.model_files() :
+        if not os.path.exists(path) :
+            return None
+        with open(path, 'rb') as f :
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def run_figure(figure, repeat) :
+    data = render_figure(figure)
+    best = None
+    for _ in range(repeat) :
+        with metrics.Trace() as trace :
+            metrics.stage('decode')
+            image = app.decode_image(data)
+            try :
+                image_type, answer, _, _, _ = app.scan(image)
+                error = None
+            except app.ScanError as e :
+                image_type, answer, error = None, None, str(e)
+        if best is None or trace.elapsed < best.elapsed :
+            best = trace
+
+    return {
+        'name' : figure.name,
+        'shape' : figure.shape,
+        'lines' : figure.lines,
+        'rotation' : figure.rotation,
+        'noise' : figure.noise,
+        'width' : figure.width,
+        'truth' : figure.truth,
+        'image_type' : image_type,
+        'answer' : answer,
+        'correct' : image_type == figure.shape and answer == figure.truth,
+        'error' : error,
+        'seconds' : best.elapsed,
+        'func_seconds' : sum(best.stages.get(stage, 0.0) for stage in FUNC_STAGES),
+        'stages' : best.stages,
+        'model_pairs' : best.counts.get('model_pairs', 0),
+        'hough_lines' : best.counts.get('hough_lines', 0),
+        'memo_hits' : best.counts.get('memo_hits', 0) + best.counts.get('memo_shared_hits', 0),
+        'memo_lookups' : sum(best.counts.get(name, 0) for name in ('memo_hits', 'memo_shared_hits', 'memo_misses')),
+    }
+
+def summarize(results) :
+    # สรุปตาม (รูป, จำนวนเส้น): จำนวนภาพ, สัดส่วนที่ถูก, median ของเวลาทั้งหมดและเวลาใน funcTriangles / funcRectangles
+    groups = {}
+    for result in results :
+        groups.setdefault(f'{result["shape"]}/{result["lines"]}', []).append(result)
+    summary = {}
+    for key, group in sorted(groups.items(), key=lambda item : (item[0].split('/')[0], int(item[0].split('/')[1]))) :
+        summary[key] = {
+            'images' : len(group),
+            'accuracy' : sum(r['correct'] for r in group) / len(group),
+            'failed' : sum(r['error'] is not None for r in group),
+            'median_ms' : statistics.median(r['seconds'] for r in group) * 1000,
+            'func_median_ms' : statistics.median(r['func_seconds'] for r in group) * 1000,
+            'model_pairs' : statistics.median(r['model_pairs'] for r in group),
+        }
+    return summary
+
+def stage_summary(results) :
+    stages = {}
+    for result in results :
+        for stage, seconds in result['stages'].items() :
+            stages.setdefault(stage, []).append(seconds)
+    return {stage : statistics.median(values) * 1000 for stage, values in stages.items()}
+
+def print_report(results, summary, stages) :
+    print(f'{"shape/lines":<14} {"images":>6} {"accuracy":>8} {"failed":>6} {"total ms":>9} {"func ms":>8} {"pairs":>6}')
+    for key, row in summary.items() :
+        print(f'{key:<14} {row["images"]:>6} {row["accuracy"]:>8.0%} {row["failed"]:>6} '
+              f'{row["median_ms"]:>9.2f} {row["func_median_ms"]:>8.2f} {row["model_pairs"]:>6g}')
+
+    correct = sum(r['correct'] for r in results)
+    print(f'\naccuracy {correct}/{len(results)} ({correct / len(results):.0%})')
+    for shape in ('triangle', 'rectangle') :
+        group = [r for r in results if r['shape'] == shape]
+        if group :
+            print(f'  {shape}: {sum(r["correct"] for r in group)}/{len(group)}')
+
+    lookups = sum(r['memo_lookups'] for r in results)
+    if lookups :
+        hits = sum(r['memo_hits'] for r in results)
+        print(f'pair memo: {hits}/{lookups} predictions reused ({hits / lookups:.1%})')
+
+    print('\nmedian ms per stage')
+    for stage, ms in sorted(stages.items(), key=lambda item : -item[1]) :
+        print(f'  {stage:<16} {ms:8.3f}')
+
+def baseline_data(results, summary, stages, sweep_name) :
+    return {
+        'created' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sweep' : sweep_name,
+        'config' : result_config(),
+        'model' : model_fingerprint() if any(r['shape'] == 'triangle' for r in results) else None,
+        'machine' : {'python' : platform.python_version(), 'opencv' : cv2.__version__,
+                     'processor' : platform.processor() or platform.machine(), 'cpus' : os.cpu_count()},
+        'answers' : {r['name'] : {'image_type' : r['image_type'], 'answer' : r['answer'], 'truth' : r['truth']}
+                     for r in results},
+        'summary' : summary,
+        'stages' : stages,
+    }
+
+def variant_data(baseline, results, overrides) :
+    # ผลของค่าตั้งอื่นเทียบกับ baseline: ความแม่นยำ และภาพที่คำตอบต่างจากค่าเริ่มต้น
+    answers = baseline.get('answers', {})
+    changed = [r['name'] for r in results
+               if r['name'] in answers and (answers[r['name']]['image_type'], answers[r['name']]['answer']) != (r['image_type'], r['answer'])]
+    return {
+        'created' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config' : overrides,
+        'correct' : sum(r['correct'] for r in results),
+        'baseline_correct' : sum(a['image_type'] == r['shape'] and a['answer'] == r['truth']
+                                 for r in results for a in [answers.get(r['name'])] if a is not None),
+        'images' : len(results),
+        'changed' : changed,
+    }
+
+def compare(baseline, results, summary, tolerance, sweep_name) :
+    # คืนรายการปัญหา: คำตอบของภาพที่เปลี่ยนไป (ไม่ขึ้นกับเครื่อง), ความแม่นยำที่ลดลง
+    # และเวลาที่ช้าลงเกิน tolerance (เฉพาะเมื่อ baseline ใช้ sweep เดียวกัน) เทียบเฉพาะที่มีทั้งสองฝั่ง
+    problems = []
+    print(f'\ncompared with baseline from {baseline.get("created", "?")}')
+    same_model = baseline.get('model') == model_fingerprint()
+    if not same_model :
+        print('model differs from the baseline, triangle answers are not compared')
+    compared = lambda shape : same_model or shape != 'triangle'
+
+    answers = baseline.get('answers', {})
+    if baseline.get('config', result_config()) != result_config() :
+        print(f'config differs from the baseline ({baseline["config"]}), answers are not compared')
+        answers = {}
+    checked = 0
+    for r in results :
+        base = answers.get(r['name'])
+        if base is None or not compared(r['shape']) :
+            continue
+        checked += 1
+        if (base['image_type'], base['answer']) != (r['image_type'], r['answer']) :
+            problems.append(f'{r["name"]}: answer {base["image_type"]} {base["answer"]} -> '
+                            f'{r["image_type"]} {r["answer"]} (truth {r["truth"]})')
+    print(f'answers compared for {checked}/{len(results)} images')
+
+    same_sweep = baseline.get('sweep') == sweep_name
+    if not same_sweep :
+        print(f'baseline is a {baseline.get("sweep", "?")} sweep, timing and per-group accuracy are not compared')
+        return problems
+    print(f'{"shape/lines":<14} {"base ms":>8} {"now ms":>8} {"change":>7} {"base acc":>8} {"now acc":>8}')
+    for key, row in summary.items() :
+        base = baseline['summary'].get(key)
+        if base is None :
+            continue
+        change = row['median_ms'] / base['median_ms'] - 1 if base['median_ms'] else 0.0
+        flag = ''
+        if change > tolerance :
+            problems.append(f'{key}: {base["median_ms"]:.2f} ms -> {row["median_ms"]:.2f} ms ({change:+.0%})')
+            flag = ' slower'
+        if compared(key.split('/')[0]) and row['accuracy'] < base['accuracy'] :
+            problems.append(f'{key}: accuracy {base["accuracy"]:.0%} -> {row["accuracy"]:.0%}')
+            flag += ' less accurate'
+        print(f'{key:<14} {base["median_ms"]:>8.2f} {row["median_ms"]:>8.2f} {change:>+7.0%} '
+              f'{base["accuracy"]:>8.0%} {row["accuracy"]:>8.0%}{flag}')
+    return problems
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description='Benchmark func1 on synthetic figures with known answers')
+    parser.add_argument('--quick', action='store_true', help='smaller sweep (no rotation / noise, one resolution)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per image, the fastest is kept')
+    parser.add_argument('--shape', choices=('triangle', 'rectangle'), help='only benchmark one kind of figure')
+    parser.add_argument('--threads', type=int, default=1, help='cv2.setNumThreads (0 = OpenCV default)')
+    parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE', help='override app.config for this run')
+    parser.add_argument('--out', help='write every per-image result to this JSON file')
+    parser.add_argument('--save-baseline', metavar='PATH', help='store the summary as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before --compare fails (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    if args.threads :
+        cv2.setNumThreads(args.threads)
+    overrides = parse_config(args.config)
+    app.app.config.update(overrides)
+    sweep_name = 'quick' if args.quick else 'full'
+    figures = sweep(rotations=(0,), noises=(0,), widths=(1280,)) if args.quick else sweep()
+    if args.shape :
+        figures = [figure for figure in figures if figure.shape == args.shape]
+
+    # รอบแรกของ OpenCV ช้ากว่าปกติ
+    app.warm_up()
+    started = time.perf_counter()
+    results = []
+    for i, figure in enumerate(figures) :
+        results.append(run_figure(figure, args.repeat))
+        print(f'\r{i + 1}/{len(figures)} {figure.name:<48}', end='', file=sys.stderr, flush=True)
+    print(f'\r{len(figures)} figures in {time.perf_counter() - started:.1f}s'.ljust(60), file=sys.stderr)
+
+    summary = summarize(results)
+    stages = stage_summary(results)
+    print_report(results, summary, stages)
+
+    if args.out :
+        with open(args.out, 'w', encoding='utf-8') as f :
+            json.dump(results, f, indent=1)
+    if args.save_baseline and overrides :
+        with open(args.save_baseline, encoding='utf-8') as f :
+            baseline = json.load(f)
+        label = ' '.join(f'{key}={value}' for key, value in sorted(overrides.items()))
+        variant = baseline.setdefault('variants', {})[label] = variant_data(baseline, results, overrides)
+        with open(args.save_baseline, 'w', encoding='utf-8') as f :
+            json.dump(baseline, f, indent=1)
+        print(f'\nvariant {label} written to {args.save_baseline}: {variant["correct"]}/{variant["images"]} correct '
+              f'(baseline {variant["baseline_correct"]}), {len(variant["changed"])} answers changed')
+    elif args.save_baseline :
+        with open(args.save_baseline, 'w', encoding='utf-8') as f :
+            json.dump(baseline_data(results, summary, stages, sweep_name), f, indent=1)
+        print(f'\nbaseline written to {args.save_baseline}')
+    if args.compare :
+        with open(args.compare, encoding='utf-8') as f :
+            problems = compare(json.load(f), results, summary, args.tolerance, sweep_name)
+        if problems :
+            print('\nregressions:')
+            for problem in problems :
+                print(f'  {problem}')
+            return 1
+        print('\nno regressions')
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import math
+
+import cv2
+import numpy as np
+
+"""
+สร้างภาพโจทย์สังเคราะห์ที่รู้คำตอบแน่นอน (ground truth) แบบ deterministic จาก seed
+
+- triangle (พัด): สามเหลี่ยมที่มีเส้นจากยอดลงมาที่ฐาน (dividing) และเส้นแนวนอนขนานฐาน
+  คำตอบ = จำนวนเส้นแนวนอน (รวมฐาน) x C(จำนวนเส้นจากยอด + 2, 2)
+- rectangle (ตาราง): เส้นแนวนอนและแนวตั้ง (รวมขอบ) คำตอบ = C(แนวนอน, 2) x C(แนวตั้ง, 2)
+
+ปรับได้: จำนวนเส้น, มุมหมุน, noise, ความละเอียด และคุณภาพ JPEG
+ลายเส้นเลียนแบบ static/example_*.jpg (สัดส่วน ความหนาเส้น สีถม) ภาพเดียวกันได้ไบต์เท่ากันทุกเครื่อง
+"""
+
+class Figure :
+    # shape: 'triangle' หรือ 'rectangle'
+    # horizontal: จำนวนเส้นแนวนอน (triangle รวมฐาน, rectangle รวมขอบบนล่าง)
+    # vertical: triangle = เส้นจากยอดที่อยู่ด้านใน, rectangle = เส้นแนวตั้งรวมขอบซ้ายขวา
+    # noise: ส่วนเบี่ยงเบนมาตรฐานของ Gaussian noise (ระดับสี 0-255), quality: คุณภาพ JPEG (0 = PNG)
+    def __init__(self, shape, horizontal, vertical, rotation=0.0, noise=0.0, width=1280, quality=90, seed=0) :
+        self.shape = shape
+        self.horizontal = horizontal
+        self.vertical = vertical
+        self.rotation = rotation
+        self.noise = noise
+        self.width = width
+        self.quality = quality
+        self.seed = seed
+
+    @property
+    def lines(self) :
+        # จำนวนเส้นทั้งหมดในภาพ (รวมขอบ) ใช้เป็นแกนของกราฟ latency
+        if self.shape == 'triangle' :
+            return self.horizontal + self.vertical + 2
+        return self.horizontal + self.vertical
+
+    @property
+    def truth(self) :
+        if self.shape == 'triangle' :
+            return self.horizontal * math.comb(self.vertical + 2, 2)
+        return math.comb(self.horizontal, 2) * math.comb(self.vertical, 2)
+
+    @property
+    def name(self) :
+        return (f'{self.shape}_h{self.horizontal}_v{self.vertical}_r{self.rotation:g}'
+                f'_n{self.noise:g}_w{self.width}_s{self.seed}')
+
+# สีถมด้านในรูป เท่ากับภาพตัวอย่าง
+FILL_COLOR = (216, 216, 216)
+
+def draw_figure(figure) :
+    # คืนภาพ BGR ให้หน้าตาเหมือน static/example_*.jpg: ภาพสี่เหลี่ยมจัตุรัส พื้นขาว รูปถมสีเทา
+    # เส้นดำหนา 1/125 ของความกว้าง (4px ที่ 500px) ไม่ทำ anti-alias
+    width = figure.width
+    height = width
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    thickness = max(2, round(width / 125))
+    # ให้ตำแหน่งเส้นขยับเล็กน้อยตาม seed ภาพจะได้ไม่เหมือนกันทุกภาพ
+    rng = np.random.default_rng(figure.seed)
+    jitter = lambda : rng.uniform(-0.15, 0.15)
+
+    def point(x, y) :
+        return round(x), round(y)
+
+    def line(x1, y1, x2, y2) :
+        cv2.line(image, point(x1, y1), point(x2, y2), (0, 0, 0), thickness)
+
+    def fill(*corners) :
+        cv2.fillPoly(image, [np.array([point(x, y) for x, y in corners], dtype=np.int32)], FILL_COLOR)
+
+    if figure.shape == 'triangle' :
+        left, right, base_y = width * 0.125, width * 0.87, height * 0.82
+        apex_x, apex_y = width * 0.5, height * 0.176
+        fill((apex_x, apex_y), (left, base_y), (right, base_y))
+        line(left, base_y, right, base_y)
+        line(apex_x, apex_y, left, base_y)
+        line(apex_x, apex_y, right, base_y)
+        for i in range(1, figure.vertical + 1) :
+            x = left + (right - left) * (i + jitter()) / (figure.vertical + 1)
+            line(apex_x, apex_y, x, base_y)
+        for j in range(1, figure.horizontal) :
+            # แบ่งความสูงเท่า ๆ กัน ไม่ให้ชิดยอดเกินไป
+            t = 0.3 + 0.7 * (j + jitter()) / figure.horizontal
+            y = apex_y + (base_y - apex_y) * t
+            line(apex_x + (left - apex_x) * t, y, apex_x + (right - apex_x) * t, y)
+    elif figure.shape == 'rectangle' :
+        left, right, top, bottom = width * 0.124, width * 0.874, height * 0.246, height * 0.752
+        fill((left, top), (right, top), (right, bottom), (left, bottom))
+        for j in range(figure.horizontal) :
+            offset = jitter() if 0 < j < figure.horizontal - 1 else 0
+            y = top + (bottom - top) * (j + offset) / (figure.horizontal - 1)
+            line(left, y, right, y)
+        for i in range(figure.vertical) :
+            offset = jitter() if 0 < i < figure.vertical - 1 else 0
+            x = left + (right - left) * (i + offset) / (figure.vertical - 1)
+            line(x, top, x, bottom)
+    else :
+        raise ValueError(f'unknown shape {figure.shape!r}')
+
+    if figure.rotation :
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), figure.rotation, 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+    if figure.noise :
+        noisy = image.astype(np.float32) + rng.normal(0, figure.noise, image.shape).astype(np.float32)
+        image = np.clip(noisy, 0, 255).astype(np.uint8)
+    return image
+
+def render_figure(figure) :
+    # bytes ของไฟล์ภาพ (JPEG หรือ PNG ถ้า quality = 0) เหมือนไฟล์ที่ผู้ใช้อัปโหลด
+    image = draw_figure(figure)
+    if figure.quality :
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, figure.quality])
+    else :
+        ok, buffer = cv2.imencode('.png', image)
+    if not ok :
+        raise ValueError(f'cannot encode {figure.name}')
+    return buffer.tobytes()
+
+# จำนวนเส้น (แนวนอน, แนวตั้ง) ของแต่ละรูป เรียงจากน้อยไปมาก
+TRIANGLE_LINES = [(1, 1), (2, 2), (3, 3), (4, 5), (5, 7), (6, 9)]
+RECTANGLE_LINES = [(2, 3), (3, 4), (4, 5), (5, 7), (7, 9), (9, 12)]
+
+def sweep(rotations=(0, -6, 9), noises=(0, 12), widths=(640, 1280, 1600), seeds=(0,)) :
+    # รายการ Figure ทุกแบบที่ใช้ benchmark (ลำดับคงที่)
+    figures = []
+    for shape, counts in (('triangle', TRIANGLE_LINES), ('rectangle', RECTANGLE_LINES)) :
+        for horizontal, vertical in counts :
+            for rotation in rotations :
+                for noise in noises :
+                    for width in widths :
+                        for seed in seeds :
+                            figures.append(Figure(shape, horizontal, vertical, rotation, noise, width, seed=seed))
+    return figures
@@ -0,0 +1,247 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ขนาดโดยประมาณของข้อมูลอื่นในหนึ่ง entry นอกจากภาพ (ใช้คิดขนาดแคช)
+ENTRY_OVERHEAD = 512
+
+def content_key(data) :
+    return hashlib.sha256(data).hexdigest()
+
+def perceptual_hash(image, hash_size=8) :
+    # dHash: เทียบความสว่างของพิกเซลที่อยู่ติดกันในภาพย่อขนาด ได้ตัวเลข hash_size * hash_size บิต
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(a, b) :
+    return bin(a ^ b).count('1')
+
+def entry_size(entry) :
+    overlay = entry.get('overlay')
+    return ENTRY_OVERHEAD + (len(overlay) if overlay else 0)
+
+class ResultCache :
+    """
+    แคชผลลัพธ์ของ func1 โดยใช้ hash ของไฟล์ที่อัปโหลดเป็น key
+    - หน่วยความจำ: จำกัดขนาดเป็นไบต์ ลบรายการที่ไม่ได้ใช้นานที่สุดออกก่อน (LRU)
+    - perceptual hash (ถ้าเปิด): ใช้ผลของภาพที่เกือบเหมือนกันได้
+    - ดิสก์ (ถ้าตั้ง disk_dir): อยู่รอดหลังรีสตาร์ต และใช้ร่วมกันระหว่าง gunicorn worker ได้
+      เก็บในโฟลเดอร์ย่อยตาม version (fingerprint ของโมเดลและค่าตั้ง) ไฟล์ของ version เก่าไม่ถูกอ่านอีก
+      และถูกลบก่อนเมื่อขนาดรวมเกิน disk_max_bytes (ไม่มีใครแตะจึงเป็นไฟล์ที่ใช้ล่าสุดนานที่สุด)
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0, phash_distance=-1, version='') :
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.version = version
+        self.disk_max_bytes = disk_max_bytes
+        self.phash_distance = phash_distance
+
+        self._entries = OrderedDict()
+        self._phashes = OrderedDict()
+        self._bytes = 0
+        self._disk_puts = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits' : 0,
+            'disk_hits' : 0,
+            'misses' : 0,
+            'phash_hits' : 0,
+            'phash_misses' : 0,
+            'evictions' : 0,
+        }
+
+        if disk_dir and not os.path.exists(disk_dir) :
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def phash_enabled(self) :
+        return self.phash_distance >= 0
+
+    def get(self, key) :
+        with self._lock :
+            entry = self._entries.get(key)
+            if entry is not None :
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return entry
+
+        entry = self._disk_get(key)
+        with self._lock :
+            if entry is not None :
+                self._stats['disk_hits'] += 1
+                self._insert(key, entry)
+            else :
+                self._stats['misses'] += 1
+        return entry
+
+    def get_similar(self, phash) :
+        # ใช้หลัง get() ไม่เจอ: หาภาพในแคชที่ระยะ Hamming ของ hash ไม่เกิน phash_distance
+        key = None
+        with self._lock :
+            best = self.phash_distance + 1
+            for candidate, value in self._phashes.items() :
+                distance = hamming_distance(phash, value)
+                if distance < best :
+                    key, best = candidate, distance
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None :
+                self._entries.move_to_end(key)
+                self._stats['phash_hits'] += 1
+            else :
+                self._stats['phash_misses'] += 1
+        return entry
+
+    def put(self, key, entry, phash=None) :
+        with self._lock :
+            self._insert(key, entry)
+            if phash is not None and key in self._entries :
+                self._phashes[key] = phash
+        self._disk_put(key, entry)
+
+    def stats(self) :
+        with self._lock :
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['phash_hits']
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _insert(self, key, entry) :
+        size = entry_size(entry)
+        if size > self.max_bytes :
+            return
+        old = self._entries.pop(key, None)
+        if old is not None :
+            self._bytes -= entry_size(old)
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes :
+            old_key, old = self._entries.popitem(last=False)
+            self._phashes.pop(old_key, None)
+            self._bytes -= entry_size(old)
+            self._stats['evictions'] += 1
+
+    def _disk_path(self, key) :
+        return os.path.join(self.disk_dir, self.version, key[:2], key + '.bin')
+
+    def _disk_get(self, key) :
+        if not self.disk_dir :
+            return None
+        path = self._disk_path(key)
+        try :
+            with open(path, 'rb') as f :
+                data = f.read()
+            os.utime(path)
+        except OSError :
+            return None
+
+        # รูปแบบไฟล์: JSON หนึ่งบรรทัด ตามด้วยภาพ overlay (ถ้ามี)
+        header, _, overlay = data.partition(b'\n')
+        try :
+            entry = json.loads(header)
+        except ValueError :
+            return None
+        entry['overlay'] = overlay or None
+        return entry
+
+    def _disk_put(self, key, entry) :
+        if not self.disk_dir :
+            return
+        path = self._disk_path(key)
+        folder = os.path.dirname(path)
+        header = {k : v for k, v in entry.items() if k != 'overlay'}
+        try :
+            os.makedirs(folder, exist_ok=True)
+            # เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้ worker อื่นอ่านเจอไฟล์ที่เขียนไม่เสร็จ
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f :
+                f.write(json.dumps(header, separators=(',', ':')).encode('utf-8'))
+                f.write(b'\n')
+                f.write(entry.get('overlay') or b'')
+            os.replace(tmp_path, path)
+        except OSError :
+            return
+
+        self._disk_puts += 1
+        if self.disk_max_bytes and self._disk_puts % 64 == 0 :
+            self._disk_prune()
+
+    def _disk_prune(self) :
+        # ลบไฟล์ที่ถูกใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน disk_max_bytes
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir) :
+            for name in names :
+                if name.endswith('.tmp') :
+                    continue
+                path = os.path.join(root, name)
+                try :
+                    st = os.stat(path)
+                except OSError :
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        for _, size, path in files :
+            if total <= self.disk_max_bytes :
+                break
+            try :
+                os.remove(path)
+                total -= size
+            except OSError :
+                pass
+
+class PairCache :
+    """
+    LRU ของผลทำนายต่อคู่เส้น (key จาก LinePairMemo ใน app.py -> ผลของโมเดล) ใช้ร่วมกันทุกคำขอใน process
+    - max_entries: จำนวนคู่สูงสุด เกินแล้วลบคู่ที่ไม่ได้ใช้นานที่สุดออกก่อน (0 = ปิด, get คืน None เสมอ)
+    """
+
+    def __init__(self, max_entries) :
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits' : 0, 'misses' : 0, 'evictions' : 0}
+
+    def get(self, key) :
+        if not self.max_entries :
+            return None
+        with self._lock :
+            value = self._entries.get(key)
+            if value is None :
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value) :
+        if not self.max_entries :
+            return
+        with self._lock :
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries :
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self) :
+        with self._lock :
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
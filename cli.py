@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import multiprocessing
+
+import app
+
+"""
+ประมวลผลภาพจำนวนมากแบบ offline โดยไม่ผ่าน HTTP ใช้ทุก core ด้วย process pool
+ผลลัพธ์เขียนเป็น JSONL (หนึ่งบรรทัดต่อหนึ่งภาพ) ทันทีที่แต่ละภาพเสร็จ
+
+python cli.py INPUT [INPUT ...] [--out results.jsonl] [--workers N] [--overlays DIR] [--overlay-format png]
+              [--timeout SECONDS]
+
+- INPUT เป็นโฟลเดอร์ (ค้นทุกโฟลเดอร์ย่อย), glob (เช่น 'photos/**/*.jpg') หรือไฟล์
+- ถ้าไฟล์ --out มีอยู่แล้วจะข้ามภาพที่มีผลแล้ว (ทำต่อจากที่ค้างไว้) ใช้ --no-resume เพื่อเริ่มใหม่
+- --timeout จำกัดเวลาต่อภาพ (ค่าเริ่มต้น 0 = ไม่จำกัด ไม่ใช้ GIVEMATH_SCAN_TIMEOUT ของ server เพราะงาน offline
+  ไม่มีคำขออื่นรอ) ภาพที่หมดเวลาจะถูกประมวลผลใหม่เมื่อรันต่อ
+- --overlays เขียนภาพ overlay ลงโฟลเดอร์ โดยใช้ path เดียวกับภาพต้นฉบับ (นับจากโฟลเดอร์ร่วมของทุกภาพ)
+- สรุปจำนวนภาพ / วินาทีและเวลาต่อภาพทาง stderr เมื่อจบ
+"""
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+def find_images(inputs) :
+    paths = []
+    for pattern in inputs :
+        if os.path.isdir(pattern) :
+            for folder, dirs, names in os.walk(pattern) :
+                dirs.sort()
+                paths.extend(os.path.join(folder, name) for name in sorted(names)
+                             if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        elif os.path.isfile(pattern) :
+            paths.append(pattern)
+        else :
+            paths.extend(sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)))
+    # ตัดตัวซ้ำโดยคงลำดับเดิม
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+def load_done(out_path) :
+    # path ของภาพที่มีผลใน JSONL แล้ว ตัดบรรทัดสุดท้ายที่เขียนไม่เสร็จ (ถูกหยุดกลางคัน) ทิ้ง
+    # ภาพที่หมดเวลา (มี 'timeout') ไม่นับว่าเสร็จ จะได้ลองใหม่ เช่นด้วย --timeout ที่มากขึ้น
+    done = set()
+    if not os.path.exists(out_path) :
+        return done
+    with open(out_path, 'rb+') as f :
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data) :
+            f.truncate(end)
+    for line in data[:end].splitlines() :
+        try :
+            record = json.loads(line)
+            if 'timeout' not in record :
+                done.add(record['path'])
+        except (ValueError, KeyError, TypeError) :
+            continue
+    return done
+
+def init_worker(timeout) :
+    app.init_batch_worker()
+    app.app.config['SCAN_TIMEOUT'] = timeout
+
+def process_file(job) :
+    path, overlay_path, overlay_format = job
+    started = time.perf_counter()
+    try :
+        with open(path, 'rb') as f :
+            data = f.read()
+    except OSError as e :
+        return {'path' : path, 'image_type' : None, 'answer' : None, 'arr_info' : None,
+                'error' : f'read: {e}', 'seconds' : time.perf_counter() - started}
+
+    # ถอดรหัสและประมวลผลแบบเดียวกับ /upload (make_entry ครอบ scan เหมือน func1 แต่บอกสาเหตุเมื่อล้มเหลว)
+    # ถ้าไม่เขียน overlay ใช้โหมด geometry จึงไม่ต้องวาดและ encode ภาพ
+    # exception ที่หลุดออกมาต้องกลายเป็น record ของภาพนั้น ไม่งั้น imap_unordered จะโยนต่อและหยุดทั้งชุด
+    try :
+        entry = app.make_entry(app.decode_image(data), overlay_format if overlay_path else 'geometry')
+    except Exception as e :
+        return {'path' : path, 'image_type' : None, 'answer' : None, 'arr_info' : None,
+                'error' : f'scan: {type(e).__name__}: {e}', 'seconds' : time.perf_counter() - started}
+    record = {
+        'path' : path,
+        'image_type' : entry['image_type'],
+        'answer' : entry['answer'],
+        'arr_info' : entry['arr_info'],
+    }
+    if entry.get('error') :
+        record['error'] = entry['error']
+    if entry.get('timeout') :
+        record['timeout'] = entry['timeout']
+    if overlay_path and entry['overlay'] is not None :
+        # เขียน overlay ไม่ได้ (เช่น path ชนกับไฟล์ที่มีอยู่) ยังเก็บคำตอบไว้ แต่นับเป็นภาพที่ล้มเหลว
+        try :
+            os.makedirs(os.path.dirname(overlay_path) or '.', exist_ok=True)
+            with open(overlay_path, 'wb') as f :
+                f.write(entry['overlay'])
+            record['overlay'] = overlay_path
+        except OSError as e :
+            record['error'] = f'overlay: {e}'
+    record['seconds'] = time.perf_counter() - started
+    return record
+
+def percentile(values, q) :
+    if not values :
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description='Run func1 over a directory or glob of images and write JSONL results')
+    parser.add_argument('inputs', nargs='+', help='image files, directories (searched recursively) or glob patterns')
+    parser.add_argument('--out', default='results.jsonl', help='JSONL file to append results to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--overlays', help='directory to write overlay images to (default: do not write overlays)')
+    parser.add_argument('--overlay-format', default='png', choices=sorted(app.OVERLAY_FORMATS))
+    parser.add_argument('--timeout', type=float, default=0.0, help='seconds allowed per image (0 = no limit)')
+    parser.add_argument('--no-resume', action='store_true', help='overwrite --out instead of skipping images already in it')
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.inputs)
+    if not paths :
+        print('no images found', file=sys.stderr)
+        return 1
+
+    if args.no_resume and os.path.exists(args.out) :
+        os.remove(args.out)
+    done = load_done(args.out)
+    todo = [path for path in paths if path not in done]
+
+    root = os.path.commonpath([os.path.abspath(os.path.dirname(path)) for path in paths])
+    ext = app.OVERLAY_FORMATS[args.overlay_format][0]
+    jobs = []
+    for path in todo :
+        overlay_path = None
+        if args.overlays :
+            relative = os.path.relpath(os.path.abspath(path), root)
+            overlay_path = os.path.join(args.overlays, os.path.splitext(relative)[0] + ext)
+        jobs.append((path, overlay_path, args.overlay_format))
+
+    print(f'{len(paths)} images, {len(paths) - len(todo)} already in {args.out}, {len(todo)} to process '
+          f'with {args.workers} workers', file=sys.stderr)
+
+    started = time.perf_counter()
+    seconds = []
+    failed = 0
+    interrupted = False
+    # ใช้ spawn เหมือน /upload/batch แต่ละ process โหลดโมเดลครั้งเดียวตอน import app
+    pool = multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=(args.timeout,))
+    try :
+        with open(args.out, 'a', encoding='utf-8') as out :
+            for record in pool.imap_unordered(process_file, jobs, chunksize=4) :
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                # flush ทุกบรรทัด ถ้าถูกหยุดกลางคันจะทำต่อได้โดยไม่เสียผลที่ได้แล้ว
+                out.flush()
+                seconds.append(record['seconds'])
+                failed += 'error' in record
+        pool.close()
+    except KeyboardInterrupt :
+        interrupted = True
+        pool.terminate()
+    except BaseException :
+        # ต้อง terminate ก่อน join ไม่งั้น join จะโยน 'Pool is still running' ทับ exception จริง
+        pool.terminate()
+        raise
+    finally :
+        pool.join()
+
+    elapsed = time.perf_counter() - started
+    rate = len(seconds) / elapsed if elapsed > 0 else 0.0
+    print(f'{"interrupted after" if interrupted else "processed"} {len(seconds)} images in {elapsed:.1f}s '
+          f'({rate:.1f} images/s), {failed} failed', file=sys.stderr)
+    if seconds :
+        print(f'per image: mean {sum(seconds) / len(seconds) * 1000:.1f} ms, '
+              f'p50 {percentile(seconds, 0.5) * 1000:.1f} ms, p95 {percentile(seconds, 0.95) * 1000:.1f} ms, '
+              f'max {max(seconds) * 1000:.1f} ms', file=sys.stderr)
+    return 130 if interrupted else 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
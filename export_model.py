@@ -0,0 +1,118 @@
+import os
+import sys
+import argparse
+
+import joblib
+import numpy as np
+
+from npmodel import NumpyModel
+
+"""
+แปลง scaler1.pkl + model1.pkl เป็นไฟล์ .npz สำหรับ npmodel.NumpyModel
+
+รองรับ RandomForestClassifier (model1 ที่ใช้อยู่), ExtraTreesClassifier และ DecisionTreeClassifier
+ตรวจว่าผลทำนายตรงกับ scikit-learn ทุกตัวก่อนเขียนไฟล์ ถ้าไม่ตรงจะไม่เขียน
+(tests/test_npmodel.py ตรวจแบบเดียวกันด้วย pytest)
+
+python export_model.py [--scaler scaler1.pkl] [--model model1.pkl] [--out model1.npz]
+"""
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def scaler_params(scaler) :
+    mean = scaler.mean_ if getattr(scaler, 'with_mean', True) and scaler.mean_ is not None else np.empty(0)
+    scale = scaler.scale_ if getattr(scaler, 'with_std', True) and scaler.scale_ is not None else np.empty(0)
+    return np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64)
+
+def export_forest(model, mean, scale) :
+    # ต่อทุก tree เป็น array เดียว โดยเลื่อน index ของ node ลูกตามตำแหน่งเริ่มของแต่ละ tree
+    estimators = getattr(model, 'estimators_', [model])
+    single = not hasattr(model, 'estimators_')
+    n_classes = len(model.classes_)
+    roots, features, thresholds, lefts, rights, values = [], [], [], [], [], []
+    offset = 0
+    for estimator in estimators :
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.intp)
+        right = tree.children_right.astype(np.intp)
+        value = tree.value[:, 0, :n_classes].astype(np.float64)
+        if not single :
+            # RandomForest เฉลี่ย predict_proba ของแต่ละ tree ซึ่ง normalize แล้ว
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+        roots.append(offset)
+        features.append(np.maximum(tree.feature, 0).astype(np.intp))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(left == -1, -1, left + offset))
+        rights.append(np.where(right == -1, -1, right + offset))
+        values.append(value)
+        offset += tree.node_count
+    return {
+        'kind' : np.array('forest'),
+        'roots' : np.array(roots, dtype=np.intp),
+        'feature' : np.concatenate(features),
+        'threshold' : np.concatenate(thresholds),
+        'children_left' : np.concatenate(lefts),
+        'children_right' : np.concatenate(rights),
+        'value' : np.concatenate(values),
+        'mean' : mean,
+        'scale' : scale,
+    }
+
+def export(scaler, model) :
+    from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+    from sklearn.tree import DecisionTreeClassifier
+
+    if not isinstance(model, (DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier)) :
+        raise ValueError(f'unsupported model type {type(model).__name__}; keep using model1.pkl')
+    mean, scale = scaler_params(scaler)
+    params = export_forest(model, mean, scale)
+
+    params['classes'] = np.asarray(model.classes_)
+    return params
+
+def sample_features(scaler, n, seed=0) :
+    # สุ่ม feature รอบ ๆ การกระจายที่ scaler เห็นตอน train
+    mean, scale = scaler_params(scaler)
+    rng = np.random.default_rng(seed)
+    mean = mean if mean.size else np.zeros(scaler.n_features_in_)
+    scale = scale if scale.size else np.ones(scaler.n_features_in_)
+    X = mean + scale * rng.standard_normal((n, len(mean))) * 2
+    # พิกัดของเส้นเป็นจำนวนเต็มเหมือนข้อมูลจริง
+    X[:, :8] = np.round(X[:, :8])
+    return X
+
+def check(scaler, model, params, X) :
+    expected = model.predict(scaler.transform(X))
+    predicted = NumpyModel(params).predict(X)
+    return int(np.sum(expected != predicted))
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description='Export scaler1/model1 to NumPy parameter arrays')
+    parser.add_argument('--scaler', default=os.path.join(BASE_DIR, 'scaler1.pkl'))
+    parser.add_argument('--model', default=os.path.join(BASE_DIR, 'model1.pkl'))
+    parser.add_argument('--out', default=os.path.join(BASE_DIR, 'model1.npz'))
+    parser.add_argument('--samples', type=int, default=200000, help='number of random feature rows for the equivalence check')
+    parser.add_argument('--features', help='optional .npy file of real feature rows to check as well')
+    args = parser.parse_args(argv)
+
+    scaler = joblib.load(args.scaler)
+    model = joblib.load(args.model)
+
+    X = sample_features(scaler, args.samples)
+    if args.features :
+        X = np.vstack([X, np.load(args.features)])
+
+    params = export(scaler, model)
+    mismatches = check(scaler, model, params, X)
+    if mismatches :
+        print(f'export differs from scikit-learn on {mismatches} of {len(X)} rows, not writing {args.out}', file=sys.stderr)
+        return 1
+
+    np.savez(args.out, **params)
+    print(f'{type(model).__name__} -> {args.out} ({params["kind"]}), identical on {len(X)} rows')
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import gc
+import os
+import multiprocessing
+
+"""
+gunicorn -c gunicorn.conf.py app:app
+
+- preload_app: โหลด OpenCV และโมเดลครั้งเดียวใน master แล้วให้ worker ใช้ร่วมกันแบบ copy-on-write
+- gc.freeze() ก่อน fork: ไม่ให้ GC ของ worker ไปแตะ object ที่โหลดไว้ (หน้าหน่วยความจำจะได้ไม่ถูกคัดลอก)
+- warm-up ใน worker แต่ละตัวก่อนเริ่มรับคำขอ (ไม่ทำใน master เพราะ OpenCV จะสร้างเธรดก่อน fork)
+- โหมดสแกนสด (/live) ถือเธรดไว้ตลอดการเชื่อมต่อ เปิดเมื่อ GIVEMATH_THREADS มากกว่า 1 (worker เป็น gthread)
+  แต่ละ worker รับได้ GIVEMATH_THREADS - 1 การเชื่อมต่อ ดู LIVE_MAX_SESSIONS ใน app.py
+- /upload/batch: ทุก worker สร้างพูล process ของตัวเอง (GIVEMATH_BATCH_WORKERS) ค่าเริ่มต้นคือ
+  จำนวน core // GIVEMATH_WORKERS (อย่างน้อย 1) ทั้งระบบจึงมีไม่เกินประมาณจำนวน core ถ้าตั้งเองให้
+  workers x GIVEMATH_BATCH_WORKERS ไม่เกินจำนวน core
+"""
+
+bind = os.environ.get('GIVEMATH_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GIVEMATH_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GIVEMATH_THREADS', 1))
+timeout = int(os.environ.get('GIVEMATH_TIMEOUT', 60))
+preload_app = os.environ.get('GIVEMATH_PRELOAD', '1') == '1'
+
+def when_ready(server) :
+    if preload_app :
+        import app
+        server.log.info('app preloaded in %.3fs (models in %.3fs)', app.startup['import_seconds'], app.startup['model_seconds'])
+
+def pre_fork(server, worker) :
+    gc.freeze()
+
+def child_exit(server, worker) :
+    # ค่าสถิติของ worker ที่จบแล้วรวมเข้า dead.json ไม่ทิ้งไฟล์ของทุก pid ไว้ใน GIVEMATH_METRICS_DIR
+    import metrics
+    metrics.registry.mark_process_dead(worker.pid)
+
+def post_worker_init(worker) :
+    import app
+    if os.environ.get('GIVEMATH_WARMUP', '1') != '1' :
+        return
+    startup = app.warm_up()
+    timings = ', '.join(f"{name} cold {t['cold_seconds']:.3f}s warm {t['warm_seconds']:.3f}s"
+                        for name, t in startup['warmup'].items())
+    worker.log.info('worker %s warmed up in %.3fs (%s)', worker.pid, startup['warmup_seconds'], timings)
@@ -0,0 +1,201 @@
+import os
+import json
+import math
+import time
+import uuid
+import queue
+import tempfile
+import threading
+
+class QueueFull(Exception) :
+    def __init__(self, retry_after) :
+        super().__init__(f'job queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+class JobQueue :
+    """
+    คิวงานแบบ asynchronous ภายใน process: submit() คืน job id ทันที แล้ว worker thread
+    จำนวนจำกัดจะเรียก handler(payload, progress) ทีละงาน
+    - depth: จำนวนงานที่รอในคิวได้สูงสุด ถ้าเต็มจะ raise QueueFull
+    - state_dir (ถ้าตั้ง): เขียนสถานะงานเป็นไฟล์ JSON ให้ gunicorn worker อื่นตอบสถานะได้
+    """
+
+    def __init__(self, handler, workers=2, depth=16, ttl=600, state_dir=None) :
+        self.handler = handler
+        self.workers = workers
+        self.depth = depth
+        self.ttl = ttl
+        self.state_dir = state_dir
+
+        self._queue = queue.Queue(maxsize=depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._submitted = 0
+        self._started = 0
+        # ค่าเฉลี่ยเคลื่อนที่ของเวลาที่ใช้ต่องาน ใช้ประมาณ Retry-After
+        self._avg_seconds = 1.0
+
+        if state_dir and not os.path.exists(state_dir) :
+            os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, payload) :
+        self._start_workers()
+        self._expire()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id' : job_id,
+            'status' : 'queued',
+            'stage' : 'queued',
+            'created' : time.time(),
+        }
+        # เขียนสถานะก่อนเข้าคิว worker จะได้ไม่ถูกสถานะ queued เขียนทับทีหลัง
+        self._save(job)
+        with self._lock :
+            job['seq'] = self._submitted
+            try :
+                self._queue.put_nowait((job_id, payload))
+            except queue.Full :
+                job = None
+            else :
+                self._submitted += 1
+                self._jobs[job_id] = job
+        if job is None :
+            self._remove(job_id)
+            raise QueueFull(self.retry_after())
+        return job_id
+
+    def get(self, job_id) :
+        with self._lock :
+            job = self._jobs.get(job_id)
+            if job is not None :
+                job = dict(job)
+                if job['status'] == 'queued' :
+                    job['queue_position'] = job['seq'] - self._started
+        if job is None :
+            job = self._load(job_id)
+        if job is not None :
+            job.pop('seq', None)
+        return job
+
+    def retry_after(self) :
+        waiting = self._queue.qsize() + self.workers
+        return max(1, min(60, math.ceil(self._avg_seconds * waiting / self.workers)))
+
+    def stats(self) :
+        with self._lock :
+            counts = {}
+            for job in self._jobs.values() :
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'workers' : self.workers,
+            'depth' : self.depth,
+            'queued' : self._queue.qsize(),
+            'jobs' : counts,
+            'avg_seconds' : self._avg_seconds,
+        }
+
+    def _start_workers(self) :
+        # สร้างเธรดตอนมีงานแรก ไม่ใช่ตอน import (กัน fork ของ gunicorn ติดเธรดไปด้วย)
+        with self._lock :
+            if self._threads :
+                return
+            for i in range(self.workers) :
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) :
+        while True :
+            job_id, payload = self._queue.get()
+            self._update(job_id, status='running', stage='running', started=time.time())
+            with self._lock :
+                self._started += 1
+
+            def progress(stage, job_id=job_id) :
+                self._update(job_id, stage=stage)
+
+            start = time.perf_counter()
+            try :
+                result = self.handler(payload, progress)
+            except Exception as e :
+                self._update(job_id, status='failed', stage='failed', error=f'{type(e).__name__}: {e}', finished=time.time())
+            else :
+                self._update(job_id, status='done', stage='done', result=result, finished=time.time())
+            finally :
+                elapsed = time.perf_counter() - start
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+                del payload
+                self._queue.task_done()
+
+    def _update(self, job_id, **fields) :
+        with self._lock :
+            job = self._jobs.get(job_id)
+            if job is None :
+                return
+            job.update(fields)
+            job = dict(job)
+        self._save(job)
+
+    def _expire(self) :
+        now = time.time()
+        with self._lock :
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.get('finished') and now - job['finished'] > self.ttl]
+            for job_id in expired :
+                del self._jobs[job_id]
+        for job_id in expired :
+            self._remove(job_id)
+
+        # ไฟล์สถานะของ worker อื่นที่หยุดไปแล้ว ลบเมื่อไม่ถูกแก้ไขนานเกิน ttl
+        if self.state_dir and self._submitted % 100 == 0 :
+            for name in os.listdir(self.state_dir) :
+                path = os.path.join(self.state_dir, name)
+                try :
+                    if now - os.path.getmtime(path) > self.ttl :
+                        os.remove(path)
+                except OSError :
+                    pass
+
+    def _state_path(self, job_id) :
+        return os.path.join(self.state_dir, job_id + '.json')
+
+    def _save(self, job) :
+        if not self.state_dir :
+            return
+        record = {k : v for k, v in job.items() if k != 'seq'}
+        tmp_path = None
+        try :
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f :
+                json.dump(record, f)
+            os.replace(tmp_path, self._state_path(job['job_id']))
+        except (OSError, TypeError, ValueError) :
+            # เขียนไม่ได้หรือผลลัพธ์แปลงเป็น JSON ไม่ได้: สถานะยังอยู่ในหน่วยความจำ แค่ worker อื่นมองไม่เห็น
+            # ต้องไม่โยนต่อ ไม่งั้นเธรด worker ของคิวจะตาย
+            if tmp_path is not None :
+                try :
+                    os.remove(tmp_path)
+                except OSError :
+                    pass
+
+    def _load(self, job_id) :
+        if not self.state_dir or not all(c in '0123456789abcdef' for c in job_id) :
+            return None
+        try :
+            with open(self._state_path(job_id)) as f :
+                job = json.load(f)
+        except (OSError, ValueError) :
+            return None
+        if job.get('finished') and time.time() - job['finished'] > self.ttl :
+            return None
+        return job
+
+    def _remove(self, job_id) :
+        if not self.state_dir :
+            return
+        try :
+            os.remove(self._state_path(job_id))
+        except OSError :
+            pass
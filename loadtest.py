@@ -0,0 +1,342 @@
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import random
+import signal
+import socket
+import argparse
+import itertools
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+load test ของ /upload: เปิด gunicorn (gunicorn.conf.py) ตามจำนวน worker / thread / เธรดของ OpenCV ที่กำหนด
+แล้วส่งภาพจาก corpus ซ้ำ ๆ รายงาน throughput, latency p50/p95/p99, อัตรา error และ RSS ของแต่ละ worker
+
+python loadtest.py [IMAGES ...] --workers 1,2,4 --threads 1 --cv-threads default,1 --concurrency 8 --duration 20
+python loadtest.py --rate 30 --duration 30             # ส่งตามอัตราคงที่ (คำขอ / วินาที) แทนจำนวนคำขอพร้อมกัน
+python loadtest.py --url http://host:5000 --pid 1234   # ทดสอบ server ที่รันอยู่แล้ว (--pid = gunicorn master ถ้าต้องการ RSS)
+
+- ใส่หลายค่าคั่นด้วยจุลภาคเพื่อทดสอบทุกชุดค่าผสม (แต่ละชุดเปิด gunicorn ใหม่)
+- cv-threads 'default' = ไม่ตั้ง GIVEMATH_CV_THREADS (OpenCV ใช้ทุก core ในทุก worker)
+- server ที่เปิดเองจะปิดแคชผลลัพธ์ และภาพที่ส่งจะต่อท้ายด้วย bytes สุ่ม (ถอดรหัสได้เหมือนเดิม)
+  ทุกคำขอจึงประมวลผลจริง ไม่ได้คำตอบจากแคช (ปิดด้วย --allow-cache)
+- RSS อ่านจาก /proc (Linux)
+"""
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+def load_corpus(inputs) :
+    paths = []
+    for pattern in inputs or [os.path.join(BASE_DIR, 'static', 'example_*.jpg')] :
+        if os.path.isdir(pattern) :
+            for folder, _, names in os.walk(pattern) :
+                paths.extend(os.path.join(folder, name) for name in sorted(names)
+                             if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        else :
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    corpus = []
+    for path in paths :
+        with open(path, 'rb') as f :
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+def multipart(filename, data, fields) :
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items() :
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+    parts.append(data)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class Client :
+    def __init__(self, url, corpus, overlay, bust_cache, timeout) :
+        self.url = url.rstrip('/') + '/upload'
+        self.corpus = corpus
+        self.overlay = overlay
+        self.bust_cache = bust_cache
+        self.timeout = timeout
+        self._counter = itertools.count()
+
+    def send(self) :
+        # คืน (สำเร็จไหม, สถานะ HTTP หรือชื่อ exception)
+        filename, data = self.corpus[next(self._counter) % len(self.corpus)]
+        if self.bust_cache :
+            # ต่อท้ายไฟล์ (หลัง marker จบภาพ) ตัวถอดรหัสไม่อ่าน แต่ hash ของไฟล์เปลี่ยน
+            data = data + os.urandom(16)
+        body, content_type = multipart(filename, data, {'overlay' : self.overlay})
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type' : content_type})
+        try :
+            with urllib.request.urlopen(request, timeout=self.timeout) as response :
+                result = json.loads(response.read())
+            return response.status == 200 and not result.get('error'), response.status
+        except urllib.error.HTTPError as e :
+            return False, e.code
+        except Exception as e :
+            return False, type(e).__name__
+
+def run_closed(client, concurrency, duration) :
+    # concurrency เธรด ส่งคำขอถัดไปทันทีเมื่อได้คำตอบ
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop() :
+        while time.perf_counter() < deadline :
+            started = time.perf_counter()
+            ok, status = client.send()
+            with lock :
+                results.append((time.perf_counter() - started, ok, status))
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    for thread in threads :
+        thread.start()
+    for thread in threads :
+        thread.join()
+    return results
+
+def run_open(client, rate, duration, poisson, max_inflight) :
+    # ส่งคำขอตามเวลาที่กำหนดไว้ล่วงหน้าไม่ว่าคำขอก่อนหน้าจะเสร็จหรือยัง
+    # latency นับจากเวลาที่ควรส่ง (รวมเวลาที่ต้องรอในฝั่ง client ถ้า server ตามไม่ทัน)
+    results = []
+    lock = threading.Lock()
+
+    def one(scheduled) :
+        ok, status = client.send()
+        with lock :
+            results.append((time.perf_counter() - scheduled, ok, status))
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    scheduled = start
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor :
+        while scheduled < start + duration :
+            delay = scheduled - time.perf_counter()
+            if delay > 0 :
+                time.sleep(delay)
+            executor.submit(one, scheduled)
+            scheduled += rng.expovariate(rate) if poisson else 1 / rate
+    return results
+
+def child_pids(pid) :
+    children = []
+    for name in os.listdir('/proc') :
+        if not name.isdigit() :
+            continue
+        try :
+            with open(f'/proc/{name}/stat') as f :
+                # ชื่อ process อยู่ในวงเล็บและอาจมีช่องว่าง ค่า ppid อยู่ถัดจากสถานะ
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == pid :
+                children.append(int(name))
+        except (OSError, IndexError, ValueError) :
+            continue
+    return sorted(children)
+
+def rss_bytes(pid) :
+    try :
+        with open(f'/proc/{pid}/status') as f :
+            for line in f :
+                if line.startswith('VmRSS:') :
+                    return int(line.split()[1]) * 1024
+    except OSError :
+        pass
+    return 0
+
+class RssSampler :
+    # อ่าน RSS ของ gunicorn worker (ลูกของ master) เป็นระยะ เก็บค่าสูงสุดและค่าล่าสุดของแต่ละ pid
+    def __init__(self, master_pid, interval=0.5) :
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) :
+        if self.master_pid :
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) :
+        self._stop.set()
+        if self._thread.is_alive() :
+            self._thread.join()
+        return False
+
+    def _run(self) :
+        while True :
+            self.sample()
+            if self._stop.wait(self.interval) :
+                break
+
+    def sample(self) :
+        for pid in child_pids(self.master_pid) :
+            rss = rss_bytes(pid)
+            if rss :
+                self.last[pid] = rss
+                self.peak[pid] = max(self.peak.get(pid, 0), rss)
+
+def free_port() :
+    with socket.socket() as s :
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workers, threads, cv_threads, allow_cache, log) :
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'GIVEMATH_BIND' : f'127.0.0.1:{port}',
+        'GIVEMATH_WORKERS' : str(workers),
+        'GIVEMATH_THREADS' : str(threads),
+    })
+    env.pop('GIVEMATH_CV_THREADS', None)
+    if cv_threads != 'default' :
+        env['GIVEMATH_CV_THREADS'] = str(cv_threads)
+    if not allow_cache :
+        env['GIVEMATH_CACHE_MAX_BYTES'] = '0'
+        env.pop('GIVEMATH_CACHE_DIR', None)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               cwd=BASE_DIR, env=env, stdout=log, stderr=log)
+    url = f'http://127.0.0.1:{port}'
+    # worker รับคำขอหลัง warm-up เสร็จ /ready ตอบ 200 แปลว่ามี worker พร้อมแล้วอย่างน้อยหนึ่งตัว
+    # worker ทุกตัว warm-up พร้อมกัน จึงรออีกประมาณสองเท่าของเวลา warm-up ให้ตัวอื่นเสร็จด้วย
+    deadline = time.time() + 120
+    while time.time() < deadline :
+        if process.poll() is not None :
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try :
+            with urllib.request.urlopen(url + '/ready', timeout=5) as response :
+                startup = json.loads(response.read())
+            time.sleep(max(1.0, 2 * (startup.get('warmup_seconds') or 0)))
+            return process, url
+        except (urllib.error.URLError, OSError, ValueError) :
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError('gunicorn did not become ready')
+
+def stop_server(process) :
+    process.send_signal(signal.SIGTERM)
+    try :
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired :
+        process.kill()
+        process.wait()
+
+def percentile(values, q) :
+    if not values :
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def report(config, results, duration, sampler) :
+    latencies = [seconds for seconds, _, _ in results]
+    errors = [status for _, ok, status in results if not ok]
+    row = dict(config)
+    row.update({
+        'requests' : len(results),
+        'errors' : len(errors),
+        'error_rate' : len(errors) / len(results) if results else 0.0,
+        'error_statuses' : {str(s) : errors.count(s) for s in set(errors)},
+        'throughput' : (len(results) - len(errors)) / duration,
+        'p50_ms' : percentile(latencies, 0.50) * 1000,
+        'p95_ms' : percentile(latencies, 0.95) * 1000,
+        'p99_ms' : percentile(latencies, 0.99) * 1000,
+        'max_ms' : max(latencies) * 1000 if latencies else float('nan'),
+        'worker_rss_mb' : [round(sampler.last[pid] / 2 ** 20, 1) for pid in sorted(sampler.last)],
+        'worker_peak_rss_mb' : [round(sampler.peak[pid] / 2 ** 20, 1) for pid in sorted(sampler.peak)],
+    })
+    return row
+
+def print_row(row) :
+    rss = '/'.join(f'{mb:.0f}' for mb in row['worker_peak_rss_mb']) or '-'
+    print(f'{row["workers"]:>7} {row["threads"]:>7} {row["cv_threads"]:>10} {row["requests"]:>8} {row["error_rate"]:>6.1%} '
+          f'{row["throughput"]:>8.1f} {row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f}  {rss}', flush=True)
+
+def int_list(value) :
+    return [int(v) for v in value.split(',')]
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description='Load-test /upload under gunicorn')
+    parser.add_argument('images', nargs='*', help='image files, directories or globs (default: static/example_*.jpg)')
+    parser.add_argument('--url', help='test an already running server instead of starting gunicorn')
+    parser.add_argument('--pid', type=int, help='gunicorn master pid of --url, to sample worker RSS')
+    parser.add_argument('--workers', type=int_list, default=[os.cpu_count() or 1], help='comma separated list')
+    parser.add_argument('--threads', type=int_list, default=[1], help='gunicorn threads per worker, comma separated list')
+    parser.add_argument('--cv-threads', default='default', help="GIVEMATH_CV_THREADS values, comma separated ('default' = unset)")
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight (closed loop)')
+    parser.add_argument('--rate', type=float, help='requests per second (open loop), overrides --concurrency')
+    parser.add_argument('--poisson', action='store_true', help='exponential inter-arrival times with --rate')
+    parser.add_argument('--max-inflight', type=int, default=256, help='client threads for --rate')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load per configuration')
+    parser.add_argument('--overlay', default='png', help='overlay format requested from /upload')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-request timeout in seconds')
+    parser.add_argument('--allow-cache', action='store_true', help='send identical bytes and keep the result cache on')
+    parser.add_argument('--log', default=os.devnull, help='file for gunicorn output')
+    parser.add_argument('--json', help='write all result rows to this JSON file')
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.images)
+    if not corpus :
+        print('no images found', file=sys.stderr)
+        return 1
+
+    if args.url :
+        configs = [{'workers' : '-', 'threads' : '-', 'cv_threads' : '-'}]
+    else :
+        cv_threads = [v if v == 'default' else int(v) for v in args.cv_threads.split(',')]
+        configs = [{'workers' : w, 'threads' : t, 'cv_threads' : c}
+                   for w, t, c in itertools.product(args.workers, args.threads, cv_threads)]
+
+    mode = f'{args.rate:g} req/s{" (poisson)" if args.poisson else ""}' if args.rate else f'concurrency {args.concurrency}'
+    print(f'{len(corpus)} images, {mode}, {args.duration:g}s per configuration, {os.cpu_count()} cpus', flush=True)
+    print(f'{"workers":>7} {"threads":>7} {"cv_threads":>10} {"requests":>8} {"errors":>6} '
+          f'{"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}  peak RSS MB per worker', flush=True)
+
+    rows = []
+    with open(args.log, 'ab') as log :
+        for config in configs :
+            process = None
+            url, master_pid = args.url, args.pid
+            try :
+                if not args.url :
+                    process, url = start_server(config['workers'], config['threads'], config['cv_threads'], args.allow_cache, log)
+                    master_pid = process.pid
+                client = Client(url, corpus, args.overlay, not args.allow_cache, args.timeout)
+                with RssSampler(master_pid) as sampler :
+                    started = time.perf_counter()
+                    if args.rate :
+                        results = run_open(client, args.rate, args.duration, args.poisson, args.max_inflight)
+                    else :
+                        results = run_closed(client, args.concurrency, args.duration)
+                    elapsed = time.perf_counter() - started
+                    if master_pid :
+                        sampler.sample()
+            except RuntimeError as e :
+                print(f'{config}: {e}', file=sys.stderr)
+                continue
+            finally :
+                if process is not None :
+                    stop_server(process)
+            row = report(config, results, elapsed, sampler)
+            row['mode'] = mode
+            rows.append(row)
+            print_row(row)
+
+    if args.json :
+        with open(args.json, 'w') as f :
+            json.dump(rows, f, indent=1)
+    return 0
+
+if __name__ == '__main__' :
+    sys.exit(main())
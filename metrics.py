@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import contextvars
+
+"""
+ตัวเก็บสถิติแบบ Prometheus อย่างง่าย (counter / histogram) และตัวจับเวลาแต่ละขั้นตอนของ func1
+
+การจับเวลา: สร้าง Trace ครอบการประมวลผลหนึ่งภาพ แล้วเรียก stage('ชื่อขั้นตอน') ตอนเริ่มแต่ละขั้นตอน
+เวลาจะนับให้ขั้นตอนล่าสุดจนกว่าจะเริ่มขั้นตอนใหม่หรือออกจาก Trace
+ถ้าไม่มี Trace อยู่ stage() / count() จะไม่ทำอะไร
+
+ถ้าตั้ง GIVEMATH_METRICS_DIR แต่ละ process จะเขียนค่าของตัวเองลงโฟลเดอร์นั้น (<pid>.json)
+และ /metrics จะรวมค่าจากทุก gunicorn worker เมื่อ worker จบ gunicorn.conf.py จะรวมค่าของมันเข้า
+dead.json แล้วลบไฟล์ของ pid นั้น (ดู Registry.mark_process_dead)
+"""
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-2, 11))
+
+_current_trace = contextvars.ContextVar('givemath_trace', default=None)
+
+class Trace :
+    def __init__(self) :
+        self.stages = {}
+        self.counts = {}
+        self.failed_stage = None
+        self.elapsed = 0.0
+        self._current = None
+        self._stage_started = None
+        self._entered = None
+        self._token = None
+
+    def __enter__(self) :
+        self._token = _current_trace.set(self)
+        self._entered = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) :
+        now = time.perf_counter()
+        if exc_type is not None and self.failed_stage is None :
+            self.failed_stage = self._current or 'unknown'
+        self._close(now)
+        self.elapsed += now - self._entered
+        _current_trace.reset(self._token)
+        self._token = None
+        return False
+
+    def stage(self, name) :
+        now = time.perf_counter()
+        self._close(now)
+        self._current = name
+        self._stage_started = now
+
+    def _close(self, now) :
+        if self._current is not None :
+            self.stages[self._current] = self.stages.get(self._current, 0.0) + now - self._stage_started
+        self._current = None
+
+    def __getstate__(self) :
+        # ส่งข้าม process ได้ (ใช้ใน process pool)
+        state = dict(self.__dict__)
+        state['_token'] = None
+        return state
+
+def stage(name) :
+    trace = _current_trace.get()
+    if trace is not None :
+        trace.stage(name)
+
+def current_stage() :
+    trace = _current_trace.get()
+    return trace._current if trace is not None else None
+
+def count(name, amount=1) :
+    trace = _current_trace.get()
+    if trace is not None :
+        trace.counts[name] = trace.counts.get(name, 0) + amount
+
+def fail(default_stage) :
+    # บันทึกว่าล้มเหลวที่ขั้นตอนไหน (ใช้เมื่อจับ exception เองโดยไม่ปล่อยออกจาก Trace)
+    trace = _current_trace.get()
+    if trace is not None and trace.failed_stage is None :
+        trace.failed_stage = trace._current or default_stage
+
+def format_labels(labelnames, values, extra=()) :
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs :
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def format_value(value) :
+    if value == float('inf') :
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter :
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labelnames=()) :
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels) :
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock :
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) :
+        with self._lock :
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(a, b) :
+        return a + b
+
+    def lines(self, values) :
+        for key, value in sorted(values.items()) :
+            yield f'{self.name}_total{format_labels(self.labelnames, key)} {format_value(value)}'
+
+class Histogram :
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=SECONDS_BUCKETS) :
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels) :
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock :
+            state = self._values.get(key)
+            if state is None :
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets) :
+                if value <= bound :
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self) :
+        with self._lock :
+            return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]
+
+    @staticmethod
+    def merge(a, b) :
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def lines(self, values) :
+        for key, (bucket_counts, total, n) in sorted(values.items()) :
+            cumulative = 0
+            for bound, c in zip(self.buckets, bucket_counts) :
+                cumulative += c
+                yield f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", format_value(float(bound)))])} {cumulative}'
+            yield f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", "+Inf")])} {n}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labelnames, key)} {n}'
+
+class Gauge :
+    # ค่าที่อ่านจากฟังก์ชันตอน render (เฉพาะ process ที่ตอบ /metrics ไม่รวมข้าม worker)
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, function, labelnames=()) :
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        registry.register(self, local=True)
+
+    def lines(self) :
+        values = self.function()
+        if not isinstance(values, dict) :
+            values = {() : values}
+        for key, value in sorted(values.items()) :
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+
+# ไฟล์ที่เก็บค่ารวมของ process ที่จบไปแล้ว
+DEAD_SNAPSHOT = 'dead.json'
+
+def read_snapshot(path) :
+    try :
+        with open(path) as f :
+            return json.load(f)
+    except (OSError, ValueError) :
+        return None
+
+class Registry :
+    def __init__(self, directory=None, flush_interval=1.0) :
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._local = []
+        self._last_flush = 0.0
+        if directory and not os.path.exists(directory) :
+            os.makedirs(directory, exist_ok=True)
+
+    def register(self, metric, local=False) :
+        (self._local if local else self._metrics).append(metric)
+
+    def snapshot(self) :
+        return {metric.name : metric.snapshot() for metric in self._metrics}
+
+    def flush(self, force=False) :
+        if not self.directory :
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval :
+            return
+        self._last_flush = now
+        try :
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f :
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, os.path.join(self.directory, f'{os.getpid()}.json'))
+        except OSError :
+            pass
+
+    def mark_process_dead(self, pid) :
+        # รวมค่าของ process ที่จบแล้วเข้า dead.json แล้วลบ <pid>.json ทิ้ง counter / histogram จึงไม่ลดลง
+        # และโฟลเดอร์ไม่โตขึ้นทุกครั้งที่ worker ถูกสร้างใหม่ เรียกจาก process เดียว (gunicorn master)
+        if not self.directory :
+            return
+        path = os.path.join(self.directory, f'{pid}.json')
+        snapshot = read_snapshot(path)
+        if snapshot is not None :
+            archive_path = os.path.join(self.directory, DEAD_SNAPSHOT)
+            merged = self._merge([read_snapshot(archive_path) or {}, snapshot])
+            archive = {name : [[list(key), value] for key, value in values.items()] for name, values in merged.items()}
+            try :
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f :
+                    json.dump(archive, f)
+                os.replace(tmp_path, archive_path)
+            except OSError :
+                return
+        try :
+            os.remove(path)
+        except OSError :
+            pass
+
+    def _collect(self) :
+        snapshots = [self.snapshot()]
+        if self.directory :
+            self.flush(force=True)
+            snapshots = []
+            for name in os.listdir(self.directory) :
+                if not name.endswith('.json') :
+                    continue
+                snapshot = read_snapshot(os.path.join(self.directory, name))
+                if snapshot is not None :
+                    snapshots.append(snapshot)
+        return self._merge(snapshots)
+
+    def _merge(self, snapshots) :
+        merged = {metric.name : {} for metric in self._metrics}
+        by_name = {metric.name : metric for metric in self._metrics}
+        for snapshot in snapshots :
+            for name, values in snapshot.items() :
+                metric = by_name.get(name)
+                if metric is None :
+                    continue
+                for key, value in values :
+                    key = tuple(key)
+                    current = merged[name].get(key)
+                    merged[name][key] = value if current is None else metric.merge(current, value)
+        return merged
+
+    def render(self) :
+        merged = self._collect()
+        out = []
+        for metric in self._metrics :
+            out.append(f'# HELP {metric.name} {metric.help}')
+            out.append(f'# TYPE {metric.name} {metric.kind}')
+            out.extend(metric.lines(merged[metric.name]))
+        for metric in self._local :
+            out.append(f'# HELP {metric.name} {metric.help}')
+            out.append(f'# TYPE {metric.name} {metric.kind}')
+            out.extend(metric.lines())
+        return '\n'.join(out) + '\n'
+
+registry = Registry(os.environ.get('GIVEMATH_METRICS_DIR') or None)
+
+requests_total = Counter(registry, 'givemath_http_requests', 'HTTP requests by endpoint and status code', ['endpoint', 'status'])
+request_seconds = Histogram(registry, 'givemath_http_request_seconds', 'HTTP request latency by endpoint', ['endpoint'])
+scans_total = Counter(registry, 'givemath_scans', 'Images run through the func1 pipeline by result', ['result'])
+scan_failures_total = Counter(registry, 'givemath_scan_failures', 'Failed scans by the stage that failed', ['stage'])
+scan_timeouts_total = Counter(registry, 'givemath_scan_timeouts', 'Scans stopped by GIVEMATH_SCAN_TIMEOUT by the stage they reached', ['stage'])
+scan_seconds = Histogram(registry, 'givemath_scan_seconds', 'End-to-end time to process one image')
+stage_seconds = Histogram(registry, 'givemath_stage_seconds', 'Time spent in each pipeline stage per image', ['stage'])
+model_calls = Histogram(registry, 'givemath_model_calls_per_scan', 'Line-pair classifier predict calls per image', buckets=COUNT_BUCKETS)
+model_pairs = Histogram(registry, 'givemath_model_pairs_per_scan', 'Line pairs scored by the classifier per image', buckets=COUNT_BUCKETS)
+pair_memo_lookups = Counter(registry, 'givemath_pair_memo_lookups', 'Line-pair predictions looked up in funcTriangles by outcome (hit, shared_hit from other requests, miss = model call)', ['outcome'])
+hough_lines = Histogram(registry, 'givemath_hough_lines_detected', 'Segments returned by HoughLinesP per image', buckets=COUNT_BUCKETS)
+hough_lines_dropped = Counter(registry, 'givemath_hough_lines_dropped', 'Shortest Hough segments discarded by GIVEMATH_MAX_HOUGH_LINES')
+lines_kept = Histogram(registry, 'givemath_hough_lines_kept', 'Hough segments kept after de-duplication and classification per image', buckets=COUNT_BUCKETS)
+gc_collections = Counter(registry, 'givemath_gc_collections', 'Full garbage collections forced after a request because RSS grew past GIVEMATH_GC_RSS_THRESHOLD')
+gc_seconds = Histogram(registry, 'givemath_gc_seconds', 'Time spent in forced garbage collections')
+live_frames = Counter(registry, 'givemath_live_frames', 'Live scanner frames by outcome (tracked, dropped as stale, or fully scanned)', ['outcome'])
+live_sessions_rejected = Counter(registry, 'givemath_live_sessions_rejected', 'Live scanner connections closed because GIVEMATH_LIVE_MAX_SESSIONS were already open')
+live_frame_seconds = Histogram(registry, 'givemath_live_frame_seconds', 'Time to process one live scanner frame')
+request_peak_bytes = Histogram(registry, 'givemath_request_peak_bytes', 'Peak memory traced by tracemalloc during a request (GIVEMATH_TRACEMALLOC=1)', ['endpoint'], buckets=BYTES_BUCKETS)
+
+def observe_scan(trace) :
+    failed = trace.failed_stage is not None
+    scans_total.inc(result='failed' if failed else 'ok')
+    if failed :
+        scan_failures_total.inc(stage=trace.failed_stage)
+        if trace.counts.get('timeouts') :
+            scan_timeouts_total.inc(stage=trace.failed_stage)
+    scan_seconds.observe(trace.elapsed)
+    for name, seconds in trace.stages.items() :
+        stage_seconds.observe(seconds, stage=name)
+    model_calls.observe(trace.counts.get('model_calls', 0))
+    model_pairs.observe(trace.counts.get('model_pairs', 0))
+    for outcome, name in (('hit', 'memo_hits'), ('shared_hit', 'memo_shared_hits'), ('miss', 'memo_misses')) :
+        if trace.counts.get(name) :
+            pair_memo_lookups.inc(trace.counts[name], outcome=outcome)
+    if trace.counts.get('hough_lines_dropped') :
+        hough_lines_dropped.inc(trace.counts['hough_lines_dropped'])
+    if 'hough_lines' in trace.counts :
+        hough_lines.observe(trace.counts['hough_lines'])
+        lines_kept.observe(trace.counts.get('lines_kept', 0))
+    registry.flush()
+
+def observe_request(endpoint, status, seconds) :
+    requests_total.inc(endpoint=endpoint, status=status)
+    request_seconds.observe(seconds, endpoint=endpoint)
+    registry.flush()
+
+def observe_live_frame(seconds, dropped, scanned) :
+    live_frames.inc(outcome='scanned' if scanned else 'tracked')
+    if dropped :
+        live_frames.inc(dropped, outcome='dropped')
+    live_frame_seconds.observe(seconds)
+    registry.flush()
@@ -0,0 +1,64 @@
+import numpy as np
+
+"""
+ตัวทำนายที่ใช้ NumPy อย่างเดียว อ่านพารามิเตอร์จากไฟล์ .npz ที่สร้างด้วย export_model.py
+ไม่ต้อง import scikit-learn ตอนรันจริง
+
+รองรับ kind เดียวคือ forest (DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier)
+mean / scale คือพารามิเตอร์ของ StandardScaler (ว่าง = ไม่ได้ใช้ขั้นนั้น)
+"""
+
+class NumpyModel :
+    def __init__(self, params) :
+        self.kind = str(params['kind'])
+        self.classes = params['classes']
+        self.mean = params['mean'] if params['mean'].size else None
+        self.scale = params['scale'] if params['scale'].size else None
+        self.params = params
+
+    @classmethod
+    def load(cls, path) :
+        with np.load(path, allow_pickle=False) as data :
+            return cls({key : data[key] for key in data.files})
+
+    def predict(self, X) :
+        X = np.asarray(X, dtype=np.float64)
+        # ลำดับการคำนวณเหมือน StandardScaler.transform (ลบ mean แล้วหาร scale)
+        if self.mean is not None :
+            X = X - self.mean
+        if self.scale is not None :
+            X = X / self.scale
+
+        if self.kind == 'forest' :
+            return self._predict_forest(X)
+        raise ValueError(f'unknown model kind {self.kind!r}')
+
+    def _predict_forest(self, X) :
+        # sklearn เทียบค่าใน tree เป็น float32
+        X = X.astype(np.float32)
+        p = self.params
+        # เดินทุก tree พร้อมกัน node มีรูป (n_trees, n_samples)
+        node = np.repeat(p['roots'][:, None], len(X), axis=1)
+        cols = np.broadcast_to(np.arange(len(X)), node.shape)
+        while True :
+            left = p['children_left'][node]
+            leaf = left == -1
+            if leaf.all() :
+                break
+            go_left = X[cols, p['feature'][node]] <= p['threshold'][node]
+            node = np.where(leaf, node, np.where(go_left, left, p['children_right'][node]))
+        # รวมความน่าจะเป็นทีละ tree ตามลำดับเดียวกับ sklearn แล้วเฉลี่ย
+        proba = np.zeros((len(X), p['value'].shape[1]))
+        for leaves in node :
+            proba += p['value'][leaves]
+        proba /= len(node)
+        return self.classes[np.argmax(proba, axis=1)]
+
+class SklearnModel :
+    # ใช้ scaler1.pkl / model1.pkl เดิมผ่าน scikit-learn เมื่อยังไม่ได้ export เป็น .npz
+    def __init__(self, scaler, model) :
+        self.scaler = scaler
+        self.model = model
+
+    def predict(self, X) :
+        return self.model.predict(self.scaler.transform(X))
@@ -45,6 +45,137 @@ function setupDropDown(){
     dropdownButton.addEventListener('click', useDropDown);
 }
 
+// func1 ย่อภาพให้กว้าง 500px อยู่แล้ว จึงย่อภาพให้ด้านที่สั้นกว่าเหลือ 500px ก่อนอัปโหลด
+const UPLOAD_MIN_SIDE = 500;
+
+async function downscaleImage(file, minSide = UPLOAD_MIN_SIDE){
+    // ถ้าเบราว์เซอร์ไม่รองรับหรือภาพเล็กอยู่แล้ว ส่งไฟล์เดิม
+    if(!window.createImageBitmap || !file.type.startsWith('image/')) return file;
+
+    let bitmap = null;
+    try{
+        // หมุนภาพตาม EXIF ก่อนวาด ภาพที่ส่งไปจึงตั้งตรงแล้ว
+        bitmap = await createImageBitmap(file, {imageOrientation: 'from-image'});
+    }
+    catch{
+        return file;
+    }
+
+    const scale = minSide / Math.min(bitmap.width, bitmap.height);
+    if(scale >= 1){
+        bitmap.close();
+        return file;
+    }
+
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(bitmap.width * scale);
+    canvas.height = Math.round(bitmap.height * scale);
+    const context = canvas.getContext('2d');
+    context.imageSmoothingQuality = 'high';
+    context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.92));
+    return blob || file;
+}
+
+// ขอผลเป็นพิกัดเส้น (overlay=geometry) แล้ววาดภาพผลลัพธ์เองบน canvas
+// server ไม่ต้องสร้างและ encode ภาพ และไม่ต้องโหลดภาพผลลัพธ์อีกรอบ
+const OVERLAY_MODE = window.createImageBitmap ? 'geometry' : 'png';
+
+async function drawGeometry(image, geometry){
+    // วาดส่วนของภาพที่ server ตัดและหมุนแล้ว จากนั้นวาดเส้นที่นับได้ทับ (สีเดียวกับภาพที่ server วาด)
+    const bitmap = await createImageBitmap(image, {imageOrientation: 'from-image'});
+    const canvas = document.createElement('canvas');
+    canvas.width = geometry.width;
+    canvas.height = geometry.height;
+    const context = canvas.getContext('2d');
+    context.fillStyle = 'white';
+    context.fillRect(0, 0, canvas.width, canvas.height);
+
+    // transform รับพิกัดแบบ normalize (0..1) ของภาพ จึงหารด้วยขนาดภาพก่อน
+    const [[a, b, c], [d, e, f]] = geometry.transform;
+    context.setTransform(a / bitmap.width, d / bitmap.width, b / bitmap.height, e / bitmap.height, c, f);
+    context.imageSmoothingQuality = 'high';
+    context.drawImage(bitmap, 0, 0);
+    context.setTransform(1, 0, 0, 1, 0, 0);
+    bitmap.close();
+
+    function drawLines(lines, color){
+        context.strokeStyle = color;
+        context.lineWidth = 2;
+        context.beginPath();
+        // พิกัดเส้นเป็นพิกเซล ลากผ่านกึ่งกลางพิกเซล
+        for(const [x1, y1, x2, y2] of lines){
+            context.moveTo(x1 + 0.5, y1 + 0.5);
+            context.lineTo(x2 + 0.5, y2 + 0.5);
+        }
+        context.stroke();
+    }
+    drawLines(geometry.horizontal_lines, 'red');
+    drawLines(geometry.dividing_lines || geometry.vertical_lines, 'blue');
+    return canvas;
+}
+
+function showResultImage(container, element){
+    element.style.width = '300px';
+    element.style.height = '300px';
+    container.innerHTML = '';
+    container.appendChild(element);
+}
+
+function renderExplanation(data, textResult, textExplain){
+    const resultTemplate = "คำตอบ คือ {{answer}} รูป<br><br>";
+    const explanationTemplateTri = `เมื่อเลือกเส้นแนวนอนเส้นที่ {{i}} และเลือกเส้นด้านประกอบมุมยอด 2 เส้น จากทั้งหมด {{x}} เส้น สร้างได้ \\( \\Large \\binom{{x}}{2} \\) = {{y}}  รูป<br><br>`;
+    const explanationTemplateRec = `เมื่อเลือกเส้นแนวนอนเส้นที่ {{i}} สร้างได้ <br> {{subtemplate}} = {{sum}} รูป`;
+    const explanationTemplateRec2 = `\\( \\Large \\binom{{x}}{2} \\) `;
+    function renderTemplate(template, values){
+        return template.replace(/{{(.*?)}}/g, (match, key) => values[key.trim()] ?? '');
+    }
+
+    let resultHTML = '';
+    let explanationHTML = '';
+
+    resultHTML += renderTemplate(resultTemplate, {answer: data.answer});
+
+    if(data.image_type === 'triangle'){
+        explanationHTML += 'พิจารณาเส้นแนวนอนจากเส้นล่างสุดขึ้นไปยังเส้นบนสุด<br><br>';
+        data.arr_info.forEach((x, index) => {
+            const i = index + 1;
+            const y = x * (x-1) / 2;
+            explanationHTML += renderTemplate(explanationTemplateTri, { i, x, y });
+        })
+    }
+    else if(data.image_type === 'rectangle'){
+        explanationHTML += 'พิจารณาเส้นแนวนอนจากเส้นล่างสุดขึ้นไปยังเส้นบนสุด<br><br>'
+        
+        for(let i=0; i<data.arr_info.length; i++){
+            let sum = 0;
+            let explanationTemp = '';
+
+            for(let j=i+1; j<data.arr_info.length; j++){
+                const x = Math.min(data.arr_info[i], data.arr_info[j]);
+                sum += x * (x-1) / 2;
+                explanationTemp += renderTemplate(explanationTemplateRec2, { x });
+                if(j != data.arr_info.length - 1) explanationTemp += '+ ';
+            }
+            explanationHTML += renderTemplate(explanationTemplateRec, { i: i+1, subtemplate: explanationTemp, sum });
+            if(i != 0) explanationHTML += ' (ไม่นับรูปซ้ำ)<br><br>';
+            else explanationHTML += '<br><br>'
+        }
+    }
+
+    textResult.innerHTML = resultHTML;
+    textExplain.innerHTML = explanationHTML;
+
+    textResult.style.color = 'black';
+    textExplain.style.color = 'black'; 
+
+    if(window.MathJax){
+        MathJax.typeset();
+    }
+}
+
 function setupInput(){
     const buttonCamera = document.getElementById('button-camera');
     const realCamera = document.getElementById('real-camera');
@@ -109,8 +240,10 @@ function setupInput(){
         }
 
         if(file){
+            const upload = await downscaleImage(file);
             const formData = new FormData();
-            formData.append('image', file);
+            formData.append('image', upload, file.name);
+            formData.append('overlay', OVERLAY_MODE);
             try{
                 const response = await fetch('/upload', {
                     method: 'POST',
@@ -119,63 +252,15 @@ function setupInput(){
                 const data = await response.json();
 
                 if(!data.image_type) throw new Error();
-                const img = document.createElement('img');
-                img.src = data.ret_image_url;
-                img.style.width = '300px';
-                img.style.height = '300px';
-                
-                uploadcontainer.innerHTML = '';
-                uploadcontainer.appendChild(img);
-
-                const resultTemplate = "คำตอบ คือ {{answer}} รูป<br><br>";
-                const explanationTemplateTri = `เมื่อเลือกเส้นแนวนอนเส้นที่ {{i}} และเลือกเส้นด้านประกอบมุมยอด 2 เส้น จากทั้งหมด {{x}} เส้น สร้างได้ \\( \\Large \\binom{{x}}{2} \\) = {{y}}  รูป<br><br>`;
-                const explanationTemplateRec = `เมื่อเลือกเส้นแนวนอนเส้นที่ {{i}} สร้างได้ <br> {{subtemplate}} = {{sum}} รูป`;
-                const explanationTemplateRec2 = `\\( \\Large \\binom{{x}}{2} \\) `;
-                function renderTemplate(template, values){
-                    return template.replace(/{{(.*?)}}/g, (match, key) => values[key.trim()] ?? '');
-                }
-
-                let resultHTML = '';
-                let explanationHTML = '';
-
-                resultHTML += renderTemplate(resultTemplate, {answer: data.answer});
-
-                if(data.image_type === 'triangle'){
-                    explanationHTML += 'พิจารณาเส้นแนวนอนจากเส้นล่างสุดขึ้นไปยังเส้นบนสุด<br><br>';
-                    data.arr_info.forEach((x, index) => {
-                        const i = index + 1;
-                        const y = x * (x-1) / 2;
-                        explanationHTML += renderTemplate(explanationTemplateTri, { i, x, y });
-                    })
+                if(data.geometry){
+                    showResultImage(uploadcontainer, await drawGeometry(upload, data.geometry));
                 }
-                else if(data.image_type === 'rectangle'){
-                    explanationHTML += 'พิจารณาเส้นแนวนอนจากเส้นล่างสุดขึ้นไปยังเส้นบนสุด<br><br>'
-                    
-                    for(let i=0; i<data.arr_info.length; i++){
-                        let sum = 0;
-                        let explanationTemp = '';
-
-                        for(let j=i+1; j<data.arr_info.length; j++){
-                            const x = Math.min(data.arr_info[i], data.arr_info[j]);
-                            sum += x * (x-1) / 2;
-                            explanationTemp += renderTemplate(explanationTemplateRec2, { x });
-                            if(j != data.arr_info.length - 1) explanationTemp += '+ ';
-                        }
-                        explanationHTML += renderTemplate(explanationTemplateRec, { i: i+1, subtemplate: explanationTemp, sum });
-                        if(i != 0) explanationHTML += ' (ไม่นับรูปซ้ำ)<br><br>';
-                        else explanationHTML += '<br><br>'
-                    }
-                }
-
-                textResult.innerHTML = resultHTML;
-                textExplain.innerHTML = explanationHTML;
-
-                textResult.style.color = 'black';
-                textExplain.style.color = 'black'; 
-
-                if(window.MathJax){
-                    MathJax.typeset();
+                else{
+                    const img = document.createElement('img');
+                    img.src = data.ret_image_url;
+                    showResultImage(uploadcontainer, img);
                 }
+                renderExplanation(data, textResult, textExplain);
             }
             catch{
                 textResult.innerHTML = 'ไม่สามารถหาคำตอบได้'
@@ -188,6 +273,122 @@ function setupInput(){
     });
 }
 
+// โหมดสแกนสด: ส่งภาพจากกล้องย่อกว้าง 500px (ขนาดที่ func1 ใช้) ไปที่ /live ทีละเฟรม
+// ส่งเฟรมถัดไปเมื่อได้คำตอบของเฟรมก่อนแล้วเท่านั้น จึงไม่มีเฟรมค้างที่ server
+const LIVE_FRAME_WIDTH = 500;
+
+function setupLive(){
+    const buttonLive = document.getElementById('button-live');
+    const uploadcontainer = document.getElementById('upload-container');
+    const textResult = document.getElementById('text-result');
+    const textExplain = document.getElementById('text-explain');
+
+    if(!buttonLive || !uploadcontainer || !textResult || !textExplain) return;
+    if(!navigator.mediaDevices || !window.WebSocket || !window.createImageBitmap){
+        buttonLive.style.display = 'none';
+        return;
+    }
+
+    let session = null;
+
+    function stop(){
+        if(!session) return;
+        session.running = false;
+        session.stream.getTracks().forEach(track => track.stop());
+        session.socket.close();
+        session = null;
+        buttonLive.textContent = 'สแกนสด';
+    }
+
+    async function start(){
+        let stream = null;
+        try{
+            stream = await navigator.mediaDevices.getUserMedia({video: {facingMode: 'environment'}, audio: false});
+        }
+        catch{
+            textResult.innerHTML = 'ไม่สามารถเปิดกล้องได้';
+            textResult.style.color = 'red';
+            return;
+        }
+
+        const video = document.createElement('video');
+        video.muted = true;
+        video.playsInline = true;
+        video.srcObject = stream;
+        await video.play();
+
+        const preview = document.createElement('canvas');
+        preview.width = video.videoWidth;
+        preview.height = video.videoHeight;
+        showResultImage(uploadcontainer, preview);
+
+        const frame = document.createElement('canvas');
+        frame.width = LIVE_FRAME_WIDTH;
+        frame.height = Math.round(LIVE_FRAME_WIDTH * video.videoHeight / video.videoWidth);
+
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${location.host}/live`);
+        // blob = เฟรมล่าสุดที่ส่งไป ผลลัพธ์ที่ได้กลับมาเป็นของเฟรมนี้
+        const current = session = {running: true, stream, socket, blob: null};
+        buttonLive.textContent = 'หยุด';
+        textResult.innerHTML = 'เล็งกล้องไปที่โจทย์ให้เห็นทั้งรูป แล้วถือนิ่ง ๆ';
+        textResult.style.color = 'black';
+        textExplain.innerHTML = '';
+
+        async function sendFrame(){
+            frame.getContext('2d').drawImage(video, 0, 0, frame.width, frame.height);
+            current.blob = await new Promise(resolve => frame.toBlob(resolve, 'image/jpeg', 0.8));
+            if(current.running && current.blob) socket.send(current.blob);
+        }
+
+        function drawPreview(data){
+            // ภาพจากกล้องกับกรอบของรูปที่ server ติดตามอยู่ (สีเขียวเมื่อนิ่งแล้ว)
+            const context = preview.getContext('2d');
+            context.drawImage(video, 0, 0, preview.width, preview.height);
+            if(!data.corners) return;
+            context.strokeStyle = data.status === 'stable' ? 'lime' : 'orange';
+            context.lineWidth = 4;
+            context.beginPath();
+            data.corners.forEach(([x, y], index) => {
+                if(index === 0) context.moveTo(x * preview.width, y * preview.height);
+                else context.lineTo(x * preview.width, y * preview.height);
+            });
+            context.closePath();
+            context.stroke();
+        }
+
+        socket.addEventListener('open', sendFrame);
+        socket.addEventListener('message', async event => {
+            if(!current.running) return;
+            const data = JSON.parse(event.data);
+            drawPreview(data);
+
+            // server ลองใหม่เองถ้านับไม่สำเร็จ จึงส่งเฟรมต่อไปจนกว่าจะได้คำตอบ
+            if(data.result && data.result.image_type){
+                const blob = current.blob;
+                stop();
+                showResultImage(uploadcontainer, await drawGeometry(blob, data.result.geometry));
+                renderExplanation(data.result, textResult, textExplain);
+                return;
+            }
+            sendFrame();
+        });
+        socket.addEventListener('close', event => {
+            if(session === current) stop();
+            if(event.code === 1013){
+                // server รับการเชื่อมต่อสแกนสดเต็มแล้ว
+                textResult.innerHTML = 'ตอนนี้ใช้งานสแกนสดเต็มแล้ว ลองใหม่ภายหลัง หรืออัปโหลดภาพแทน';
+                textResult.style.color = 'red';
+            }
+        });
+    }
+
+    buttonLive.addEventListener('click', () => {
+        if(session) stop();
+        else start();
+    });
+}
+
 function renderMarkdown(id, markdown){
     const obj = document.getElementById(id);
     if(!obj) return Promise.resolve();
@@ -271,6 +472,7 @@ document.addEventListener('DOMContentLoaded', () => {
     setupSideMenu();
     setupDropDown();
     setupInput();
+    setupLive();
 
     renderMarkdown('paragraph', topicMarkdown);
     renderMarkdown('triangle-text', exampleMarkdown);
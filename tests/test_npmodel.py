@@ -0,0 +1,97 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path :
+    sys.path.insert(0, BASE_DIR)
+
+pytest.importorskip('sklearn')
+joblib = pytest.importorskip('joblib')
+
+from export_model import export, sample_features
+from npmodel import NumpyModel
+
+"""
+NumpyModel (model1.npz) ต้องทำนายตรงกับ scaler1 + model1 ของ scikit-learn ทุกแถว
+ทดสอบกับโมเดลที่ train ในเทสต์เอง (รันได้เสมอ) และกับ scaler1.pkl / model1.pkl ถ้ามีไฟล์
+"""
+
+N_FEATURES = 13
+
+def edge_rows(scaler, model) :
+    # แถวที่ feature เท่ากับ threshold ของ node พอดี (หลังผ่าน scaler) ค่าศูนย์ ค่าลบ และค่าใหญ่มาก
+    # (slope ของเส้นแนวตั้งใน line_pair_features เป็น 1e6)
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(N_FEATURES)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(N_FEATURES)
+    estimators = getattr(model, 'estimators_', [model])
+    rows = []
+    rng = np.random.default_rng(1)
+    for estimator in estimators[:10] :
+        tree = estimator.tree_
+        for node in np.flatnonzero(tree.children_left != -1)[:50] :
+            row = rng.standard_normal(N_FEATURES)
+            row[tree.feature[node]] = tree.threshold[node]
+            rows.append(row * scale + mean)
+    rows = np.array(rows)
+    extremes = np.array([
+        np.zeros(N_FEATURES),
+        np.full(N_FEATURES, -1.0),
+        np.full(N_FEATURES, 1e6),
+        np.full(N_FEATURES, -1e6),
+        mean,
+    ])
+    return np.vstack([rows, extremes])
+
+def assert_equivalent(scaler, model, X) :
+    expected = model.predict(scaler.transform(X))
+    predicted = NumpyModel(export(scaler, model)).predict(X)
+    mismatches = np.flatnonzero(expected != predicted)
+    assert mismatches.size == 0, f'{mismatches.size} of {len(X)} rows differ, first at row {mismatches[0]}'
+
+@pytest.fixture(scope='module')
+def trained() :
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((2000, N_FEATURES)) * 50
+    X[:, :8] = np.round(X[:, :8])
+    y = ((X[:, 8] > 0) ^ (X[:, 11] < 10)).astype(int)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0).fit(scaler.transform(X), y)
+    return scaler, model
+
+@pytest.fixture(scope='module')
+def shipped() :
+    scaler_path = os.path.join(BASE_DIR, 'scaler1.pkl')
+    model_path = os.path.join(BASE_DIR, 'model1.pkl')
+    if not os.path.exists(scaler_path) or not os.path.exists(model_path) :
+        pytest.skip('scaler1.pkl / model1.pkl not available')
+    return joblib.load(scaler_path), joblib.load(model_path)
+
+def test_trained_forest_random_rows(trained) :
+    scaler, model = trained
+    assert_equivalent(scaler, model, sample_features(scaler, 20000))
+
+def test_trained_forest_edge_rows(trained) :
+    scaler, model = trained
+    assert_equivalent(scaler, model, edge_rows(scaler, model))
+
+def test_shipped_model_random_rows(shipped) :
+    scaler, model = shipped
+    assert_equivalent(scaler, model, sample_features(scaler, 20000))
+
+def test_shipped_model_edge_rows(shipped) :
+    scaler, model = shipped
+    assert_equivalent(scaler, model, edge_rows(scaler, model))
+
+def test_unsupported_model_is_rejected(trained) :
+    from sklearn.naive_bayes import GaussianNB
+
+    scaler, _ = trained
+    model = GaussianNB().fit(np.eye(N_FEATURES), np.arange(N_FEATURES) % 2)
+    with pytest.raises(ValueError) :
+        export(scaler, model)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path :
+    sys.path.insert(0, BASE_DIR)
+
+from warp import rotate_window, rotation_matrix
+
+"""
+rotate_window สร้าง map แบบ fixed-point เองตามที่ cv2.warpAffine ทำภายใน (ดู warp_affine_maps)
+ถ้า OpenCV เวอร์ชันใหม่เปลี่ยนวิธีนี้ ผลจะต่างจากการตัดภาพที่หมุนทั้งภาพโดยไม่มี error อื่นเตือน
+เทสต์นี้จึงเทียบทั้งสองแบบทีละพิกเซล (requirements.txt ล็อก opencv-python ไว้ที่เวอร์ชันที่ตรวจแล้ว)
+"""
+
+@pytest.mark.parametrize('angle', [-12.0, -5.0, -0.4, 0.0, 3.0, 8.0, 33.0])
+def test_rotate_window_matches_full_warp(angle) :
+    rng = np.random.default_rng(int(angle * 10) % 1000)
+    image = rng.integers(0, 256, (375, 500, 3), dtype=np.uint8)
+    radians = np.radians(angle)
+    line = (100, 200, 100 + round(300 * np.cos(radians)), 200 + round(300 * np.sin(radians)))
+    matrix, size = rotation_matrix(image.shape, line)
+    full = cv2.warpAffine(image, matrix, size, borderValue=(255, 255, 255))
+
+    for left, top, right, bottom in [(0, 0, size[0], size[1]), (37, 21, 301, 250), (size[0] - 90, size[1] - 60, size[0], size[1])] :
+        window = rotate_window(image, matrix, left, top, right, bottom)
+        assert np.array_equal(window, full[top:bottom, left:right])
@@ -0,0 +1,94 @@
+import math
+import threading
+
+import cv2
+import numpy as np
+
+"""
+หมุนภาพด้วย cv2.warpAffine เฉพาะหน้าต่างที่ต้องใช้ และบัฟเฟอร์ปลายทางของ OpenCV ที่ใช้ซ้ำในแต่ละเธรด
+แยกจาก app.py (ไม่โหลดโมเดล) เพื่อให้ tests/test_rotate_window.py รันได้เสมอ
+"""
+
+class ScratchBuffers(threading.local) :
+    # บัฟเฟอร์ปลายทาง (dst) ของ OpenCV ที่ใช้ซ้ำในแต่ละเธรด เก็บเป็น array 1 มิติแล้วคืนส่วนต้นในรูป shape ที่ขอ
+    # (ต่อเนื่องในหน่วยความจำ OpenCV จึงเขียนลงไปตรง ๆ) จองใหม่เฉพาะเมื่อภาพใหญ่กว่าที่เคยจองไว้
+    def get(self, name, shape, dtype=np.uint8) :
+        size = int(np.prod(shape))
+        buffer = self.__dict__.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype :
+            buffer = np.empty(size, dtype=dtype)
+            setattr(self, name, buffer)
+        return buffer[:size].reshape(shape)
+
+    def trim(self, max_bytes) :
+        # คืนบัฟเฟอร์ที่ใหญ่กว่า max_bytes (ครั้งต่อไปจะจองใหม่ตามขนาดที่ขอ) 0 = เก็บไว้ทั้งหมด
+        if max_bytes :
+            for name, buffer in list(self.__dict__.items()) :
+                if buffer.nbytes > max_bytes :
+                    del self.__dict__[name]
+
+scratch = ScratchBuffers()
+
+def rotation_matrix(shape, line) :
+    # matrix ที่ rotate_image (app.py) ใช้ หมุนรอบจุดกลางภาพแล้วขยายกรอบไม่ให้ภาพขาด คืน (matrix, (กว้าง, สูง))
+    x1, y1, x2, y2 = line
+    angle_rad = math.atan2(y2 - y1, x2 - x1)
+    angle_deg = math.degrees(angle_rad)
+    
+    height, width = shape[:2]
+    center = (width // 2, height // 2)
+    
+    rotation_matrix = cv2.getRotationMatrix2D(center, angle_deg, 1.0)
+    
+    cos = abs(rotation_matrix[0, 0])
+    sin = abs(rotation_matrix[0, 1])
+    new_width = int((height * sin) + (width * cos))
+    new_height = int((height * cos) + (width * sin))
+    
+    rotation_matrix[0, 2] += (new_width / 2) - center[0]
+    rotation_matrix[1, 2] += (new_height / 2) - center[1]
+    
+    return rotation_matrix, (new_width, new_height)
+
+def warp_affine_maps(matrix, left, top, right, bottom) :
+    # map แบบ fixed-point ที่ cv2.warpAffine (INTER_LINEAR) สร้างเองก่อนเรียก remap แต่คิดเฉพาะพิกเซล
+    # [top:bottom, left:right] ของภาพผลลัพธ์ ถ้าเลื่อน matrix แล้ว warp ตรง ๆ การปัดเศษจะต่างไปบางพิกเซล
+    m = matrix.reshape(-1).astype(np.float64)
+    d = m[0] * m[4] - m[1] * m[3]
+    d = 1.0 / d if d != 0 else 0.0
+    a11, a12, a21, a22 = m[4] * d, -m[1] * d, -m[3] * d, m[0] * d
+    b1 = -a11 * m[2] - a12 * m[5]
+    b2 = -a21 * m[2] - a22 * m[5]
+
+    # AB_SCALE = 1024, INTER_BITS = 5, round_delta = 16
+    xs = np.arange(left, right, dtype=np.float64)
+    ys = np.arange(top, bottom, dtype=np.float64)
+    X = (np.rint((a12 * ys + b1) * 1024) + 16).astype(np.int32)[:, None] + np.rint(a11 * xs * 1024).astype(np.int32)
+    Y = (np.rint((a22 * ys + b2) * 1024) + 16).astype(np.int32)[:, None] + np.rint(a21 * xs * 1024).astype(np.int32)
+    X >>= 5
+    Y >>= 5
+    alpha = Y & 31
+    alpha <<= 5
+    alpha |= X & 31
+    X >>= 5
+    Y >>= 5
+
+    xy = np.empty(X.shape + (2,), dtype=np.int16)
+    xy[..., 0] = np.clip(X, -32768, 32767, out=X)
+    xy[..., 1] = np.clip(Y, -32768, 32767, out=Y)
+    return xy, alpha.astype(np.uint16)
+
+def rotate_window(image, matrix, left, top, right, bottom, name=None) :
+    # ส่วน [top:bottom, left:right] ของ cv2.warpAffine(image, matrix, ...) โดย warp เฉพาะส่วนนั้น
+    # ถ้าระบุ name จะเขียนผลลงบัฟเฟอร์ของเธรด (ดู ScratchBuffers)
+    rows, cols = max(bottom - top, 0), max(right - left, 0)
+    if rows == 0 or cols == 0 :
+        return np.empty((rows, cols) + image.shape[2:], dtype=image.dtype)
+    xy, alpha = warp_affine_maps(matrix, left, top, right, bottom)
+    dst = scratch.get(name, (rows, cols) + image.shape[2:], image.dtype) if name else None
+    return cv2.remap(image, xy, alpha, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+
+def warp_rotated(image, matrix, size) :
+    # cv2.warpAffine ทั้งภาพลงบัฟเฟอร์ของเธรด
+    dst = scratch.get('rotated', (size[1], size[0]) + image.shape[2:], image.dtype)
+    return cv2.warpAffine(image, matrix, size, dst=dst, borderValue=(255, 255, 255))